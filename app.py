@@ -9,20 +9,32 @@ Como rodar:
   python -m pip install -r requirements.txt
   python -m streamlit run app.py
 """
-import io
-import zipfile
-from datetime import datetime, date
-import xml.etree.ElementTree as ET
+import importlib.util
+import os
+from collections import deque
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 import html
 import time
-import hashlib
-from openpyxl import load_workbook
 from textwrap import dedent
 
+from archives import iter_xml_sources, read_xml
+from exportacao import MAX_LINHAS as PLANILHA_MAX_LINHAS, MODOS as MODOS_DIVISAO
+from exportacao import exportar_zip, particionar, zip_planilhas
+from indices import buscar, buscar_nota, indexar_notas, indexar_texto, nota, sigs_da_nota
+from ingest import acumular_itens, concat_itens, itens_para_df, parse_documents
+from xml_store import XmlStore
+from nfe_parser import CENTAVOS_COLS
+from xlsx_writer import (EXCEL_MAX_LINHAS, ModeloNaoSuportado, append_lancamentos, append_lancamentos_openpyxl,
+                         ler_modelo, linhas_livres)
+
+# Os processos do pool (parse e exportação; forkserver/spawn) rodam de novo o __main__ do pai, que
+# no Streamlit é este script. Com o __spec__ do módulo tarefas, o multiprocessing importa só ele lá.
+__spec__ = importlib.util.find_spec("tarefas")
+
 # -----------------------------
 # Page config + CSS (Figma-like)
 # -----------------------------
@@ -1127,212 +1139,6 @@ SPINNER_HTML = dedent("""
 """)
 
 
-# -----------------------------
-# XML helpers
-# -----------------------------
-def _local(tag: str) -> str:
-    # "{ns}Tag" -> "Tag"
-    return tag.split("}", 1)[-1] if "}" in tag else tag
-
-def _find_text(elem: ET.Element, path: str) -> str | None:
-    x = elem.find(path)
-    if x is None or x.text is None:
-        return None
-    return x.text.strip()
-
-def _parse_date(root: ET.Element) -> date | None:
-    """
-    Tenta pegar data de emissão:
-      - NFe/infNFe/ide/dhEmi (ISO datetime) ou dEmi (YYYY-MM-DD)
-    """
-    for p in [
-        ".//{*}infNFe/{*}ide/{*}dhEmi",
-        ".//{*}infNFe/{*}ide/{*}dEmi",
-        ".//{*}ide/{*}dhEmi",
-        ".//{*}ide/{*}dEmi",
-    ]:
-        t = _find_text(root, p)
-        if not t:
-            continue
-        try:
-            # dhEmi pode ser "2026-01-08T10:22:33-03:00"
-            if "T" in t:
-                # remove timezone para parse mais simples
-                base = t.split("T")[0]
-                return datetime.fromisoformat(base).date() if len(base) > 10 else datetime.fromisoformat(t[:19]).date()
-            return datetime.fromisoformat(t).date()
-        except Exception:
-            try:
-                return datetime.strptime(t[:10], "%Y-%m-%d").date()
-            except Exception:
-                pass
-    return None
-
-def _parse_nnf(root: ET.Element) -> str | None:
-    # Número da NF: ide/nNF
-    for p in [".//{*}infNFe/{*}ide/{*}nNF", ".//{*}ide/{*}nNF"]:
-        t = _find_text(root, p)
-        if t:
-            return t
-    return None
-
-
-def _extract_nfe_key(xml_bytes: bytes) -> str:
-    """Tenta extrair a chave (44 dígitos) da NFe/NFCe.
-    - Prioriza Id do infNFe (ex.: Id="NFe3519...")
-    - Fallback para tags chNFe comuns em protNFe/infProt ou eventos.
-    Retorna "" se não encontrar.
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return ""
-
-    # 1) infNFe @Id (mais comum)
-    inf = root.find(".//{*}infNFe")
-    if inf is not None:
-        idv = inf.attrib.get("Id") or inf.attrib.get("id") or ""
-        digits = "".join(ch for ch in idv if ch.isdigit())
-        if len(digits) >= 44:
-            return digits[-44:]
-
-    # 2) chNFe em protocolos
-    ch = (
-        _find_text(root, ".//{*}protNFe/{*}infProt/{*}chNFe")
-        or _find_text(root, ".//{*}infProt/{*}chNFe")
-        or _find_text(root, ".//{*}chNFe")
-        or ""
-    )
-    ch_digits = "".join(chh for chh in ch if chh.isdigit())
-    if len(ch_digits) >= 44:
-        return ch_digits[-44:]
-    return ""
-
-
-def _xml_signature(xml_bytes: bytes) -> str:
-    """Assinatura estável para deduplicação:
-    - Se achar chave, usa chave (melhor)
-    - Senão, usa hash do conteúdo (sha1)
-    """
-    chave = _extract_nfe_key(xml_bytes)
-    if chave:
-        return f"ch:{chave}"
-    return "sha1:" + hashlib.sha1(xml_bytes).hexdigest()
-
-def _parse_items_from_xml(xml_bytes: bytes, filename: str) -> list[dict]:
-    """
-    Extrai itens (det) e IBS/CBS:
-      - Item/Serviço: det/prod/xProd
-      - cClassTrib: imposto/IBSCBS/cClassTrib
-      - Base (vBC): imposto/IBSCBS/vBC
-      - vIBS / vCBS: imposto/IBSCBS/vIBS, vCBS (se existirem)
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return []
-
-    emissao = _parse_date(root)
-    nnf = _parse_nnf(root)
-
-    rows: list[dict] = []
-    dets = root.findall(".//{*}infNFe/{*}det") or root.findall(".//{*}det")
-    for det in dets:
-        xprod = _find_text(det, ".//{*}prod/{*}xProd") or ""
-        # Componentes do item (para validação por subtração)
-        vprod = _find_text(det, ".//{*}prod/{*}vProd")
-        vdesc = _find_text(det, ".//{*}prod/{*}vDesc")
-
-        # Tributos por ITEM (quando existirem)
-        vicms_item = _find_text(det, ".//{*}imposto/{*}ICMS//{*}vICMS")
-        vpis_item = _find_text(det, ".//{*}imposto/{*}PIS//{*}vPIS")
-        vcof_item = _find_text(det, ".//{*}imposto/{*}COFINS//{*}vCOFINS")
-
-        ibscbs = det.find(".//{*}imposto/{*}IBSCBS")
-        if ibscbs is None:
-            # alguns XML podem não ter IBSCBS -> ignora item
-            continue
-
-        cclass = _find_text(ibscbs, ".//{*}cClassTrib") or ""
-        vbc = _find_text(ibscbs, ".//{*}vBC")
-        vibs = _find_text(ibscbs, ".//{*}vIBS")
-        vcbs = _find_text(ibscbs, ".//{*}vCBS")
-
-        def _to_float(x: str | None):
-            try:
-                if x in (None, ""):
-                    return None
-                # suporta vírgula decimal
-                s = str(x).strip().replace(",", ".")
-                return float(s)
-            except Exception:
-                return None
-
-        def _to_float0(x: str | None) -> float:
-            v = _to_float(x)
-            return float(v) if v is not None else 0.0
-
-        vbc_f = _to_float(vbc)
-        vibs_f = _to_float(vibs)
-        vcbs_f = _to_float(vcbs)
-
-        # Componentes para validação por subtração (sempre em float)
-        vprod_f = _to_float0(vprod)
-        vdesc_f = _to_float0(vdesc)
-        vicms_item_f = _to_float0(vicms_item)
-        vpis_item_f = _to_float0(vpis_item)
-        vcof_item_f = _to_float0(vcof_item)
-
-        # Fonte do valor (base)
-        fonte = "IBSCBS/vBC" if vbc_f is not None else ""
-
-        rows.append(
-            {
-                "Data": emissao,
-                "Numero": nnf,
-                "Item/Serviço": xprod,
-                "cClassTrib": cclass,
-                "Valor da operação": vbc_f,
-                "vIBS": vibs_f,
-                "vCBS": vcbs_f,
-                "vProd": vprod_f,
-                "vDesc": vdesc_f,
-                "vICMS_item": vicms_item_f,
-                "vPIS_item": vpis_item_f,
-                "vCOFINS_item": vcof_item_f,
-                "arquivo": filename,
-                "Fonte do valor": fonte,
-            }
-        )
-
-    return rows
-
-
-
-def _parse_tax_totals_from_xml(xml_bytes: bytes) -> dict:
-    """Extrai totais do XML (por NOTA) via ICMSTot:
-    - vICMS (ICMS próprio)
-    - vPIS
-    - vCOFINS
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return {"vICMS": 0.0, "vPIS": 0.0, "vCOFINS": 0.0}
-
-    def _to_float(x: str | None) -> float:
-        try:
-            return float(x) if x not in (None, "") else 0.0
-        except Exception:
-            return 0.0
-
-    vICMS = _find_text(root, ".//{*}ICMSTot/{*}vICMS")
-    vPIS = _find_text(root, ".//{*}ICMSTot/{*}vPIS")
-    vCOF = _find_text(root, ".//{*}ICMSTot/{*}vCOFINS")
-
-    return {"vICMS": _to_float(vICMS), "vPIS": _to_float(vPIS), "vCOFINS": _to_float(vCOF)}
-
-
 # ============================
 # Validação Premium IBS/CBS
 # Regra: Base Calc = vProd − vDesc − vICMS_item − vPIS_item − vCOFINS_item
@@ -1358,54 +1164,153 @@ def _safe_num(x) -> float:
     except Exception:
         return 0.0
 
+def _num_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """Versão vetorizada de fillna(0).apply(_safe_num) para a coluna inteira (ausente -> 0.0)."""
+    if col not in df.columns:
+        return pd.Series(0.0, index=df.index)
+    s = df[col]
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype("float64").fillna(0.0)
+    # object: textos seguem a regra do _safe_num ("1.234,56"); o resto via to_numeric
+    try:
+        txt = s.str.strip()
+    except AttributeError:  # nenhum texto na coluna
+        txt = pd.Series(None, index=s.index, dtype=object)
+    eh_txt = txt.notna()
+    conv_txt = pd.to_numeric(
+        txt.str.replace(".", "", regex=False).str.replace(",", ".", regex=False), errors="coerce"
+    )
+    conv = pd.to_numeric(s.where(~eh_txt), errors="coerce")
+    return conv_txt.where(eh_txt, conv).astype("float64").fillna(0.0)
+
+def _centavos_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """Coluna monetária em centavos (int64): a coluna *_cent do parser quando existe,
+    senão a conversão do valor em float."""
+    cent = CENTAVOS_COLS.get(col)
+    if cent in df.columns:
+        return df[cent].fillna(0).astype("int64")
+    return (_num_col(df, col) * 100).round().astype("int64")
+
+def _sem_centavos(df: pd.DataFrame) -> pd.DataFrame:
+    """Tira as colunas internas em centavos (exportações para o usuário)."""
+    return df.drop(columns=[c for c in df.columns if str(c).endswith("_cent")])
+
+_STATUS_BASE_CATS = ["OK", "Divergente"]
+_DIAG_OK = "✓ Base bateu exatamente (0,00)"
+_DIAG_ZERADO = "Componentes do item vieram 0,00 (ver vProd/vDesc/tributos por item)"
+_DIAG_DIVERGE = "Base do XML não bate com a decomposição do item (subtração)"
+
 def aplicar_validacao_base_ibscbs(df_itens: pd.DataFrame) -> pd.DataFrame:
-    """Adiciona colunas de validação IBS/CBS (por item)."""
-    df = df_itens.copy()
+    """Adiciona colunas de validação IBS/CBS (por item). Tudo vetorizado (sem apply por linha)
+    e em centavos (int64): a comparação com ZERO tolerância é exata, sem erro de float.
+    Status e Diagnóstico saem como categóricos.
+    Cópia rasa: só as colunas novas ocupam memória; as do df_itens são compartilhadas (nenhuma
+    delas é alterada aqui)."""
+    df = df_itens.copy(deep=False)
 
     # Base do XML já vem em 'Valor da operação' (IBSCBS/vBC) no seu app
-    if "Valor da operação" in df.columns:
-        base_xml = df["Valor da operação"].fillna(0).apply(_safe_num)
-    else:
-        base_xml = pd.Series([0.0]*len(df), index=df.index)
+    base_xml = _centavos_col(df, "Valor da operação")
+
+    vProd = _centavos_col(df, "vProd")
+    vDesc = _centavos_col(df, "vDesc")
+    vICMS = _centavos_col(df, "vICMS_item")
+    vPIS = _centavos_col(df, "vPIS_item")
+    vCOF = _centavos_col(df, "vCOFINS_item")
+
+    base_calc = vProd - vDesc - vICMS - vPIS - vCOF
+    dif = base_calc - base_xml
+
+    ok = (dif.abs() <= round(TOLERANCIA_BASE_IBSCBS * 100)).to_numpy()
+
+    df["base_xml_cent"] = base_xml
+    df["base_calc_cent"] = base_calc
+    df["Base IBS/CBS (XML)"] = base_xml / 100
+    df["Base IBS/CBS (Calc)"] = base_calc / 100
+    df["Dif Base IBS/CBS"] = dif / 100
+    # categóricos montados direto pelos códigos (sem comparar strings linha a linha)
+    df["Status Base IBS/CBS"] = pd.Categorical.from_codes(
+        np.where(ok, 0, 1).astype(np.int8), categories=_STATUS_BASE_CATS
+    )
 
-    vProd = df.get("vProd", 0)
-    vDesc = df.get("vDesc", 0)
-    vICMS = df.get("vICMS_item", 0)
-    vPIS = df.get("vPIS_item", 0)
-    vCOF = df.get("vCOFINS_item", 0)
+    # Diagnóstico curto (premium)
+    # Se calc zerou mas XML > 0: normalmente faltam tributos por item (ou vProd não veio)
+    zerado = ((base_calc == 0) & (base_xml > 0)).to_numpy()
+    diag = np.select([ok, zerado], [0, 1], default=2).astype(np.int8)
+    df["Diagnóstico Base IBS/CBS"] = pd.Categorical.from_codes(
+        diag, categories=[_DIAG_OK, _DIAG_ZERADO, _DIAG_DIVERGE]
+    )
 
-    vProd = pd.Series(vProd).fillna(0).apply(_safe_num)
-    vDesc = pd.Series(vDesc).fillna(0).apply(_safe_num)
-    vICMS = pd.Series(vICMS).fillna(0).apply(_safe_num)
-    vPIS  = pd.Series(vPIS).fillna(0).apply(_safe_num)
-    vCOF  = pd.Series(vCOF).fillna(0).apply(_safe_num)
+    return df
 
-    base_calc = (vProd - vDesc - vICMS - vPIS - vCOF).round(2)
-    dif = (base_calc - base_xml).round(2)
 
-    status = dif.apply(lambda d: "OK" if abs(d) <= TOLERANCIA_BASE_IBSCBS else "Divergente")
+def _posicoes(df: pd.DataFrame, linhas) -> np.ndarray:
+    """Posições (iloc) das linhas filtradas; linhas=None é a tabela inteira."""
+    return np.arange(len(df)) if linhas is None else linhas
 
-    df["Base IBS/CBS (XML)"] = base_xml.round(2)
-    df["Base IBS/CBS (Calc)"] = base_calc
-    df["Dif Base IBS/CBS"] = dif
-    df["Status Base IBS/CBS"] = status
 
-    # Diagnóstico curto (premium)
-    def _diag(row):
-        if row["Status Base IBS/CBS"] == "OK":
-            return "✓ Base bateu exatamente (0,00)"
-        # Se calc zerou mas XML > 0: normalmente faltam tributos por item (ou vProd não veio)
-        if row["Base IBS/CBS (Calc)"] == 0 and row["Base IBS/CBS (XML)"] > 0:
-            return "Componentes do item vieram 0,00 (ver vProd/vDesc/tributos por item)"
-        return "Base do XML não bate com a decomposição do item (subtração)"
+def _coluna(df: pd.DataFrame, col: str, linhas) -> np.ndarray:
+    """Só os valores de uma coluna nas linhas filtradas (sem recortar o df inteiro)."""
+    valores = df[col].to_numpy()
+    return valores if linhas is None else valores[linhas]
 
-    df["Diagnóstico Base IBS/CBS"] = df.apply(_diag, axis=1)
 
-    return df
+def _divergentes(df_validado: pd.DataFrame, linhas) -> np.ndarray:
+    """Posições (iloc) dos itens divergentes entre as linhas filtradas."""
+    pos = _posicoes(df_validado, linhas)
+    return pos[(df_validado["Status Base IBS/CBS"] != "OK").to_numpy()[pos]]
+
+
+def _resumo_validacao(df_validado: pd.DataFrame, linhas=None, cache_key=None) -> dict:
+    """Totais do painel de validação, memoizados por cache_key (estado dos filtros + versão dos
+    dados): rerun causado por outro widget (checkbox, seletor de item) não recalcula nada."""
+    memo = st.session_state.setdefault("resumo_validacao", {})
+    if cache_key is not None and cache_key in memo:
+        return memo[cache_key]
+
+    total = len(df_validado) if linhas is None else len(linhas)
+    ok = total - len(_divergentes(df_validado, linhas))
+    xml_cent = int(_coluna(df_validado, "base_xml_cent", linhas).sum())
+    calc_cent = int(_coluna(df_validado, "base_calc_cent", linhas).sum())
+    resumo = {
+        "total": total,
+        "ok": ok,
+        "div": total - ok,
+        "soma_xml": xml_cent / 100,
+        "soma_calc": calc_cent / 100,
+        "delta_total": (calc_cent - xml_cent) / 100,
+    }
+    if cache_key is not None:
+        if len(memo) >= 8:
+            memo.clear()
+        memo[cache_key] = resumo
+    return resumo
+
+
+def _resumo_item(resumo: dict, nome, calcular):
+    """Derivado caro do resumo (CSV, ordem do seletor), calculado só na primeira vez."""
+    if nome not in resumo:
+        resumo[nome] = calcular()
+    return resumo[nome]
+
 
+def _ordem_seletor(df_validado: pd.DataFrame, linhas, so_divergentes: bool):
+    """Posições dos itens no seletor (maior |diferença| primeiro) e seus rótulos."""
+    pos = _divergentes(df_validado, linhas) if so_divergentes else _posicoes(df_validado, linhas)
+    absdif = pd.Series(np.abs(df_validado["Dif Base IBS/CBS"].to_numpy()[pos]))
+    ordem = pos[absdif.sort_values(ascending=False).index.to_numpy()]
 
-def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: str = "ibscbs"):
+    label_col = "Item/Serviço" if "Item/Serviço" in df_validado.columns else df_validado.columns[0]
+    labels = df_validado[label_col].iloc[ordem]
+    return ordem, labels.fillna("").astype(str).tolist()
+
+
+def render_painel_validacao_premium(df_validado: pd.DataFrame, *, linhas=None, notas=None,
+                                    key_prefix: str = "ibscbs", cache_key=None):
     """Retângulo premium com resumo + cálculo detalhado.
+    df_validado já traz as colunas de aplicar_validacao_base_ibscbs; linhas são as posições que
+    passaram nos filtros (None = todas), lidas direto do df_validado, sem recortá-lo; notas é o
+    índice de nota (indices.indexar_notas) do botão "Baixar XML"; cache_key (estado dos
+    filtros) memoiza resumo, CSV de divergentes e ordem do seletor entre reruns.
 
     ✅ Fix:
     - Dropdown pode mostrar só divergentes
@@ -1413,7 +1318,7 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
     - Botão para exportar apenas divergentes
     - Card fica vermelho quando item selecionado está divergente
     """
-    if df_validado is None or len(df_validado) == 0:
+    if df_validado is None or len(df_validado) == 0 or (linhas is not None and len(linhas) == 0):
         return
 
     # CSS premium (injetado uma vez)
@@ -1672,25 +1577,26 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
 </style>
 """)
 
-    total = len(df_validado)
-    ok = int((df_validado["Status Base IBS/CBS"] == "OK").sum())
-    div = total - ok
+    resumo = _resumo_validacao(df_validado, linhas, cache_key)
+    total = resumo["total"]
+    ok = resumo["ok"]
+    div = resumo["div"]
 
-    soma_xml = float(df_validado["Base IBS/CBS (XML)"].sum())
-    soma_calc = float(df_validado["Base IBS/CBS (Calc)"].sum())
-    delta_total = round(soma_calc - soma_xml, 2)
+    soma_xml = resumo["soma_xml"]
+    soma_calc = resumo["soma_calc"]
+    delta_total = resumo["delta_total"]
 
     status_global_ok = (div == 0)
     chip = "ok" if status_global_ok else "bad"
     chip_txt = "✓ Validado (0,00)" if status_global_ok else f"⚠ Divergências ({div})"
 
     # Exportar só divergentes
-    df_div = df_validado[df_validado["Status Base IBS/CBS"] != "OK"].copy()
-    if not df_div.empty:
-        csv_div = df_div.to_csv(index=False, sep=';', encoding='utf-8')
+    if div:
         st.download_button(
             "⬇️ Baixar somente divergentes (CSV)",
-            data=csv_div,
+            data=_resumo_item(resumo, "csv_div", lambda: _sem_centavos(
+                df_validado.iloc[_divergentes(df_validado, linhas)]
+            ).to_csv(index=False, sep=';', encoding='utf-8')),
             file_name="divergentes_ibscbs.csv",
             mime="text/csv",
             key=f"{key_prefix}_dl_div"
@@ -1699,25 +1605,19 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
     # Dropdown: por padrão, só divergentes quando existir
     show_only_div = st.checkbox(
         "Mostrar somente as divergentes",
-        value=(not df_div.empty),
+        value=(div > 0),
         key=f"{key_prefix}_onlydiv",
         help="Filtra o seletor e mostra apenas itens com Status = Divergente."
     )
 
-    df_tmp = df_validado.copy()
-    if show_only_div:
-        df_tmp = df_tmp[df_tmp["Status Base IBS/CBS"] != "OK"].copy()
+    # posições (iloc) ordenadas por |diferença| desc + rótulos do seletor, memoizados
+    ordem, options = _resumo_item(resumo, ("seletor", show_only_div),
+                                  lambda: _ordem_seletor(df_validado, linhas, show_only_div))
 
-    if df_tmp.empty:
+    if not options:
         st.success("✅ Nenhuma divergência encontrada. (Tudo OK)")
         return
 
-    df_tmp["_absdif"] = df_tmp["Dif Base IBS/CBS"].abs()
-    df_tmp = df_tmp.sort_values("_absdif", ascending=False)
-
-    label_col = "Item/Serviço" if "Item/Serviço" in df_tmp.columns else df_tmp.columns[0]
-    options = df_tmp[label_col].fillna("").astype(str).tolist()
-
     pick = st.selectbox(
         "Detalhar cálculo (selecione um item)",
         options=options,
@@ -1726,14 +1626,13 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
         help="Mostra a decomposição do item: vProd − vDesc − ICMS_item − PIS_item − COFINS_item."
     )
 
-    row = df_tmp[df_tmp[label_col].astype(str) == str(pick)].iloc[0]
+    row = df_validado.iloc[ordem[options.index(str(pick))]]
 
     # Download do XML da nota selecionada (individual)
     try:
         sig_sel = str(row.get("xml_sig", "")).strip()
-        store = st.session_state.get("xml_store", {})
-        if sig_sel and sig_sel in store:
-            meta = store[sig_sel]
+        meta = nota(notas, sig_sel) if notas is not None and sig_sel else None
+        if meta is not None:
             nnf = meta.get("Numero") or row.get("Numero") or ""
             chave = meta.get("chave") or ""
             src = meta.get("src") or ""
@@ -1743,7 +1642,7 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
                 fname = f"NFe_{nnf}_{chave[-6:]}.xml" if nnf else f"NFe_{chave[-6:]}.xml"
             st.download_button(
                 "⬇️ Baixar XML desta nota",
-                data=meta.get("bytes", b""),
+                data=_xml_download(sig_sel),
                 file_name=fname,
                 mime="application/xml",
                 key=f"{key_prefix}_dl_xml_{sig_sel}",
@@ -1763,7 +1662,7 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
     base_calc = float(row["Base IBS/CBS (Calc)"])
     dif = float(row["Dif Base IBS/CBS"])
 
-    status_item = "OK" if abs(dif) <= TOLERANCIA_BASE_IBSCBS else "Divergente"
+    status_item = str(row["Status Base IBS/CBS"])
     panel_class = "ibscbs-panel" + (" divergente" if status_item != "OK" else "")
     formula = (
         f"vProd ({_br_money(vProd)})  −  vDesc ({_br_money(vDesc)})  −  ICMS ({_br_money(vICMS)})  −  PIS ({_br_money(vPIS)})  −  COFINS ({_br_money(vCOF)})\n"
@@ -1853,165 +1752,30 @@ def render_painel_validacao_premium(df_validado: pd.DataFrame, *, key_prefix: st
     st.markdown(_html_clean(panel), unsafe_allow_html=True)
 
 
-def _detect_cancel_event(xml_bytes: bytes) -> dict | None:
-    """Detecta XML de evento de cancelamento (procEventoNFe / evento).
-    Retorna dict com dados úteis ou None se não for cancelamento.
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return None
-
-    # Procura tpEvento=110111 (Cancelamento)
-    tp = _find_text(root, ".//{*}detEvento/{*}tpEvento") or _find_text(root, ".//{*}tpEvento")
-    if tp != "110111":
-        return None
-
-    ch = _find_text(root, ".//{*}infEvento/{*}chNFe") or _find_text(root, ".//{*}chNFe") or ""
-    dh = _find_text(root, ".//{*}infEvento/{*}dhEvento") or _find_text(root, ".//{*}dhEvento") or ""
-    nprot = _find_text(root, ".//{*}infEvento/{*}nProt") or _find_text(root, ".//{*}nProt") or ""
-    xjust = _find_text(root, ".//{*}detEvento/{*}xJust") or _find_text(root, ".//{*}xJust") or ""
-
-    return {"chNFe": ch, "dhEvento": dh, "nProt": nprot, "xJust": xjust}
-
-
-
 # -----------------------------
 # Excel write helper
 # -----------------------------
 def _append_to_workbook(template_bytes: bytes, df: pd.DataFrame) -> bytes:
     """
-    Abre o template e grava df na aba LANCAMENTOS, acrescentando linhas.
+    Grava df na aba LANCAMENTOS do template.
 
-    ✅ O que este writer garante:
-      - Encontra a linha correta de cabeçalhos mesmo que o layout mude (ex.: cabeçalho na linha 2).
-      - Escreve nos campos de entrada (Data, Numero, Item/Serviço, etc.).
-      - COPIA fórmulas/estilos da primeira linha-modelo de dados para todas as novas linhas,
-        para que "Base", "Valor IBS/CBS", validações e cálculos voltem a aparecer no Excel.
+    Caminho normal: xlsx_writer (streaming, sem carregar o modelo no openpyxl). Se o modelo
+    tiver algo que ele não reproduz (ModeloNaoSuportado), usa xlsx_writer.append_lancamentos_openpyxl.
     """
-    from copy import copy
-    bio = io.BytesIO(template_bytes)
-    wb = load_workbook(bio)
-
-    ws = wb["LANCAMENTOS"] if "LANCAMENTOS" in wb.sheetnames else wb.active
-
-    # ------------------------------------------------------------
-    # 1) Descobre em qual linha estão os cabeçalhos (layout pode mudar)
-    # ------------------------------------------------------------
-    expected = {"Data", "Numero", "Item/Serviço", "cClassTrib", "Valor da operação"}
-    header_row = None
-
-    # procura nos primeiros 25 rows (suficiente pro seu layout)
-    for r in range(1, 26):
-        values = []
-        for c in range(1, 101):  # lê até 100 colunas (bem além do necessário)
-            v = ws.cell(row=r, column=c).value
-            if isinstance(v, str):
-                values.append(v.strip())
-        hit = len(expected.intersection(values))
-        if hit >= 3:  # achou linha com a maioria dos cabeçalhos
-            header_row = r
-            break
-
-    if header_row is None:
-        # fallback antigo (assume linha 1)
-        header_row = 1
-
-    # mapeia "nome do cabeçalho" -> coluna
-    headers: dict[str, int] = {}
-    last_col = 0
-    for col in range(1, 201):  # até 200 colunas
-        v = ws.cell(row=header_row, column=col).value
-        if isinstance(v, str) and v.strip():
-            headers[v.strip()] = col
-            last_col = max(last_col, col)
-
-    # se ainda não achou nada (planilha muito custom), tenta usar as colunas usadas do sheet
-    if last_col == 0:
-        last_col = min(ws.max_column, 200)
-
-    # ------------------------------------------------------------
-    # 2) Define a "linha modelo" (a primeira linha de dados com fórmulas)
-    #    No seu modelo: header_row=2, a linha 3 é seção, a 4 é a linha modelo.
-    # ------------------------------------------------------------
-    template_row = header_row + 2
-
-    # ------------------------------------------------------------
-    # 3) Descobre a próxima linha vazia olhando a coluna "Data"
-    # ------------------------------------------------------------
-    next_row = ws.max_row + 1
-    if "Data" in headers:
-        c = headers["Data"]
-        r = ws.max_row
-        while r >= (template_row) and ws.cell(row=r, column=c).value in (None, ""):
-            r -= 1
-        next_row = max(r + 1, template_row)
-
-    # ------------------------------------------------------------
-    # 4) Função para copiar estilo + fórmulas da linha modelo
-    # ------------------------------------------------------------
-    def _copy_row_style_and_formulas(src_row: int, dst_row: int):
-        from copy import copy
-        from openpyxl.formula.translate import Translator
-
-        for col in range(1, last_col + 1):
-            src = ws.cell(row=src_row, column=col)
-            dst = ws.cell(row=dst_row, column=col)
-
-            # estilos
-            dst.font = copy(src.font)
-            dst.fill = copy(src.fill)
-            dst.border = copy(src.border)
-            dst.alignment = copy(src.alignment)
-            dst.number_format = src.number_format
-            dst.protection = copy(src.protection)
-
-            # valor / fórmula
-            if isinstance(src.value, str) and src.value.startswith("="):
-                # traduz a referência da linha-modelo -> linha destino (ex.: G4 vira G7)
-                try:
-                    dst.value = Translator(src.value, origin=src.coordinate).translate_formula(dst.coordinate)
-                except Exception:
-                    dst.value = src.value
-            else:
-                dst.value = src.value
-
-
-    # ------------------------------------------------------------
-    # 5) Escreve as linhas: primeiro replica modelo, depois grava os valores de entrada
-    # ------------------------------------------------------------
-    fields = [
-        "Data", "Numero", "Item/Serviço", "cClassTrib",
-        "Valor da operação", "vIBS", "vCBS", "arquivo", "Fonte do valor"
-    ]
-
-    for _, row in df.iterrows():
-        # replica a linha modelo (fórmulas + visual)
-        _copy_row_style_and_formulas(template_row, next_row)
-
-        # agora sobrescreve somente os campos de ENTRADA
-        for f in fields:
-            if f not in headers:
-                continue
-            col = headers[f]
-            val = row.get(f, None)
-
-            cell = ws.cell(row=next_row, column=col)
-
-            # datas
-            if f == "Data" and pd.notna(val) and isinstance(val, date):
-                cell.value = val
-                cell.number_format = "dd/mm/yyyy"
-            else:
-                if pd.isna(val):
-                    val = None
-                cell.value = val
+    try:
+        return append_lancamentos(template_bytes, df)
+    except ModeloNaoSuportado:
+        return append_lancamentos_openpyxl(template_bytes, df)
+
 
-        next_row += 1
+def _planilhas_zip(template_bytes: bytes, df: pd.DataFrame, modo: str, max_linhas: int) -> bytes:
+    """Várias planilhas (exportacao) num .zip; com modelo fora do xlsx_writer, usa o writer openpyxl."""
+    try:
+        return exportar_zip(template_bytes, df, modo, max_linhas)
+    except ModeloNaoSuportado:
+        partes = particionar(df, modo, min(max_linhas, EXCEL_MAX_LINHAS - 25))
+        return zip_planilhas((nome, append_lancamentos_openpyxl(template_bytes, p)) for nome, p in partes)
 
-    out = io.BytesIO()
-    wb.save(out)
-    return out.getvalue()
 
 # -----------------------------
 # UI
@@ -2133,7 +1897,7 @@ with st.sidebar:
 """), unsafe_allow_html=True)
 
     st.markdown('<div class="uiverse-uploader">', unsafe_allow_html=True)
-    xml_files = st.file_uploader("", type=["xml","zip"], accept_multiple_files=True, label_visibility="collapsed")
+    xml_files = st.file_uploader("", type=["xml","zip","gz","tgz","tar"], accept_multiple_files=True, label_visibility="collapsed")
     components.html(
         '''
     <script>
@@ -2156,7 +1920,7 @@ with st.sidebar:
     st.markdown('</div>', unsafe_allow_html=True)
 
     st.markdown(dedent("""
-<div class="uploader-help">XML, ZIP • Múltiplos</div>
+<div class="uploader-help">XML, ZIP, GZ, TAR • Múltiplos</div>
 </div>
 
 <div style="height: 14px;"></div>
@@ -2176,7 +1940,7 @@ from pathlib import Path
 TEMPLATE_PATH = Path(__file__).parent / "planilha_modelo.xlsx"
 
 try:
-    template_bytes = TEMPLATE_PATH.read_bytes()
+    template_bytes = ler_modelo(TEMPLATE_PATH)
 except FileNotFoundError:
     template_bytes = None
 
@@ -2200,144 +1964,249 @@ if template_bytes is None:
 """), unsafe_allow_html=True)
 
 # Parse XMLs
-rows_all: list[dict] = []
-errors: list[str] = []
-cancelados: list[dict] = []
+def _iter_upload_fontes(files):
+    """Achata os uploads em (origem, bytes, ref) lendo um XML por vez (ZIP/GZ/TAR em streaming,
+    inclusive aninhados).
+    Falha de leitura vira (nome, "mensagem de erro", None), que o parse_documents repassa
+    na mesma ordem.
+    """
+    for f in files:
+        try:
+            yield from iter_xml_sources(f.name, f)
+        except Exception as e:
+            yield f.name, f"{f.name}: erro ao ler ({e})", None
+
 
-# Acumuladores por NOTA (ICMSTot)
-icms_total_all = 0.0
-pis_total_all = 0.0
-cofins_total_all = 0.0
+def _xml_download(sig: str):
+    """data do botão "Baixar XML": o xml_store só lê o XML quando o botão é clicado."""
+    store = st.session_state["xml_store"]
 
-if xml_files:
-    # Mostra spinner enquanto processa uploads (XML/ZIP)
-    spinner_placeholder.markdown(SPINNER_HTML, unsafe_allow_html=True)
+    def _ler() -> bytes:
+        return store.ler(sig) or b""
 
-    seen_xml_sigs: set[str] = set()
+    return _ler
 
-    # Store dos XMLs para download individual (por nota)
+
+def _upload_key(f) -> str:
+    """Identifica um upload entre reruns (id do arquivo no uploader + tamanho)."""
+    return f"{getattr(f, 'file_id', None) or f.name}:{getattr(f, 'size', '')}"
+
+
+def _ingest_state() -> dict:
+    """Estado da ingestão incremental (sobrevive aos reruns da sessão)."""
+    if "ingest" not in st.session_state:
+        st.session_state["ingest"] = {
+            # chave do upload -> {"nome", "entradas": [(origem, bytes|ref|erro, doc|stub|None)]}
+            "arquivos": {},
+            "dono": {},  # sig -> (chave do upload, índice da entrada) que venceu a deduplicação
+            "df": pd.DataFrame(),
+            "totais": {"vICMS": 0, "vPIS": 0, "vCOFINS": 0},  # ICMSTot das notas ativas, em centavos
+            "versao": 0,  # muda a cada alteração do df ou das notas (chave dos caches derivados)
+            "validado": None,  # (versao, df com as colunas da validação IBS/CBS)
+            "busca": None,  # (versao, índice de busca de Item/Serviço)
+            "notas": None,  # (versao, índices de nota: Numero, chave, sig)
+        }
+    # Store dos XMLs para download individual (por nota): só metadados + ref, bytes sob demanda
     if "xml_store" not in st.session_state:
-        st.session_state["xml_store"] = {}  # sig -> {bytes, src, Numero, Data, chave}
-    if "nnf_to_sig" not in st.session_state:
-        st.session_state["nnf_to_sig"] = {}  # nnf -> [sig, sig...]
+        st.session_state["xml_store"] = XmlStore()  # sig -> {ref, src, Numero, Data, chave}
+    return st.session_state["ingest"]
 
-    dupes_ignored = 0
-    xml_processed = 0
 
-    for f in xml_files:
-        try:
-            b = f.read()
-            # Deduplicação: evita processar o mesmo XML mais de uma vez
-            if not f.name.lower().endswith(".zip"):
-                sig = _xml_signature(b)
-                if sig in seen_xml_sigs:
-                    dupes_ignored += 1
-                    continue
-                seen_xml_sigs.add(sig)
-                xml_processed += 1
-
-                # Guardar XML para download individual (por assinatura/chave)
-                try:
-                    root_tmp = ET.fromstring(b)
-                    nnf_tmp = _parse_nnf(root_tmp) or ""
-                    dh_tmp = _parse_date(root_tmp)
-                    chave_tmp = _extract_nfe_key(b)
-                except Exception:
-                    nnf_tmp, dh_tmp, chave_tmp = "", None, ""
-                st.session_state["xml_store"][sig] = {
-                    "bytes": b,
-                    "src": f.name,
-                    "Numero": nnf_tmp,
-                    "Data": dh_tmp,
-                    "chave": chave_tmp,
-                }
-                if nnf_tmp:
-                    st.session_state["nnf_to_sig"].setdefault(str(nnf_tmp), [])
-                    if sig not in st.session_state["nnf_to_sig"][str(nnf_tmp)]:
-                        st.session_state["nnf_to_sig"][str(nnf_tmp)].append(sig)
-            # Totais por NOTA (somente quando for XML direto)
-            if not f.name.lower().endswith(".zip"):
-                tot0 = _parse_tax_totals_from_xml(b)
-                icms_total_all += tot0["vICMS"]
-                pis_total_all += tot0["vPIS"]
-                cofins_total_all += tot0["vCOFINS"]
-            if f.name.lower().endswith(".zip"):
-                with zipfile.ZipFile(io.BytesIO(b)) as z:
-                    xml_names = sorted(set(n for n in z.namelist() if n.lower().endswith(".xml")))
-                    if not xml_names:
-                        errors.append(f"{f.name}: zip sem .xml")
-                        continue
-                    for xn in xml_names:
-                        xb = z.read(xn)
-                        sig = _xml_signature(xb)
-                        if sig in seen_xml_sigs:
-                            dupes_ignored += 1
-                            continue
-                        seen_xml_sigs.add(sig)
-                        xml_processed += 1
-
-                        # Guardar XML para download individual (por assinatura/chave)
-                        try:
-                            root_tmp = ET.fromstring(xb)
-                            nnf_tmp2 = _parse_nnf(root_tmp) or ""
-                            dh_tmp2 = _parse_date(root_tmp)
-                            chave_tmp2 = _extract_nfe_key(xb)
-                        except Exception:
-                            nnf_tmp2, dh_tmp2, chave_tmp2 = "", None, ""
-                        st.session_state["xml_store"][sig] = {
-                            "bytes": xb,
-                            "src": f"{f.name}:{xn}",
-                            "Numero": nnf_tmp2,
-                            "Data": dh_tmp2,
-                            "chave": chave_tmp2,
-                        }
-                        if nnf_tmp2:
-                            st.session_state["nnf_to_sig"].setdefault(str(nnf_tmp2), [])
-                            if sig not in st.session_state["nnf_to_sig"][str(nnf_tmp2)]:
-                                st.session_state["nnf_to_sig"][str(nnf_tmp2)].append(sig)
-
-                        tot = _parse_tax_totals_from_xml(xb)
-                        icms_total_all += tot["vICMS"]
-                        pis_total_all += tot["vPIS"]
-                        cofins_total_all += tot["vCOFINS"]
-                        rows = _parse_items_from_xml(xb, f"{f.name}:{xn}")
-                        for rr in rows:
-                            rr['xml_sig'] = sig
-                        if not rows:
-                            ce = _detect_cancel_event(xb)
-                            if ce is not None:
-                                ce["arquivo"] = f"{f.name}:{xn}"
-                                cancelados.append(ce)
-                                # evento de cancelamento não possui itens/IBSCBS
-                                continue
-                            errors.append(f"{f.name}:{xn}: não encontrei itens com IBSCBS")
-                        rows_all.extend(rows)
-            else:
-                rows = _parse_items_from_xml(b, f.name)
-                for rr in rows:
-                    rr['xml_sig'] = sig
-                if not rows:
-                    ce = _detect_cancel_event(b)
-                    if ce is not None:
-                        ce["arquivo"] = f.name
-                        cancelados.append(ce)
-                    else:
-                        errors.append(f"{f.name}: não encontrei itens com IBSCBS")
-                rows_all.extend(rows)
-        except Exception as e:
-            errors.append(f"{f.name}: erro ao ler ({e})")
+def _ativar_doc(stt: dict, dono: tuple, src: str, xml, doc: dict, novas: dict) -> None:
+    """Nota passa a valer: entra no xml_store, soma nos totais e seus itens vão para as colunas
+    `novas` (ingest.acumular_itens), que viram o df da tabela.
+    xml: ref de archives.iter_xml_sources (o XML é relido do upload sob demanda).
+    """
+    sig = doc["sig"]
+    stt["dono"][sig] = dono
 
-    # Remove spinner ao terminar
-    spinner_placeholder.empty()
+    # Guardar XML para download individual (por assinatura/chave)
+    st.session_state["xml_store"].put(sig, {
+        "src": src,
+        "Numero": doc["Numero"] or "",
+        "Data": doc["Data"],
+        "chave": doc["chave"],
+    }, ref=xml)
+
+    # Totais por NOTA (ICMSTot), em centavos: somar/subtrair não acumula erro
+    for k, v in doc["totais_cent"].items():
+        stt["totais"][k] += v
+
+    rows = doc["rows"]
+    if not rows and doc["cancel"] is not None:
+        doc["cancel"]["arquivo"] = src
+    acumular_itens(novas, rows, sig)
+
+
+def _desativar_doc(stt: dict, doc: dict) -> None:
+    """Desfaz _ativar_doc (as linhas saem da tabela em lote, por xml_sig)."""
+    sig = doc["sig"]
+    del stt["dono"][sig]
+    st.session_state["xml_store"].pop(sig, None)
+    for k, v in doc["totais_cent"].items():
+        stt["totais"][k] -= v
+
+
+def _doc_leve(doc: dict | None) -> dict | None:
+    """O que a entrada guarda depois do parse: o documento sem os itens (eles já estão no df;
+    se a nota precisar voltar a valer, _doc_completo parseia de novo, em geral do parse_cache)."""
+    if doc is None or doc.get("rows") is None:
+        return doc
+    return {**doc, "rows": None, "n_itens": len(doc["rows"])}
 
-    if dupes_ignored:
-        st.info(f"🔁 {dupes_ignored} XML(s) foram ignorados por duplicidade (mesma chave/conteúdo).")
 
-df = pd.DataFrame(rows_all)
+def _doc_completo(entradas: list, i: int) -> dict:
+    """Documento da entrada i; duplicata que foi pulada (stub) ou entrada já sem os itens
+    (_doc_leve) é parseada agora."""
+    src, xml, doc = entradas[i]
+    if doc.get("duplicado") or doc["rows"] is None:
+        xb = read_xml(xml)
+        doc = next(parse_documents([(src, xb)]))[2]
+        entradas[i] = (src, xml, doc)
+    return doc
 
-# Normaliza Data
-if not df.empty:
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce").dt.date
+
+
+
+def _sincronizar_uploads(files) -> dict:
+    """Atualiza o estado só com a diferença desde o último rerun.
+
+    - upload novo: só os XMLs dele são parseados; as linhas são acrescentadas ao df
+    - upload removido: linhas, totais e XMLs das notas dele saem; se outro upload tinha
+      a mesma nota (duplicata ignorada), ela passa a valer a partir dele
+    """
+    stt = _ingest_state()
+    atuais = [(_upload_key(f), f) for f in files]
+    chaves = {k for k, _ in atuais}
+    df_ing = stt["df"]
+    novas: dict[str, list] = {}  # itens das notas que passaram a valer, por coluna
+
+    removidos = [k for k in stt["arquivos"] if k not in chaves]
+    if removidos:
+        sigs_fora: set[str] = set()
+        for k in removidos:
+            for i, (_src, _xb, doc) in enumerate(stt["arquivos"].pop(k)["entradas"]):
+                if doc is not None and stt["dono"].get(doc["sig"]) == (k, i):
+                    _desativar_doc(stt, doc)
+                    sigs_fora.add(doc["sig"])
+        if sigs_fora and not df_ing.empty:
+            df_ing = df_ing[~df_ing["xml_sig"].isin(sigs_fora)]
+        # duplicatas que estavam em outros uploads passam a valer
+        for k, _ in atuais:
+            entradas = stt["arquivos"].get(k, {"entradas": []})["entradas"]
+            for i, (src, xb, doc) in enumerate(entradas):
+                if doc is not None and doc["sig"] in sigs_fora and doc["sig"] not in stt["dono"]:
+                    _ativar_doc(stt, (k, i), src, xb, _doc_completo(entradas, i), novas)
+                    entradas[i] = (src, xb, _doc_leve(entradas[i][2]))
+
+    novos = [(k, f) for k, f in atuais if k not in stt["arquivos"]]
+    if novos:
+        # Mostra spinner enquanto processa uploads (XML/ZIP)
+        spinner_placeholder.markdown(SPINNER_HTML, unsafe_allow_html=True)
+
+        for k, f in novos:
+            stt["arquivos"][k] = {"nome": f.name, "entradas": []}
+        origem_upload: deque = deque()  # (chave do upload, ref) de cada fonte, na ordem de envio
+
+        def _fontes():
+            for k, f in novos:
+                for src, payload, ref in _iter_upload_fontes([f]):
+                    origem_upload.append((k, ref))
+                    yield src, payload
+
+        # Parse em paralelo (ingest.WORKERS processos); resultados voltam na ordem de upload.
+        # XMLs ficam guardados só pela ref: os bytes são descartados após o parse.
+        # Notas que já valem (mesma chave) nem são parseadas: voltam como duplicate_stub.
+        for src, xb, doc in parse_documents(_fontes(), pular=stt["dono"].__contains__):
+            k, ref = origem_upload.popleft()
+            if ref is not None:
+                xb = ref
+            entradas = stt["arquivos"][k]["entradas"]
+            # Deduplicação: a primeira ocorrência da nota (mesma chave/conteúdo) é a que vale
+            if doc is not None and doc["sig"] not in stt["dono"]:
+                _ativar_doc(stt, (k, len(entradas)), src, xb, doc, novas)
+            entradas.append((src, xb, _doc_leve(doc)))
+
+        # Remove spinner ao terminar
+        spinner_placeholder.empty()
+
+    if novas:
+        part = itens_para_df(novas)
+        df_ing = part if df_ing.empty else concat_itens(df_ing, part)
+        # Linhas acrescentadas ao fim; se alguma nota "promovida" ou upload novo não for o
+        # último da lista, reordena pela ordem de upload (igual a reprocessar tudo)
+        novos_no_fim = [k for k, _ in atuais[len(atuais) - len(novos):]] == [k for k, _ in novos]
+        if len(part) != len(df_ing) and (removidos or not novos_no_fim):
+            pos = {k: n for n, (k, _) in enumerate(atuais)}
+            ordem = {sig: (pos[k], i) for sig, (k, i) in stt["dono"].items()}
+            chave_ordem = df_ing["xml_sig"].astype(object).map(ordem)
+            df_ing = df_ing.iloc[chave_ordem.argsort(kind="stable")].reset_index(drop=True)
+    elif removidos:
+        df_ing = df_ing.reset_index(drop=True)
+    if novos or removidos:
+        # df e/ou notas do xml_store mudaram (nota sem itens, como cancelamento, só no store)
+        stt["versao"] += 1
+    stt["df"] = df_ing
+    return stt
+
+
+def _validacao_completa(stt: dict) -> pd.DataFrame:
+    """Validação IBS/CBS da tabela inteira, refeita só quando os dados mudam (não a cada filtro)."""
+    cache = stt["validado"]
+    if cache is None or cache[0] != stt["versao"]:
+        cache = (stt["versao"], aplicar_validacao_base_ibscbs(stt["df"]))
+        stt["validado"] = cache
+    return cache[1]
+
+
+def _indice_notas(stt: dict) -> dict:
+    """Índices de nota (indices.indexar_notas): Numero/sig -> linhas, chave -> sig, Numero ->
+    sigs; refeitos só quando os dados mudam."""
+    cache = stt["notas"]
+    if cache is None or cache[0] != stt["versao"]:
+        cache = (stt["versao"], indexar_notas(stt["df"], st.session_state["xml_store"].items()))
+        stt["notas"] = cache
+    return cache[1]
+
+
+def _indice_busca(stt: dict) -> dict:
+    """Índice do "Buscar item" (indices.indexar_texto), refeito só quando os dados mudam."""
+    cache = stt["busca"]
+    if cache is None or cache[0] != stt["versao"]:
+        cache = (stt["versao"], indexar_texto(stt["df"]["Item/Serviço"]))
+        stt["busca"] = cache
+    return cache[1]
+
+
+stt_ingest = _sincronizar_uploads(xml_files or [])
+df = stt_ingest["df"]
+
+# Acumuladores por NOTA (ICMSTot): somados em centavos, convertidos só para exibir
+icms_total_all = stt_ingest["totais"]["vICMS"] / 100
+pis_total_all = stt_ingest["totais"]["vPIS"] / 100
+cofins_total_all = stt_ingest["totais"]["vCOFINS"] / 100
+
+# Erros e cancelamentos na ordem de upload (só das notas que valem)
+errors: list[str] = []
+cancelados: list[dict] = []
+n_docs = 0
+for k in map(_upload_key, xml_files or []):
+    for i, (src, xb, doc) in enumerate(stt_ingest["arquivos"][k]["entradas"]):
+        if doc is None:
+            errors.append(xb)
+            continue
+        n_docs += 1
+        if stt_ingest["dono"].get(doc["sig"]) != (k, i) or doc.get("n_itens"):
+            continue
+        if doc["cancel"] is not None:
+            # evento de cancelamento não possui itens/IBSCBS
+            cancelados.append(doc["cancel"])
+        else:
+            errors.append(f"{src}: não encontrei itens com IBSCBS")
+
+dupes_ignored = n_docs - len(stt_ingest["dono"])
+if dupes_ignored:
+    st.info(f"🔁 {dupes_ignored} XML(s) foram ignorados por duplicidade (mesma chave/conteúdo).")
 
 # ---------- KPIs ----------
 def money(x):
@@ -2374,39 +2243,125 @@ def _clean_html(s: str) -> str:
     # Remove indentation that can turn HTML into a markdown code block
     return "\n".join(line.lstrip() for line in s.splitlines() if line.strip())
 
-def _render_doc_table(df: pd.DataFrame, total_items: int | None = None):
+# Tabela paginada: só a página visível vira HTML (o resto fica no servidor)
+TABELA_LINHAS_POR_PAGINA = int(os.environ.get("EXTRATOR_TABELA_LINHAS", "100") or 100)
+_TABELA_TAMANHOS = sorted({50, 100, 250, 500, TABELA_LINHAS_POR_PAGINA})
+_TABELA_ORDEM = {
+    "(Ordem do XML)": None,
+    "Data": "Data",
+    "Número": "Numero",
+    "Item/Serviço": "Item/Serviço",
+    "cClassTrib": "cClassTrib",
+    "Valor da operação": "Valor da operação",
+    "vIBS": "vIBS",
+    "vCBS": "vCBS",
+    "Arquivo": "arquivo",
+}
+
+
+def _h_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """_h de uma coluna inteira (vazio quando falta), com os mesmos escapes de html.escape."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index)
+    s = df[col]
+    s = s.astype(object).where(s.notna(), "").astype(str)
+    return (
+        s.str.replace("&", "&amp;", regex=False)
+        .str.replace("<", "&lt;", regex=False)
+        .str.replace(">", "&gt;", regex=False)
+        .str.replace('"', "&quot;", regex=False)
+        .str.replace("'", "&#x27;", regex=False)
+    )
+
+
+def _money_br_col(df: pd.DataFrame, col: str) -> pd.Series:
+    """_fmt_money_br de uma coluna inteira, a partir dos centavos (sem erro de float)."""
+    if col not in df.columns:
+        return pd.Series("0,00", index=df.index)
+    cent = _centavos_col(df, col)
+    absc = cent.abs()
+    inteiro = (absc // 100).astype(str).str.replace(r"\B(?=(\d{3})+(?!\d))", ".", regex=True)
+    frac = (absc % 100).astype(str).str.zfill(2)
+    sinal = pd.Series(np.where(cent < 0, "-", ""), index=df.index)
+    return sinal + inteiro + "," + frac
+
+
+def _doc_table_rows_html(df: pd.DataFrame) -> str:
+    """<tr> de cada linha, montados coluna a coluna (sem iterrows)."""
+    if df.empty:
+        return ""
+    arquivo = _h_col(df, "arquivo")
+    linhas = (
+        '<tr>\n<td class="col-date">' + _h_col(df, "Data")
+        + '</td>\n<td class="col-num">' + _h_col(df, "Numero")
+        + '</td>\n<td class="col-item">' + _h_col(df, "Item/Serviço")
+        + '</td>\n<td class="col-cclass"><span class="cclass-badge">' + _h_col(df, "cClassTrib")
+        + '</span></td>\n<td class="col-money">' + _money_br_col(df, "Valor da operação")
+        + '</td>\n<td class="col-vibs">' + _money_br_col(df, "vIBS")
+        + '</td>\n<td class="col-vcbs">' + _money_br_col(df, "vCBS")
+        + '</td>\n<td class="col-file" title="' + arquivo + '">' + arquivo
+        + "</td>\n</tr>"
+    )
+    return "\n".join(linhas.tolist())
+
+
+def _ordenar_tabela(df: pd.DataFrame, col: str | None, desc: bool, linhas=None) -> np.ndarray:
+    """Posições (iloc) das linhas filtradas na ordem pedida; só a coluna da ordenação é lida."""
+    pos = _posicoes(df, linhas)
+    if col is None or col not in df.columns:
+        return pos[::-1] if desc else pos
+    if col in CENTAVOS_COLS:
+        cent = CENTAVOS_COLS[col]
+        sub = df[[cent] if cent in df.columns else [col]].iloc[pos]
+        chave = _centavos_col(sub, col)
+    elif col == "Numero":
+        # número da nota ordena como número (texto só no desempate)
+        chave = pd.to_numeric(df[col].iloc[pos], errors="coerce")
+    else:
+        chave = df[col].iloc[pos]
+    return pos[chave.reset_index(drop=True).sort_values(
+        ascending=not desc, kind="stable", na_position="last"
+    ).index.to_numpy()]
+
+
+def _render_doc_table(df: pd.DataFrame, total_items: int | None = None, *, linhas=None,
+                      key_prefix: str = "doc_tab"):
     """
     Renderiza tabela premium (HTML) no estilo do print.
+    Paginada no servidor: ordenação e página escolhidas nos controles acima da tabela; só as
+    linhas da página são convertidas em HTML (e só elas saem do df, pelas posições em linhas;
+    None = todas).
     """
-    if df is None or df.empty:
+    n = 0 if df is None else (len(df) if linhas is None else len(linhas))
+    if n == 0 or df.empty:
         st.info("Nenhum item para exibir.")
         return
 
-    total = total_items if total_items is not None else len(df)
-
-    rows = []
-    for _, r in df.iterrows():
-        data = _h(r.get("Data", ""))
-        numero = _h(r.get("Numero", ""))
-        item = _h(r.get("Item/Serviço", ""))
-        cclass = _h(r.get("cClassTrib", ""))
-        valor = _fmt_money_br(r.get("Valor da operação", 0))
-        vibs = _fmt_money_br(r.get("vIBS", 0))
-        vcbs = _fmt_money_br(r.get("vCBS", 0))
-        arquivo = _h(r.get("arquivo", ""))
-
-        rows.append(f"""
-<tr>
-  <td class="col-date">{data}</td>
-  <td class="col-num">{numero}</td>
-  <td class="col-item">{item}</td>
-  <td class="col-cclass"><span class="cclass-badge">{cclass}</span></td>
-  <td class="col-money">{valor}</td>
-  <td class="col-vibs">{vibs}</td>
-  <td class="col-vcbs">{vcbs}</td>
-  <td class="col-file" title="{arquivo}">{arquivo}</td>
-</tr>
-""")
+    total = total_items if total_items is not None else n
+
+    k_ordem, k_desc = f"{key_prefix}_ordem", f"{key_prefix}_desc"
+    k_tam, k_pag = f"{key_prefix}_tamanho", f"{key_prefix}_pagina"
+    tam = int(st.session_state.get(k_tam, TABELA_LINHAS_POR_PAGINA))
+    n_pag = max(1, -(-n // tam))
+    # filtro reduziu a tabela: volta para a última página que existe
+    if st.session_state.get(k_pag, 1) > n_pag:
+        st.session_state[k_pag] = n_pag
+
+    t1, t2, t3, t4 = st.columns([2, 1, 1, 1], gap="medium")
+    with t1:
+        ordem = st.selectbox("Ordenar por", options=list(_TABELA_ORDEM), index=0, key=k_ordem)
+    with t2:
+        desc = st.toggle("Decrescente", value=False, key=k_desc)
+    with t3:
+        st.selectbox("Itens por página", options=_TABELA_TAMANHOS,
+                     index=_TABELA_TAMANHOS.index(TABELA_LINHAS_POR_PAGINA), key=k_tam)
+    with t4:
+        pagina = st.number_input(f"Página (de {n_pag})", min_value=1, max_value=n_pag,
+                                 value=1, step=1, key=k_pag)
+
+    ini = (int(pagina) - 1) * tam
+    pagina_df = df.iloc[_ordenar_tabela(df, _TABELA_ORDEM[ordem], desc, linhas)[ini:ini + tam]]
+    fim = ini + len(pagina_df)
 
     html_block = f"""
 <div class="doc-table-wrap">
@@ -2424,10 +2379,10 @@ def _render_doc_table(df: pd.DataFrame, total_items: int | None = None):
       </tr>
     </thead>
     <tbody>
-      {''.join(rows)}
+      {_doc_table_rows_html(pagina_df)}
     </tbody>
   </table>
-  <div class="doc-table-foot">Mostrando {len(df)} de {total} itens</div>
+  <div class="doc-table-foot">Mostrando {ini + 1}–{fim} de {total} itens (página {int(pagina)} de {n_pag})</div>
 </div>
 """
     st.markdown(_clean_html(html_block), unsafe_allow_html=True)
@@ -2439,16 +2394,20 @@ def _render_doc_table(df: pd.DataFrame, total_items: int | None = None):
 ALIQUOTA_IBS_TEXTO = "0,10%"
 ALIQUOTA_CBS_TEXTO = "0,90%"
 
-base_ibs = float(df["Valor da operação"].fillna(0).sum()) if (not df.empty and "Valor da operação" in df.columns) else 0.0
-base_cbs = float(df["Valor da operação"].fillna(0).sum()) if (not df.empty and "Valor da operação" in df.columns) else 0.0
+def _soma_reais(df: pd.DataFrame, col: str) -> float:
+    """Soma exata de uma coluna monetária: em centavos (int64) e só no fim vira reais."""
+    return _centavos_col(df, col).sum() / 100 if not df.empty else 0.0
+
+base_ibs = _soma_reais(df, "Valor da operação")
+base_cbs = base_ibs
 
 # Totais exibidos nos cards = soma das bases
-ibs_total = round(base_ibs, 2)
-cbs_total = round(base_cbs, 2)
-total_tributos = round(icms_total_all, 2)
+ibs_total = base_ibs
+cbs_total = base_cbs
+total_tributos = icms_total_all
 # Créditos: Totais reais do XML (somatório de vIBS e vCBS)
-creditos_ibs_total = round(float(df["vIBS"].fillna(0).sum()) if (not df.empty and "vIBS" in df.columns) else 0.0, 2)
-creditos_cbs_total = round(float(df["vCBS"].fillna(0).sum()) if (not df.empty and "vCBS" in df.columns) else 0.0, 2)
+creditos_ibs_total = _soma_reais(df, "vIBS")
+creditos_cbs_total = _soma_reais(df, "vCBS")
 # --- KPI clique (filtro via query param) ---
 try:
     _qp = st.query_params.get("kpi", "all")
@@ -2643,6 +2602,71 @@ if errors:
     if len(errors) > 10:
         st.caption(f"... e mais {len(errors)-10} itens")
 
+def _mascara_texto(s: pd.Series, pred) -> np.ndarray:
+    """Máscara de pred (Series de str -> bool) sobre s.astype(str); em coluna categórica o
+    teste roda só nas categorias (uma vez por valor distinto, não por item)."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        por_cat = pred(pd.Series(s.cat.categories.astype(str))).to_numpy(dtype=bool)
+        return np.append(por_cat, False)[s.cat.codes.to_numpy()]  # código -1 (vazio): False
+    return pred(s.astype(str)).to_numpy(dtype=bool)
+
+
+def _filtrar_itens(df: pd.DataFrame, periodo, q: str, pick, nota_q: str, kpi: str, busca=None,
+                   notas=None):
+    """Posições (iloc) dos itens que passam em todos os filtros da tela (None = todos).
+
+    Cada filtro é um predicado sobre uma coluna do df, combinado numa máscara booleana só;
+    nenhum recorte intermediário do df é montado. busca: índice de Item/Serviço
+    (_indice_busca), obrigatório quando há q; notas: índice de nota (_indice_notas),
+    obrigatório quando há nota_q.
+    """
+    mascara = np.ones(len(df), dtype=bool)
+
+    # período: "Data" já vem normalizada (date, NaT quando inválida) desde a ingestão
+    if isinstance(periodo, (list, tuple)) and len(periodo) == 2:
+        d1, d2 = periodo
+        mascara &= ((df["Data"] >= d1) & (df["Data"] <= d2)).to_numpy(dtype=bool)
+
+    # busca: todos os termos, sem diferenciar maiúsculas nem acentos (indices.buscar)
+    achados = buscar(busca, q) if q else None
+    if achados is not None:
+        no_item = np.zeros(len(df), dtype=bool)
+        no_item[achados] = True
+        mascara &= no_item
+
+    # cClassTrib
+    if pick and pick != "(Todos)":
+        mascara &= _mascara_texto(df["cClassTrib"], lambda s: s == str(pick))
+
+    # busca por número da nota (nNF): notas cujo número começa pelos dígitos, ou a da chave
+    nn = "".join(ch for ch in str(nota_q or "").strip() if ch.isdigit())
+    if nn:
+        da_nota = np.zeros(len(df), dtype=bool)
+        da_nota[buscar_nota(notas, nn)] = True
+        mascara &= da_nota
+
+    # filtro por KPI (clique nos cards)
+    vibs = df["vIBS"].fillna(0).to_numpy() if kpi != "all" and "vIBS" in df.columns else None
+    vcbs = df["vCBS"].fillna(0).to_numpy() if kpi != "all" and "vCBS" in df.columns else None
+    if kpi == "ibs" and vibs is not None:
+        mascara &= vibs != 0
+    elif kpi == "cbs" and vcbs is not None:
+        mascara &= vcbs != 0
+    elif kpi == "cred" and (vibs is not None and vcbs is not None):
+        # créditos normalmente aparecem como valores negativos
+        mascara &= (vibs < 0) | (vcbs < 0)
+    elif kpi == "total" and (vibs is not None and vcbs is not None):
+        mascara &= (vibs != 0) | (vcbs != 0)
+
+    return None if mascara.all() else np.flatnonzero(mascara)
+
+
+def _recorte(df: pd.DataFrame, linhas) -> pd.DataFrame:
+    """df só com as linhas filtradas, materializado quando alguém precisa dele inteiro
+    (CSV, planilha); sem filtro, o próprio df."""
+    return df if linhas is None else df.iloc[linhas]
+
+
 # ---------- Filters + table ----------
 st.markdown('<div class="card">', unsafe_allow_html=True)
 st.markdown("## Itens do Documento")
@@ -2662,38 +2686,23 @@ with c1:
     periodo = st.date_input("Período", value=(min_d, max_d), min_value=min_d, max_value=max_d)
 
 with c2:
-    q = st.text_input("Buscar item", placeholder="Ex.: produto, serviço, descrição...")
+    q = st.text_input("Buscar item", placeholder="Ex.: produto, serviço, descrição...",
+                      help="Vários termos: só os itens que têm todos. Maiúsculas e acentos não contam.")
 
 with c3:
     classes = sorted([c for c in df["cClassTrib"].dropna().unique().tolist() if str(c).strip() != ""])
     pick = st.selectbox("cClassTrib", options=["(Todos)"] + classes, index=0)
 
 with c4:
-    nota_q = st.text_input("Buscar nota (nNF)", placeholder="Ex.: 6484")
-
-df_view = df.copy()
-
-# filtro de período (robusto)
-if isinstance(periodo, (list, tuple)) and len(periodo) == 2:
-    d1, d2 = periodo
-    df_view["Data"] = pd.to_datetime(df_view["Data"], errors="coerce").dt.date
-    df_view = df_view[(df_view["Data"] >= d1) & (df_view["Data"] <= d2)]
-
-# busca
-if q:
-    qq = q.strip().lower()
-    df_view = df_view[df_view["Item/Serviço"].fillna("").str.lower().str.contains(qq, na=False)]
-
-# cClassTrib
-if pick and pick != "(Todos)":
-    df_view = df_view[df_view["cClassTrib"].astype(str) == str(pick)]
-
-# busca por número da nota (nNF)
-if 'nota_q' in locals() and nota_q:
-    nn = ''.join(ch for ch in str(nota_q).strip() if ch.isdigit())
-    if nn:
-        df_view = df_view[df_view["Numero"].astype(str).str.contains(nn, na=False)]
+    nota_q = st.text_input("Buscar nota (nNF)", placeholder="Ex.: 6484",
+                           help="Número da nota ou o começo dele; a chave de acesso (44 dígitos) acha a nota.")
 
+# Todos os filtros numa máscara só sobre o df (que não é copiado nem alterado): a tabela, o
+# painel de validação e as exportações recebem as posições das linhas que passaram
+linhas_view = _filtrar_itens(df, periodo, q, pick, nota_q, selected_kpi,
+                             busca=_indice_busca(stt_ingest) if q.strip() else None,
+                             notas=_indice_notas(stt_ingest))
+n_view = len(df) if linhas_view is None else len(linhas_view)
 
 
 # Download rápido do XML pela nota (digite o número acima)
@@ -2701,15 +2710,15 @@ try:
     if 'nota_q' in locals() and nota_q:
         nn = ''.join(ch for ch in str(nota_q).strip() if ch.isdigit())
         if nn:
-            sigs = st.session_state.get("nnf_to_sig", {}).get(str(nn), [])
-            store = st.session_state.get("xml_store", {})
-            sigs = [s for s in sigs if s in store]
+            # número exato (ou a chave de acesso inteira) pelo índice de notas
+            indice_notas = _indice_notas(stt_ingest)
+            sigs = sigs_da_nota(indice_notas, nn)
             if sigs:
                 # Se houver mais de 1 XML com o mesmo número (ex.: séries diferentes), deixa escolher
                 if len(sigs) > 1:
                     opt_labels = []
                     for s in sigs:
-                        meta = store.get(s, {})
+                        meta = nota(indice_notas, s)
                         chave = meta.get("chave") or ""
                         src = meta.get("src") or ""
                         suf = (chave[-6:] if chave else s[-6:])
@@ -2719,15 +2728,16 @@ try:
                 else:
                     sig_sel = sigs[0]
 
-                meta = store.get(sig_sel, {})
+                meta = nota(indice_notas, sig_sel)
+                nnf = meta.get("Numero") or nn
                 chave = meta.get("chave") or ""
                 src = meta.get("src") or ""
-                fname = f"NFe_{nn}.xml"
+                fname = f"NFe_{nnf}.xml"
                 if chave:
-                    fname = f"NFe_{nn}_{chave[-6:]}.xml"
+                    fname = f"NFe_{nnf}_{chave[-6:]}.xml"
                 st.download_button(
                     "⬇️ Baixar XML dessa nota (busca)",
-                    data=meta.get("bytes", b""),
+                    data=_xml_download(sig_sel),
                     file_name=fname,
                     mime="application/xml",
                     key=f"dl_xml_by_nnf_{sig_sel}",
@@ -2736,41 +2746,34 @@ try:
 except Exception:
     pass
 
-# filtro por KPI (clique nos cards)
-if selected_kpi != "all":
-    vibs = df_view["vIBS"].fillna(0) if "vIBS" in df_view.columns else None
-    vcbs = df_view["vCBS"].fillna(0) if "vCBS" in df_view.columns else None
-
-    if selected_kpi == "ibs" and vibs is not None:
-        df_view = df_view[vibs != 0]
-    elif selected_kpi == "cbs" and vcbs is not None:
-        df_view = df_view[vcbs != 0]
-    elif selected_kpi == "cred" and (vibs is not None and vcbs is not None):
-        # créditos normalmente aparecem como valores negativos
-        df_view = df_view[(vibs < 0) | (vcbs < 0)]
-    elif selected_kpi == "total" and (vibs is not None and vcbs is not None):
-        df_view = df_view[(vibs != 0) | (vcbs != 0)]
-
-
 # ---------- Validação Premium IBS/CBS (retângulo) ----------
 try:
-    df_validado = aplicar_validacao_base_ibscbs(df_view)
-    render_painel_validacao_premium(df_validado, key_prefix="ibscbs")
+    # validação já calculada da tabela inteira (mesmas posições do df), lida só nas linhas_view
+    filtro_key = (stt_ingest["versao"], str(periodo), q, pick, nota_q, selected_kpi)
+    render_painel_validacao_premium(_validacao_completa(stt_ingest), linhas=linhas_view,
+                                    notas=_indice_notas(stt_ingest),
+                                    key_prefix="ibscbs", cache_key=filtro_key)
 except Exception as _e:
     st.warning(f"Não foi possível renderizar a validação IBS/CBS: {_e}")
 
 
 show_cols = ["Data", "Numero", "Item/Serviço", "cClassTrib", "Valor da operação", "vIBS", "vCBS", "arquivo", "Fonte do valor"]
-show_cols = [c for c in show_cols if c in df_view.columns]
+show_cols = [c for c in show_cols if c in df.columns]
 
 # ===== TABELA PREMIUM (igual vídeo) =====
 st.markdown('<div class="table-wrap">', unsafe_allow_html=True)
 
-_render_doc_table(df_view[show_cols], total_items=len(df_view))
+_render_doc_table(df, total_items=n_view, linhas=linhas_view)
 st.markdown('<div class="table-download-spacer"></div>', unsafe_allow_html=True)
+
+
+def _csv_filtrado() -> bytes:
+    return _recorte(df[show_cols], linhas_view).to_csv(index=False).encode("utf-8")
+
+
 st.download_button(
     "Baixar CSV filtrado",
-    data=df_view[show_cols].to_csv(index=False).encode("utf-8"),
+    data=_csv_filtrado,  # gerado só no clique
     file_name="itens_filtrados.csv",
     mime="text/csv",
 )
@@ -2784,6 +2787,35 @@ st.markdown("## Gerar planilha preenchida")
 if template_bytes is None:
     st.error("Não encontrei **planilha_modelo.xlsx** na mesma pasta do app.py.")
 else:
+    try:
+        _livres = linhas_livres(template_bytes)
+    except ModeloNaoSuportado:
+        _livres = EXCEL_MAX_LINHAS - 25  # cabeçalho nas 25 primeiras linhas (writer openpyxl)
+
+    _div_opcoes = ["nao"] + list(MODOS_DIVISAO)
+    modo_div = st.selectbox(
+        "Dividir em várias planilhas",
+        options=_div_opcoes,
+        format_func=lambda k: "Não dividir (uma planilha)" if k == "nao" else MODOS_DIVISAO[k],
+        key="planilha_divisao",
+        help="Gera um .xlsx por parte, todos a partir do modelo, e entrega um .zip.",
+    )
+    max_linhas_div = _livres
+    if modo_div != "nao":
+        max_linhas_div = int(st.number_input(
+            "Máx. de linhas por planilha",
+            min_value=1,
+            max_value=_livres,
+            value=min(PLANILHA_MAX_LINHAS, _livres),
+            step=10000,
+            key="planilha_max_linhas",
+        ))
+    elif n_view > _livres:
+        # não cabe numa aba do Excel: divide sozinho pelo limite
+        modo_div = "linhas"
+        st.info(f"{n_view:_} itens passam do limite do Excel ({_livres:_} linhas na aba "
+                f"LANCAMENTOS): serão geradas várias planilhas, num .zip.".replace("_", "."))
+
     if st.button("Gerar planilha", type="primary"):
         try:
             # 🔵 IBS
@@ -2801,7 +2833,10 @@ else:
             # 🟣 Total / exportação
             show_spinner(tipo="total", titulo="Gerando planilha…", subtitulo="Aplicando fórmulas e estilos", speed="1.0s")
 
-            out_bytes = _append_to_workbook(template_bytes, df_view)
+            if modo_div == "nao":
+                out_bytes = _append_to_workbook(template_bytes, _recorte(df, linhas_view))
+            else:
+                out_bytes = _planilhas_zip(template_bytes, _recorte(df, linhas_view), modo_div, max_linhas_div)
 
         except Exception as e:
             # Garante que o overlay não esconda o erro
@@ -2812,9 +2847,17 @@ else:
             hide_spinner()
             st.success("Planilha gerada! Abra no Excel para ver as fórmulas calculando.")
 
-            st.download_button(
-                "Baixar planilha_preenchida.xlsx",
-                data=out_bytes,
-                file_name="planilha_preenchida.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            )
\ No newline at end of file
+            if modo_div == "nao":
+                st.download_button(
+                    "Baixar planilha_preenchida.xlsx",
+                    data=out_bytes,
+                    file_name="planilha_preenchida.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
+            else:
+                st.download_button(
+                    "Baixar planilhas_preenchidas.zip",
+                    data=out_bytes,
+                    file_name="planilhas_preenchidas.zip",
+                    mime="application/zip",
+                )
\ No newline at end of file
@@ -11,8 +11,7 @@ Como rodar:
 """
 import io
 import zipfile
-from datetime import datetime, date
-import xml.etree.ElementTree as ET
+from datetime import date
 
 import pandas as pd
 import streamlit as st
@@ -22,6 +21,9 @@ import time
 from openpyxl import load_workbook
 from textwrap import dedent
 
+# XML helpers (lxml com XPath pré-compilado ou ElementTree, ver nfe_parser.XML_ENGINE)
+from nfe_parser import _parse_items_from_xml, _parse_tax_totals_from_xml, _detect_cancel_event
+
 # -----------------------------
 # Page config + CSS (Figma-like)
 # -----------------------------
@@ -1110,163 +1112,6 @@ SPINNER_HTML = dedent("""
 """)
 
 
-# -----------------------------
-# XML helpers
-# -----------------------------
-def _local(tag: str) -> str:
-    # "{ns}Tag" -> "Tag"
-    return tag.split("}", 1)[-1] if "}" in tag else tag
-
-def _find_text(elem: ET.Element, path: str) -> str | None:
-    x = elem.find(path)
-    if x is None or x.text is None:
-        return None
-    return x.text.strip()
-
-def _parse_date(root: ET.Element) -> date | None:
-    """
-    Tenta pegar data de emissão:
-      - NFe/infNFe/ide/dhEmi (ISO datetime) ou dEmi (YYYY-MM-DD)
-    """
-    for p in [
-        ".//{*}infNFe/{*}ide/{*}dhEmi",
-        ".//{*}infNFe/{*}ide/{*}dEmi",
-        ".//{*}ide/{*}dhEmi",
-        ".//{*}ide/{*}dEmi",
-    ]:
-        t = _find_text(root, p)
-        if not t:
-            continue
-        try:
-            # dhEmi pode ser "2026-01-08T10:22:33-03:00"
-            if "T" in t:
-                # remove timezone para parse mais simples
-                base = t.split("T")[0]
-                return datetime.fromisoformat(base).date() if len(base) > 10 else datetime.fromisoformat(t[:19]).date()
-            return datetime.fromisoformat(t).date()
-        except Exception:
-            try:
-                return datetime.strptime(t[:10], "%Y-%m-%d").date()
-            except Exception:
-                pass
-    return None
-
-def _parse_nnf(root: ET.Element) -> str | None:
-    # Número da NF: ide/nNF
-    for p in [".//{*}infNFe/{*}ide/{*}nNF", ".//{*}ide/{*}nNF"]:
-        t = _find_text(root, p)
-        if t:
-            return t
-    return None
-
-def _parse_items_from_xml(xml_bytes: bytes, filename: str) -> list[dict]:
-    """
-    Extrai itens (det) e IBS/CBS:
-      - Item/Serviço: det/prod/xProd
-      - cClassTrib: imposto/IBSCBS/cClassTrib
-      - Base (vBC): imposto/IBSCBS/vBC
-      - vIBS / vCBS: imposto/IBSCBS/vIBS, vCBS (se existirem)
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return []
-
-    emissao = _parse_date(root)
-    nnf = _parse_nnf(root)
-
-    rows: list[dict] = []
-    dets = root.findall(".//{*}infNFe/{*}det") or root.findall(".//{*}det")
-    for det in dets:
-        xprod = _find_text(det, ".//{*}prod/{*}xProd") or ""
-        ibscbs = det.find(".//{*}imposto/{*}IBSCBS")
-        if ibscbs is None:
-            # alguns XML podem não ter IBSCBS -> ignora item
-            continue
-
-        cclass = _find_text(ibscbs, ".//{*}cClassTrib") or ""
-        vbc = _find_text(ibscbs, ".//{*}vBC")
-        vibs = _find_text(ibscbs, ".//{*}vIBS")
-        vcbs = _find_text(ibscbs, ".//{*}vCBS")
-
-        def _to_float(x: str | None):
-            try:
-                return float(x) if x not in (None, "") else None
-            except Exception:
-                return None
-
-        vbc_f = _to_float(vbc)
-        vibs_f = _to_float(vibs)
-        vcbs_f = _to_float(vcbs)
-
-        # Fonte do valor (base)
-        fonte = "IBSCBS/vBC" if vbc_f is not None else ""
-
-        rows.append(
-            {
-                "Data": emissao,
-                "Numero": nnf,
-                "Item/Serviço": xprod,
-                "cClassTrib": cclass,
-                "Valor da operação": vbc_f,
-                "vIBS": vibs_f,
-                "vCBS": vcbs_f,
-                "arquivo": filename,
-                "Fonte do valor": fonte,
-            }
-        )
-
-    return rows
-
-
-
-def _parse_tax_totals_from_xml(xml_bytes: bytes) -> dict:
-    """Extrai totais do XML (por NOTA) via ICMSTot:
-    - vICMS (ICMS próprio)
-    - vPIS
-    - vCOFINS
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return {"vICMS": 0.0, "vPIS": 0.0, "vCOFINS": 0.0}
-
-    def _to_float(x: str | None) -> float:
-        try:
-            return float(x) if x not in (None, "") else 0.0
-        except Exception:
-            return 0.0
-
-    vICMS = _find_text(root, ".//{*}ICMSTot/{*}vICMS")
-    vPIS = _find_text(root, ".//{*}ICMSTot/{*}vPIS")
-    vCOF = _find_text(root, ".//{*}ICMSTot/{*}vCOFINS")
-
-    return {"vICMS": _to_float(vICMS), "vPIS": _to_float(vPIS), "vCOFINS": _to_float(vCOF)}
-
-
-def _detect_cancel_event(xml_bytes: bytes) -> dict | None:
-    """Detecta XML de evento de cancelamento (procEventoNFe / evento).
-    Retorna dict com dados úteis ou None se não for cancelamento.
-    """
-    try:
-        root = ET.fromstring(xml_bytes)
-    except Exception:
-        return None
-
-    # Procura tpEvento=110111 (Cancelamento)
-    tp = _find_text(root, ".//{*}detEvento/{*}tpEvento") or _find_text(root, ".//{*}tpEvento")
-    if tp != "110111":
-        return None
-
-    ch = _find_text(root, ".//{*}infEvento/{*}chNFe") or _find_text(root, ".//{*}chNFe") or ""
-    dh = _find_text(root, ".//{*}infEvento/{*}dhEvento") or _find_text(root, ".//{*}dhEvento") or ""
-    nprot = _find_text(root, ".//{*}infEvento/{*}nProt") or _find_text(root, ".//{*}nProt") or ""
-    xjust = _find_text(root, ".//{*}detEvento/{*}xJust") or _find_text(root, ".//{*}xJust") or ""
-
-    return {"chNFe": ch, "dhEvento": dh, "nProt": nprot, "xJust": xjust}
-
-
-
 # -----------------------------
 # Excel write helper
 # -----------------------------
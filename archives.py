@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Leitura dos uploads (XML solto ou compactado) em streaming
+- Formatos: .xml, .zip, .gz (ex.: .xml.gz), .tar, .tar.gz/.tgz — inclusive uns dentro dos
+  outros (ZIP dentro de ZIP, .xml.gz dentro de ZIP, ZIP dentro de .tar.gz...)
+- .gz sem extensão conhecida por dentro (ex.: NFe3524....gz, comum em ERPs) é lido como XML
+- O ZIP enviado é aberto direto sobre o conteúdo do upload (ou uma cópia em arquivo temporário,
+  se ele não permitir seek): nada de f.read() do arquivo inteiro nem cópia em memória
+- Cada leitura (a ingestão e cada read_xml) usa um leitor com posição própria sobre o upload: o
+  download roda em outra thread e não pode mexer na posição de quem está lendo
+- Cada XML é lido sozinho e entregue ao parse -> o pico de memória fica no tamanho do maior
+  XML (arquivos aninhados são copiados para arquivo temporário, não para a memória)
+- Os XMLs não ficam guardados: guarda-se só a referência (upload, caminho até o membro), e
+  read_xml relê aquele XML quando alguém precisar dos bytes
+- Proteção contra zip bomb: limite de níveis de aninhamento, de tamanho por XML e de total
+  descompactado por upload (EXTRATOR_ARCHIVE_MAX_DEPTH, EXTRATOR_XML_MAX_MB,
+  EXTRATOR_ARCHIVE_MAX_MB)
+
+Origem de cada XML: "{arquivo}:{membro}" (aninhado: "{arquivo}:{interno.zip}:{membro}").
+Sem dependência de Streamlit.
+"""
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+SPOOL_MAX_BYTES = 64 * 1024 * 1024  # acima disso a cópia temporária vai para o disco
+MAX_DEPTH = int(os.environ.get("EXTRATOR_ARCHIVE_MAX_DEPTH", "4"))
+MAX_XML_BYTES = int(float(os.environ.get("EXTRATOR_XML_MAX_MB", "256")) * 1024 * 1024)
+MAX_TOTAL_BYTES = int(float(os.environ.get("EXTRATOR_ARCHIVE_MAX_MB", "8192")) * 1024 * 1024)
+
+_BLOCO = 1024 * 1024
+_lock = threading.Lock()  # seek + read dos arquivos compartilhados sem getvalue (_Compartilhado)
+
+
+def _tipo(name: str) -> str | None:
+    n = name.lower()
+    if n.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"  # tarfile descompacta o gzip sozinho (modo "r|*")
+    if n.endswith(".gz"):
+        return "gz"
+    if n.endswith(".zip"):
+        return "zip"
+    if n.endswith(".xml"):
+        return "xml"
+    return None
+
+
+def _nome_gz(name: str) -> str:
+    """Nome do conteúdo de um .gz: sem o ".gz"; sem extensão conhecida, vale como XML."""
+    interno = name[:-3]
+    return interno if _tipo(interno) else interno + ".xml"
+
+
+def _seekable(f):
+    """Objeto com seek para o zipfile: o próprio upload ou uma cópia em arquivo temporário."""
+    try:
+        if f.seekable():
+            return f
+    except (AttributeError, OSError):
+        pass
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    shutil.copyfileobj(f, tmp, _BLOCO)
+    tmp.seek(0)
+    return tmp
+
+
+class _Compartilhado:
+    """Leitor com posição própria sobre um arquivo com seek usado por mais de uma thread: cada
+    read reposiciona o arquivo e lê sob o mesmo lock."""
+
+    def __init__(self, f):
+        self._f = f
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = 0) -> int:
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            with _lock:
+                pos += self._f.seek(0, 2)
+        self._pos = pos
+        return pos
+
+    def read(self, n: int = -1) -> bytes:
+        with _lock:
+            self._f.seek(self._pos)
+            dados = self._f.read(n)
+        self._pos += len(dados)
+        return dados
+
+
+def _leitor(f):
+    """Leitor do início de `f` (com seek) sem mexer na posição de `f`. O UploadedFile do
+    Streamlit é um BytesIO: getvalue() devolve os bytes sem copiar, e o BytesIO novo os
+    compartilha até alguém escrever."""
+    getvalue = getattr(f, "getvalue", None)
+    if getvalue is not None:
+        return io.BytesIO(getvalue())
+    return _Compartilhado(f)
+
+
+def _consumir(orcamento: dict, n: int) -> None:
+    orcamento["restante"] -= n
+    if orcamento["restante"] < 0:
+        mb = MAX_TOTAL_BYTES // (1024 * 1024)
+        raise ValueError(f"conteúdo descompactado passa de {mb} MB (possível zip bomb)")
+
+
+def _ler_xml(stream, src: str, orcamento: dict) -> bytes | str:
+    """Lê um XML em blocos, sem confiar no tamanho declarado no cabeçalho do arquivo.
+    XML acima de MAX_XML_BYTES vira mensagem de erro (str)."""
+    partes = []
+    total = 0
+    while True:
+        bloco = stream.read(_BLOCO)
+        if not bloco:
+            return b"".join(partes)
+        total += len(bloco)
+        _consumir(orcamento, len(bloco))
+        if total > MAX_XML_BYTES:
+            return f"{src}: XML maior que {MAX_XML_BYTES // (1024 * 1024)} MB"
+        partes.append(bloco)
+
+
+def _spool(stream, orcamento: dict):
+    """Copia um arquivo aninhado (ex.: ZIP dentro de ZIP) para arquivo temporário, com limite."""
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    while True:
+        bloco = stream.read(_BLOCO)
+        if not bloco:
+            break
+        _consumir(orcamento, len(bloco))
+        tmp.write(bloco)
+    tmp.seek(0)
+    return tmp
+
+
+def _zip_members(z: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    # mesmo critério de antes: nomes sem repetição, em ordem alfabética (agora também
+    # arquivos compactados, além de .xml)
+    por_nome = {i.filename: i for i in z.infolist() if not i.is_dir() and _tipo(i.filename)}
+    return [por_nome[n] for n in sorted(por_nome)]
+
+
+def _walk(name: str, f, src: str, caminho: tuple, nivel: int, orcamento: dict):
+    """Gera (origem, bytes|erro, caminho) de cada XML dentro de `f` (chamado `name`)."""
+    tipo = _tipo(name)
+    if tipo == "xml":
+        yield src, _ler_xml(f, src, orcamento), caminho
+        return
+    if nivel > MAX_DEPTH:
+        yield src, f"{src}: arquivos compactados aninhados demais (limite {MAX_DEPTH})", None
+        return
+    if tipo == "gz":
+        # .xml.gz (ou .zip.gz...): um único conteúdo, com o nome sem o ".gz"
+        with gzip.GzipFile(fileobj=f, mode="rb") as g:
+            yield from _walk(_nome_gz(name), g, src, caminho, nivel + 1, orcamento)
+    elif tipo == "zip":
+        fz = _seekable(f) if nivel == 0 else _spool(f, orcamento)
+        with zipfile.ZipFile(fz) as z:
+            for info in _zip_members(z):
+                with z.open(info) as m:
+                    yield from _walk_membro(info.filename, m, src, caminho, nivel, orcamento)
+    elif tipo == "tar":
+        # modo stream: lê o .tar/.tar.gz uma vez, na ordem em que os membros aparecem
+        with tarfile.open(fileobj=f, mode="r|*") as t:
+            for info in t:
+                if not info.isfile() or not _tipo(info.name):
+                    continue
+                m = t.extractfile(info)
+                yield from _walk_membro(info.name, m, src, caminho, nivel, orcamento)
+
+
+def _walk_membro(membro: str, m, src: str, caminho: tuple, nivel: int, orcamento: dict):
+    """Um membro de ZIP/TAR: arquivo interno corrompido vira erro só dele, o resto segue."""
+    src_m = f"{src}:{membro}"
+    try:
+        yield from _walk(membro, m, src_m, caminho + (membro,), nivel + 1, orcamento)
+    except Exception as e:
+        if orcamento["restante"] < 0:
+            raise  # estourou o limite do upload: para tudo
+        yield src_m, f"{src_m}: erro ao ler ({e})", None
+
+
+def iter_xml_sources(name: str, f):
+    """Gera (origem, bytes do XML, ref) de um upload.
+
+    - XML solto: (nome, bytes, ref)
+    - Compactado: ("{arquivo}:{membro}", bytes, ref) para cada XML, um por vez
+    ref = (arquivo, nome do upload, caminho até o membro — vazio no XML solto), para read_xml
+    Problemas em um XML (ex.: grande demais) saem como (origem, "mensagem", None).
+    Se não houver nenhum XML, gera (nome, "{nome}: zip sem .xml", None).
+    Estourar o limite de descompactação do upload levanta ValueError.
+    """
+    tipo = _tipo(name)
+    base = _seekable(f)
+    if tipo not in ("zip", "gz", "tar"):
+        yield name, _leitor(base).read(), (base, name, ())
+        return
+    orcamento = {"restante": MAX_TOTAL_BYTES}
+    achou = False
+    for src, xb, caminho in _walk(name, _leitor(base), name, (), 0, orcamento):
+        achou = True
+        yield src, xb, None if isinstance(xb, str) else (base, name, caminho)
+    if not achou:
+        yield name, f"{name}: {'zip' if tipo == 'zip' else 'arquivo'} sem .xml", None
+
+
+def _ler_caminho(name: str, f, caminho: tuple, nivel: int) -> bytes:
+    tipo = _tipo(name)
+    if tipo == "gz":
+        with gzip.GzipFile(fileobj=f, mode="rb") as g:
+            return _ler_caminho(_nome_gz(name), g, caminho, nivel + 1)
+    if tipo == "zip":
+        fz = _seekable(f) if nivel == 0 else _spool(f, {"restante": MAX_TOTAL_BYTES})
+        with zipfile.ZipFile(fz) as z, z.open(caminho[0]) as m:
+            return _ler_caminho(caminho[0], m, caminho[1:], nivel + 1)
+    if tipo == "tar":
+        with tarfile.open(fileobj=f, mode="r|*") as t:
+            for info in t:
+                if info.name == caminho[0] and info.isfile():
+                    return _ler_caminho(info.name, t.extractfile(info), caminho[1:], nivel + 1)
+        raise KeyError(caminho[0])
+    return f.read()
+
+
+def read_xml(ref) -> bytes:
+    """Relê os bytes de um XML a partir da ref gerada por iter_xml_sources (pode rodar em outra
+    thread enquanto a ingestão lê o mesmo upload: cada um com o seu leitor)."""
+    f, name, caminho = ref
+    return _ler_caminho(name, _leitor(f), caminho, 0)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do "Buscar item": str.lower().str.contains em todas as linhas (como o app fazia)
+x índice de trigramas (indices.indexar_texto + indices.buscar).
+
+Mede a montagem do índice (uma vez por versão dos dados) e cada consulta; --distintos controla
+quantas descrições diferentes há entre os itens (o índice cresce com elas, não com os itens).
+
+Uso:
+  python benchmarks/bench_busca.py --itens 1000000 --distintos 20000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import indices  # noqa: E402
+
+CONSULTAS = ["parafuso 1234", "1234", "açúcar", "cristal 5kg", "zz", "a"]
+
+
+def _descricoes(n_itens: int, distintos: int) -> pd.Series:
+    rng = np.random.default_rng(0)
+    nomes = ["Parafuso sextavado", "Açúcar cristal", "Óleo de soja", "Serviço de manutenção", "Cabo flexível"]
+    medidas = ["5kg", "1L", "M8", "10m", "UN"]
+    ids = rng.integers(distintos, size=n_itens)
+    vals = [f"{nomes[i % 5]} {medidas[i // 5 % 5]} ref {i}" for i in ids]
+    return pd.Series(pd.array(vals, dtype="str"))
+
+
+def _medir(fn, repeat: int = 5) -> float:
+    tempos = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+    return min(tempos)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--itens", type=int, default=1_000_000, help="itens na tabela")
+    ap.add_argument("--distintos", type=int, default=20_000, help="descrições distintas")
+    args = ap.parse_args()
+
+    s = _descricoes(args.itens, args.distintos)
+    t0 = time.perf_counter()
+    indice = indices.indexar_texto(s)
+    dt = time.perf_counter() - t0
+    mb = (sum(v.nbytes for v in indice.values() if isinstance(v, np.ndarray)) + len(indice["texto"])) / 1e6
+    print(f"índice: {len(indice['fim']):,} descrições, {dt:.2f}s, ~{mb:,.0f} MB")
+
+    print(f"{'consulta':>16} {'itens':>9} {'antes (ms)':>11} {'depois (ms)':>12} {'ganho':>7}")
+    for q in CONSULTAS:
+        antes = _medir(lambda: s.fillna("").str.lower().str.contains(q.lower(), na=False).to_numpy(), 2)
+        depois = _medir(lambda: indices.buscar(indice, q))
+        n = len(indices.buscar(indice, q))
+        print(f"{q!r:>16} {n:>9,} {antes * 1000:>11.1f} {depois * 1000:>12.3f} {antes / depois:>6.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do parser de NFe: lxml (XPath pré-compilado) x ElementTree,
+e ingestão paralela (ingest.parse_documents) com N processos.
+
+Uso:
+  python benchmarks/bench_parser.py --docs 5000 --items 20 --workers 16
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ingest  # noqa: E402
+import nfe_parser  # noqa: E402
+from synthetic_nfe import corpus  # noqa: E402
+
+
+def _run(engine: str, docs: list[tuple[str, bytes]]) -> tuple[float, int]:
+    t0 = time.perf_counter()
+    n_rows = 0
+    for name, b in docs:
+        n_rows += len(nfe_parser.parse_nfe_document(b, name, engine=engine)["rows"])
+    return time.perf_counter() - t0, n_rows
+
+
+def _run_pool(workers: int, docs: list[tuple[str, bytes]]) -> tuple[float, int]:
+    t0 = time.perf_counter()
+    n_rows = 0
+    for _, _, doc in ingest.parse_documents(docs, workers=workers):
+        n_rows += len(doc["rows"])
+    return time.perf_counter() - t0, n_rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=2000, help="quantidade de XMLs no corpus")
+    ap.add_argument("--items", type=int, default=20, help="itens (det) por NFe")
+    ap.add_argument("--repeat", type=int, default=3, help="repetições (vale a melhor)")
+    ap.add_argument("--workers", type=int, default=ingest.WORKERS, help="processos na ingestão paralela")
+    args = ap.parse_args()
+
+    docs = corpus(args.docs, args.items)
+    mb = sum(len(b) for _, b in docs) / 1e6
+    print(f"corpus: {len(docs)} XMLs, {args.items} itens/XML, {mb:.1f} MB")
+
+    engines = ["etree"] + (["lxml"] if nfe_parser.LET is not None else [])
+    best: dict[str, float] = {}
+    for engine in engines:
+        tempos = []
+        for _ in range(args.repeat):
+            dt, n_rows = _run(engine, docs)
+            tempos.append(dt)
+        best[engine] = min(tempos)
+        print(f"{engine:>6}: {best[engine]:.3f}s  ({len(docs) / best[engine]:,.0f} XML/s, {n_rows} itens)")
+
+    if "lxml" in best:
+        print(f"lxml/etree: {best['etree'] / best['lxml']:.2f}x mais rápido")
+    else:
+        print("lxml não instalado: só ElementTree medido")
+
+    if args.workers > 1:
+        _run_pool(args.workers, docs)  # sobe o pool fora da medição
+        dt = min(_run_pool(args.workers, docs)[0] for _ in range(args.repeat))
+        serial = best.get("lxml", best["etree"])
+        print(f"  pool: {dt:.3f}s com {args.workers} processos ({serial / dt:.2f}x sobre o serial)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark da tabela de itens: pd.DataFrame(lista de dicts) x colunas acumuladas
+(ingest.acumular_itens + ingest.itens_para_df, com categorias e texto em Arrow).
+
+Mede memória (memory_usage(deep=True)), tempo de montagem e os filtros da tela
+(cClassTrib, busca de número da nota, remoção das notas de um upload).
+
+Uso:
+  python benchmarks/bench_tabela.py --itens 1000000
+"""
+import argparse
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ingest  # noqa: E402
+
+
+def _notas(n_itens: int, itens_por_nota: int):
+    """(sig, rows) no formato de nfe_parser (rows com as mesmas chaves)."""
+    rng = np.random.default_rng(0)
+    classes = ["000001", "200032", "410999", "011001", "550001"]
+    for nota in range(0, n_itens, itens_por_nota):
+        emissao = date(2026, 1 + nota % 12, 1 + nota % 28)
+        nnf = str(1000 + nota // itens_por_nota)
+        src = f"lote_{nota // 20000}.zip:NFe{nnf}.xml"
+        rows = []
+        for i in range(min(itens_por_nota, n_itens - nota)):
+            v = float(round(rng.random() * 1000, 2))
+            c = int(round(v * 100))
+            rows.append({
+                "Data": emissao, "Numero": nnf, "Item/Serviço": f"Produto {rng.integers(20000)}",
+                "cClassTrib": classes[i % len(classes)], "Valor da operação": v,
+                "vIBS": round(v * 0.001, 2), "vCBS": round(v * 0.009, 2),
+                "vProd": v, "vDesc": 0.0, "vICMS_item": 0.0, "vPIS_item": 0.0, "vCOFINS_item": 0.0,
+                "arquivo": src, "Fonte do valor": "IBSCBS/vBC",
+                "vBC_cent": c, "vIBS_cent": c // 1000, "vCBS_cent": c * 9 // 1000,
+                "vProd_cent": c, "vDesc_cent": 0, "vICMS_item_cent": 0, "vPIS_item_cent": 0,
+                "vCOFINS_item_cent": 0,
+            })
+        yield f"sig{nota}", rows
+
+
+def _antes(notas) -> pd.DataFrame:
+    linhas = []
+    for sig, rows in notas:
+        for r in rows:
+            r["xml_sig"] = sig
+        linhas.extend(rows)
+    df = pd.DataFrame(linhas)
+    df["Data"] = pd.to_datetime(df["Data"], errors="coerce").dt.date
+    return df
+
+
+def _depois(notas) -> pd.DataFrame:
+    colunas: dict = {}
+    for sig, rows in notas:
+        ingest.acumular_itens(colunas, rows, sig)
+    return ingest.itens_para_df(colunas)
+
+
+def _mascara(s: pd.Series, pred) -> np.ndarray:
+    # como os filtros do app: texto comparado como str; na categórica, só nas categorias
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        por_cat = pred(pd.Series(s.cat.categories.astype(str))).to_numpy(dtype=bool)
+        return np.append(por_cat, False)[s.cat.codes.to_numpy()]
+    return pred(s.astype(str)).to_numpy(dtype=bool)
+
+
+def _medir(fn, repeat: int = 3) -> float:
+    tempos = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+    return min(tempos)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--itens", type=int, default=1_000_000, help="itens na tabela")
+    ap.add_argument("--por-nota", type=int, default=20, help="itens por NFe")
+    args = ap.parse_args()
+
+    resultados = {}
+    for nome, montar in (("antes", _antes), ("depois", _depois)):
+        notas = list(_notas(args.itens, args.por_nota))
+        t0 = time.perf_counter()
+        df = montar(notas)
+        dt = time.perf_counter() - t0
+        del notas
+        mb = df.memory_usage(deep=True).sum() / 1e6
+        sigs_fora = set(df["xml_sig"].iloc[: len(df) // 10].unique().tolist())
+        filtros = {
+            "cClassTrib": lambda: df[_mascara(df["cClassTrib"], lambda s: s == "200032")],
+            "Numero contém": lambda: df[_mascara(df["Numero"], lambda s: s.str.contains("123", regex=False))],
+            "remover upload": lambda: df[~df["xml_sig"].isin(sigs_fora)],
+        }
+        resultados[nome] = (mb, dt, {k: _medir(f) for k, f in filtros.items()})
+        print(f"{nome:>6}: {mb:,.0f} MB, montagem {dt:.2f}s, "
+              + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in resultados[nome][2].items()))
+        del df
+
+    a, d = resultados["antes"], resultados["depois"]
+    print(f"memória: {a[0] / d[0]:.1f}x menor; "
+          + ", ".join(f"{k} {a[2][k] / d[2][k]:.1f}x" for k in a[2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark da gravação da aba LANCAMENTOS (xlsx_writer).
+
+- "antes": os campos de entrada lidos linha a linha (df.iterrows + row.get + pd.isna por
+  célula), como o writer fazia
+- "depois": _colunas_entrada, cada coluna convertida de uma vez
+Os dois montam as mesmas linhas a partir da linha-modelo compilada; a última coluna é o
+append_lancamentos inteiro (ZIP de saída incluso) com o caminho novo.
+
+Uso:
+  python benchmarks/bench_writer.py --rows 10000 100000 500000
+"""
+import argparse
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import xlsx_writer  # noqa: E402
+
+MODELO = Path(__file__).resolve().parents[1] / "planilha_modelo.xlsx"
+
+
+def _df(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    d = pd.DataFrame({
+        "Data": [date(2026, 1 + i % 12, 1 + i % 28) for i in range(n)],
+        "Numero": [str(1000 + i // 5) for i in range(n)],
+        "Item/Serviço": [f"Produto {i % 5000} & cia" for i in range(n)],
+        "cClassTrib": rng.choice(["000001", "200032", "410999", ""], n),
+        "Valor da operação": np.round(rng.random(n) * 1000, 2),
+        "vIBS": np.round(rng.random(n), 2),
+        "vCBS": np.round(rng.random(n) * 10, 2),
+        "arquivo": [f"lote.zip:nfe{i // 5}.xml" for i in range(n)],
+        "Fonte do valor": "IBSCBS/vBC",
+    })
+    d.loc[d.index[::97], "vIBS"] = np.nan
+    return d
+
+
+def _linhas_iterrows(compilado: dict, df: pd.DataFrame, inicio: int, estilo_data, epoch):
+    """Caminho antigo: uma Series por linha e row.get/pd.isna por célula."""
+    molde = compilado["molde"].format
+    base = compilado["linhas"]
+    delta = inicio - compilado["template_row"]
+    for i, (_, row) in enumerate(df.iterrows()):
+        caudas = []
+        for parte in compilado["entradas"]:
+            f, s = parte["campo"], parte["s"]
+            val = row.get(f, None)
+            if f == "Data" and pd.notna(val) and isinstance(val, date):
+                caudas.append(f' s="{estilo_data or s}"><v>{xlsx_writer.to_excel(val, epoch)}</v></c>')
+            elif pd.isna(val):
+                caudas.append(f' s="{s}"/>')
+            else:
+                caudas.append(xlsx_writer._cauda(s, val))
+        yield molde(inicio + i, *[b + delta + i for b in base], *caudas)
+
+
+def _medir(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 500_000], help="linhas do df")
+    ap.add_argument("--modelo", type=Path, default=MODELO, help="planilha modelo (.xlsx)")
+    args = ap.parse_args()
+
+    template_bytes = xlsx_writer.ler_modelo(args.modelo)
+    mod = xlsx_writer._modelo(template_bytes)
+    compilado, epoch = mod["compilado"], mod["epoch"]
+    inicio = mod["layout"]["next_row"]
+    estilo_data = (xlsx_writer._styles_com_data(mod) or (None, None))[1]
+
+    print(f"{'linhas':>8} {'antes (linhas/s)':>17} {'depois (linhas/s)':>18} {'ganho':>6} {'xlsx inteiro':>13}")
+    for n in args.rows:
+        df = _df(n)
+        antes = _medir(lambda: sum(1 for _ in _linhas_iterrows(compilado, df, inicio, estilo_data, epoch)))
+        depois = _medir(lambda: sum(1 for _ in xlsx_writer._celulas_novas(compilado, df, inicio, estilo_data, epoch)))
+        total = _medir(lambda: xlsx_writer.append_lancamentos(template_bytes, df))
+        print(f"{n:>8} {n / antes:>17,.0f} {n / depois:>18,.0f} {antes / depois:>5.1f}x "
+              f"{total:>7.2f}s ({n / total:,.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark e conferência dos dois writers da aba LANCAMENTOS: o mesmo df gravado pelo
+xlsx_writer.append_lancamentos (streaming) e pelo append_lancamentos_openpyxl (writer de antes).
+
+Os dois .xlsx são abertos no openpyxl e comparados célula a célula: na LANCAMENTOS, valor
+(fórmulas como texto), formato de número, fonte, preenchimento, borda, alinhamento e proteção;
+nas outras abas, os valores. O df tem texto com &<>", acentos, texto maior que o limite de
+célula, vazios, NaN e linhas sem Data. Sai com código 1 se houver diferença.
+
+Uso:
+  python benchmarks/bench_writer_openpyxl.py --rows 2000
+"""
+import argparse
+import io
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import xlsx_writer  # noqa: E402
+
+MODELO = Path(__file__).resolve().parents[1] / "planilha_modelo.xlsx"
+ESTILOS = ("number_format", "font", "fill", "border", "alignment", "protection")
+
+
+def _df(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    itens = ["Produto & cia", 'Serviço "premium" <10>', "Açúcar cristal 5kg", "", "x" * 40000]
+    d = pd.DataFrame({
+        "Data": [date(2026, 1 + i % 12, 1 + i % 28) for i in range(n)],
+        "Numero": [str(1000 + i // 5) for i in range(n)],
+        "Item/Serviço": [f"{itens[i % len(itens)]} {i}" if i % 7 else itens[i % len(itens)] for i in range(n)],
+        "cClassTrib": rng.choice(["000001", "200032", "410999", ""], n),
+        "Valor da operação": np.round(rng.random(n) * 1000, 2),
+        "vIBS": np.round(rng.random(n), 2),
+        "vCBS": np.round(rng.random(n) * 10, 2),
+        "arquivo": [f"lote.zip:nfe{i // 5}.xml" for i in range(n)],
+        "Fonte do valor": "IBSCBS/vBC",
+    })
+    d.loc[d.index[::97], "vIBS"] = np.nan
+    d.loc[d.index[::113], "Data"] = None
+    return d
+
+
+def _estilo(celula, nome):
+    v = getattr(celula, nome)
+    return v if isinstance(v, str) else repr(v)
+
+
+def _diferencas(a: bytes, b: bytes, limite: int = 10) -> int:
+    wa, wb = load_workbook(io.BytesIO(a)), load_workbook(io.BytesIO(b))
+    if wa.sheetnames != wb.sheetnames:
+        print(f"  abas diferentes: {wa.sheetnames} x {wb.sheetnames}")
+        return 1
+    n = 0
+    for nome in wa.sheetnames:
+        sa, sb = wa[nome], wb[nome]
+        if (sa.max_row, sa.max_column) != (sb.max_row, sb.max_column):
+            n += 1
+            print(f"  {nome}: dimensão {sa.max_row}x{sa.max_column} x {sb.max_row}x{sb.max_column}")
+        # só as células gravadas: a LANCAMENTOS vai até a coluna XFD, quase toda vazia
+        for r, c in sorted(set(sa._cells) | set(sb._cells)):
+            ca, cb = sa.cell(r, c), sb.cell(r, c)
+            campos = ["valor"] if ca.value != cb.value else []
+            if nome == "LANCAMENTOS":
+                campos += [e for e in ESTILOS if _estilo(ca, e) != _estilo(cb, e)]
+            if campos:
+                n += 1
+                if n <= limite:
+                    print(f"  {nome}!{ca.coordinate}: {', '.join(campos)} "
+                          f"({str(ca.value)[:40]!r} x {str(cb.value)[:40]!r})")
+    return n
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, nargs="+", default=[2000], help="linhas do df")
+    ap.add_argument("--modelo", type=Path, default=MODELO, help="planilha modelo (.xlsx)")
+    args = ap.parse_args()
+
+    template_bytes = xlsx_writer.ler_modelo(args.modelo)
+    erros = 0
+    print(f"{'linhas':>8} {'openpyxl':>9} {'streaming':>10} {'ganho':>6}  diferenças")
+    for n in args.rows:
+        df = _df(n)
+        t0 = time.perf_counter()
+        antes = xlsx_writer.append_lancamentos_openpyxl(template_bytes, df)
+        t1 = time.perf_counter()
+        depois = xlsx_writer.append_lancamentos(template_bytes, df)
+        t2 = time.perf_counter()
+        print(f"{n:>8} {t1 - t0:>8.2f}s {t2 - t1:>9.2f}s {(t1 - t0) / (t2 - t1):>5.0f}x")
+        d = _diferencas(antes, depois)
+        print(f"{'':>37}{d}")
+        erros += d
+    sys.exit(1 if erros else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Gerador de XMLs sintéticos (NFe 4.00 com grupo IBSCBS) para os benchmarks.
+Os valores são determinísticos por número da nota (seed = nNF).
+"""
+import random
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+
+def _chave(n: int) -> str:
+    return f"3526{n:040d}"
+
+
+def _det(k: int, rnd: random.Random, ibscbs: bool) -> str:
+    vprod = round(rnd.uniform(1, 5000), 2)
+    vdesc = round(vprod * 0.03, 2)
+    vicms = round(vprod * 0.18, 2)
+    vpis = round(vprod * 0.0165, 2)
+    vcof = round(vprod * 0.076, 2)
+    vbc = round(vprod - vdesc - vicms - vpis - vcof, 2)
+    grupo = ""
+    if ibscbs:
+        grupo = (
+            f"<IBSCBS><CST>000</CST><cClassTrib>{rnd.choice(['000001', '200032', '410004'])}</cClassTrib>"
+            f"<gIBSCBS><vBC>{vbc:.2f}</vBC>"
+            f"<gIBSUF><pIBSUF>0.1000</pIBSUF><vIBSUF>{vbc * 0.001:.2f}</vIBSUF></gIBSUF>"
+            f"<gIBSMun><pIBSMun>0.0000</pIBSMun><vIBSMun>0.00</vIBSMun></gIBSMun>"
+            f"<vIBS>{vbc * 0.001:.2f}</vIBS>"
+            f"<gCBS><pCBS>0.9000</pCBS><vCBS>{vbc * 0.009:.2f}</vCBS></gCBS></gIBSCBS></IBSCBS>"
+        )
+    return (
+        f'<det nItem="{k}"><prod><cProd>{k:06d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f"<xProd>Produto de teste {k} - embalagem {rnd.randint(1, 99)} un</xProd>"
+        f"<NCM>22030000</NCM><CFOP>5102</CFOP><uCom>UN</uCom><qCom>1.0000</qCom>"
+        f"<vProd>{vprod:.2f}</vProd><vDesc>{vdesc:.2f}</vDesc></prod>"
+        f"<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC>"
+        f"<vBC>{vprod:.2f}</vBC><pICMS>18.00</pICMS><vICMS>{vicms:.2f}</vICMS></ICMS00></ICMS>"
+        f"<PIS><PISAliq><CST>01</CST><vBC>{vprod:.2f}</vBC><pPIS>1.65</pPIS><vPIS>{vpis:.2f}</vPIS></PISAliq></PIS>"
+        f"<COFINS><COFINSAliq><CST>01</CST><vBC>{vprod:.2f}</vBC><pCOFINS>7.60</pCOFINS><vCOFINS>{vcof:.2f}</vCOFINS></COFINSAliq></COFINS>"
+        f"{grupo}</imposto></det>"
+    )
+
+
+def nfe_xml(n: int, n_items: int = 10, ibscbs: bool = True, infadic_kb: int = 1) -> bytes:
+    """NFe autorizada (nfeProc) com n_items itens."""
+    rnd = random.Random(n)
+    ch = _chave(n)
+    dets = "".join(_det(k, rnd, ibscbs) for k in range(1, n_items + 1))
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<nfeProc xmlns="{NFE_NS}" versao="4.00"><NFe><infNFe Id="NFe{ch}" versao="4.00">'
+        f"<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>{n}</nNF>"
+        f"<dhEmi>2026-{1 + n % 12:02d}-{1 + n % 28:02d}T10:22:33-03:00</dhEmi><tpNF>1</tpNF></ide>"
+        f"<emit><CNPJ>00000000000191</CNPJ><xNome>Emitente Teste LTDA</xNome></emit>"
+        f"<dest><CNPJ>00000000000272</CNPJ><xNome>Destinatario Teste</xNome></dest>"
+        f"{dets}"
+        f"<total><ICMSTot><vBC>0.00</vBC><vICMS>{n % 997}.50</vICMS><vProd>0.00</vProd>"
+        f"<vPIS>{n % 97}.25</vPIS><vCOFINS>{n % 89}.75</vCOFINS><vNF>0.00</vNF></ICMSTot></total>"
+        f"<infAdic><infCpl>{'Informacoes complementares. ' * (infadic_kb * 37)}</infCpl></infAdic>"
+        f"</infNFe></NFe>"
+        f'<protNFe versao="4.00"><infProt><tpAmb>1</tpAmb><chNFe>{ch}</chNFe><nProt>135260000000001</nProt>'
+        f"<cStat>100</cStat></infProt></protNFe></nfeProc>"
+    ).encode("utf-8")
+
+
+def evento_xml(n: int, tp_evento: str = "110111") -> bytes:
+    """Evento (procEventoNFe) sobre a nota n. 110111 = cancelamento, 110110 = CC-e."""
+    ch = _chave(n)
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<procEventoNFe xmlns="{NFE_NS}" versao="1.00"><evento versao="1.00">'
+        f'<infEvento Id="ID{tp_evento}{ch}01"><cOrgao>35</cOrgao><tpAmb>1</tpAmb>'
+        f"<chNFe>{ch}</chNFe><dhEvento>2026-01-10T10:00:00-03:00</dhEvento>"
+        f"<tpEvento>{tp_evento}</tpEvento><nSeqEvento>1</nSeqEvento>"
+        f'<detEvento versao="1.00"><descEvento>Cancelamento</descEvento><nProt>135260000000001</nProt>'
+        f"<xJust>Erro de digitacao no pedido de venda</xJust></detEvento></infEvento></evento>"
+        f"</procEventoNFe>"
+    ).encode("utf-8")
+
+
+def corpus(n_docs: int, n_items: int = 10, eventos_pct: float = 0.0) -> list[tuple[str, bytes]]:
+    """Lista [(nome, bytes)] misturando NFe e eventos de cancelamento."""
+    out = []
+    for n in range(1, n_docs + 1):
+        if eventos_pct and (n % 100) < eventos_pct * 100:
+            out.append((f"evento_{n}.xml", evento_xml(n)))
+        else:
+            out.append((f"nfe_{n}.xml", nfe_xml(n, n_items)))
+    return out
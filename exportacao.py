@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação dividida da planilha preenchida
+- particionar: separa o df por mês (coluna Data), por cClassTrib ou só por nº de linhas; parte
+  maior que o orçamento de linhas (ou que o limite do Excel para a aba LANCAMENTOS) vira várias
+- gerar_planilhas: cada parte vira um .xlsx feito a partir do modelo
+  (xlsx_writer.append_lancamentos), em paralelo no pool de processos do ingest
+- zip_planilhas: junta os .xlsx num .zip, para um download só
+- Várias planilhas (arquivos), não várias abas LANCAMENTOS num arquivo: as fórmulas e
+  validações das outras abas do modelo apontam para LANCAMENTOS pelo nome
+- Orçamento padrão de linhas por planilha: EXTRATOR_PLANILHA_MAX_LINHAS (padrão 100000)
+
+Sem dependência de Streamlit (os processos do pool rodam tarefas.gerar_planilha).
+"""
+import io
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import ingest
+import tarefas
+from xlsx_writer import FIELDS, linhas_livres
+
+MAX_LINHAS = int(os.environ.get("EXTRATOR_PLANILHA_MAX_LINHAS", "100000"))
+
+MODOS = {
+    "linhas": "Por nº de linhas",
+    "mes": "Por mês (Data)",
+    "cclasstrib": "Por cClassTrib",
+}
+
+
+def _nome(texto: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", texto).strip("_") or "vazio"
+
+
+def _chaves(df: pd.DataFrame, modo: str) -> pd.Series | None:
+    if modo == "mes":
+        if "Data" not in df.columns:
+            return pd.Series("sem_data", index=df.index)
+        datas = pd.to_datetime(df["Data"], errors="coerce")
+        return datas.dt.strftime("%Y-%m").fillna("sem_data")
+    if modo == "cclasstrib":
+        if "cClassTrib" not in df.columns:
+            return pd.Series("sem_cClassTrib", index=df.index)
+        cc = df["cClassTrib"].astype(object).fillna("").astype(str).str.strip()
+        return cc.where(cc != "", "sem_cClassTrib").map(lambda v: f"cClassTrib_{v}")
+    if modo == "linhas":
+        return None
+    raise ValueError(f"modo de divisão desconhecido: {modo!r}")
+
+
+def particionar(df: pd.DataFrame, modo: str, max_linhas: int) -> list[tuple[str, pd.DataFrame]]:
+    """Partes (nome do .xlsx, df) na ordem das chaves; dentro de cada parte, a ordem do df.
+    max_linhas: orçamento de linhas por planilha (quem chama limita a linhas_livres do modelo)."""
+    max_linhas = max(1, int(max_linhas))
+    chaves = _chaves(df, modo)
+    if chaves is None:
+        grupos = [("planilha", df)]
+    else:
+        grupos = [(f"planilha_{_nome(str(k))}", g) for k, g in df.groupby(chaves.to_numpy(), sort=True)]
+
+    partes = []
+    for base, g in grupos:
+        pedacos = range(0, max(len(g), 1), max_linhas)
+        for n, ini in enumerate(pedacos, 1):
+            sufixo = f"_{n:03d}" if len(pedacos) > 1 or chaves is None else ""
+            partes.append((f"{base}{sufixo}.xlsx", g.iloc[ini:ini + max_linhas]))
+    return partes
+
+
+def gerar_planilhas(template_bytes: bytes, partes: list[tuple[str, pd.DataFrame]],
+                    workers: int | None = None):
+    """Gera (nome, bytes do .xlsx) de cada parte, na ordem de `partes`.
+
+    Com mais de uma parte e mais de um processo, as planilhas saem do pool do ingest (no
+    máximo `workers` em voo, para a memória não crescer com o nº de partes). Erros do writer
+    (ex.: xlsx_writer.ModeloNaoSuportado) sobem para o chamador.
+    """
+    workers = ingest.WORKERS if workers is None else max(1, int(workers))
+    # só as colunas que vão para a planilha atravessam o pickle
+    partes = [(nome, p[[c for c in FIELDS if c in p.columns]]) for nome, p in partes]
+    if workers <= 1 or len(partes) <= 1:
+        for nome, p in partes:
+            yield nome, tarefas.gerar_planilha(template_bytes, p)
+        return
+
+    try:
+        pool = ingest.get_pool(workers)
+    except Exception:
+        # ambiente sem suporte a multiprocessing: segue no próprio processo
+        for nome, p in partes:
+            yield nome, tarefas.gerar_planilha(template_bytes, p)
+        return
+
+    pendentes: deque = deque()  # (nome, df, future) na ordem de envio
+
+    def _drain_one():
+        nome, p, fut = pendentes.popleft()
+        try:
+            dados = fut.result()
+        except BrokenProcessPool:
+            # processo do pool morreu (ex.: falta de memória): refaz esta parte aqui
+            ingest.reset_pool()
+            dados = tarefas.gerar_planilha(template_bytes, p)
+        return nome, dados
+
+    for nome, p in partes:
+        try:
+            fut = pool.submit(tarefas.gerar_planilha, template_bytes, p)
+        except (BrokenProcessPool, RuntimeError):
+            ingest.reset_pool()
+            pool = ingest.get_pool(workers)
+            fut = pool.submit(tarefas.gerar_planilha, template_bytes, p)
+        pendentes.append((nome, p, fut))
+        while len(pendentes) >= workers:
+            yield _drain_one()
+    while pendentes:
+        yield _drain_one()
+
+
+def zip_planilhas(itens) -> bytes:
+    """ZIP com os .xlsx de gerar_planilhas (sem recompactar: o .xlsx já é um ZIP)."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as z:
+        for nome, dados in itens:
+            z.writestr(nome, dados)
+    return out.getvalue()
+
+
+def exportar_zip(template_bytes: bytes, df: pd.DataFrame, modo: str, max_linhas: int = MAX_LINHAS,
+                 workers: int | None = None) -> bytes:
+    """particionar + gerar_planilhas + zip_planilhas, com o orçamento limitado ao que cabe no modelo."""
+    max_linhas = min(int(max_linhas), linhas_livres(template_bytes))
+    return zip_planilhas(gerar_planilhas(template_bytes, particionar(df, modo, max_linhas), workers))
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Índices em memória sobre a tabela de itens (refeitos quando os dados mudam, não a cada filtro)
+
+Busca de item ("Buscar item"):
+- Indexa as descrições distintas (Item/Serviço), não as linhas: o mesmo produto em mil notas
+  é indexado uma vez; as linhas de cada descrição ficam agrupadas (CSR) para a volta
+- Descrições em minúsculas e sem acento (NFKD sem marcas combinantes) num buffer único,
+  separadas por \\0, com o deslocamento de início e fim de cada uma
+- Índice invertido de trigramas: trigrama -> descrições que o contêm (ordenadas); as letras
+  são renumeradas no alfabeto que aparece no texto, e o trigrama no fim da descrição é
+  completado com \\0, então termo de 1 ou 2 letras vira uma faixa de chaves
+- Consulta: termos separados por espaço, todos obrigatórios (E), cada um substring da
+  descrição (sem regex). As listas de trigramas são cruzadas da menor para a maior e o que
+  sobra é conferido no buffer (str.find); consulta seletiva não passa pela tabela inteira
+
+Notas ("Buscar nota (nNF)", botões "Baixar XML"):
+- Numero -> linhas e sig -> linhas, agrupadas (CSR) a partir dos códigos das colunas
+  categóricas; os números distintos ficam num array ordenado, então os números que começam
+  por um prefixo são uma faixa contígua (busca binária) e as linhas deles, uma fatia só
+- chave de acesso -> sig, Numero -> sigs (na ordem em que as notas passaram a valer) e
+  sig -> metadados do xml_store (Numero, chave, src), inclusive das notas sem itens
+
+Sem dependência de Streamlit.
+"""
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+_SEP = "\0"
+# marcas combinantes (acentos) que sobram do NFKD
+_COMBINANTES = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+# candidatas a partir das quais a conferência varre o buffer inteiro (re) em vez de uma a uma
+_CONFERIR_VARRENDO = 20000
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acento ("Açúcar" -> "acucar"), como o texto indexado."""
+    return _COMBINANTES.sub("", unicodedata.normalize("NFKD", texto).lower())
+
+
+def _ordem_estavel(chave: np.ndarray, bits: int) -> np.ndarray:
+    """argsort estável de inteiros sem sinal em passadas de 16 bits (LSD): cada passada é o
+    radix sort do numpy, linear, em vez da ordenação por comparação das chaves largas."""
+    ordem = np.arange(len(chave))
+    for desloc in range(0, max(bits, 1), 16):
+        digito = ((chave[ordem] >> np.uint64(desloc)) & np.uint64(0xFFFF)).astype(np.uint16)
+        ordem = ordem[np.argsort(digito, kind="stable")]
+    return ordem
+
+
+def _agrupar(codigos: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """CSR: (posições ordenadas pelo código, início de cada código nelas); código -1 fica de fora."""
+    ordem = np.argsort(codigos, kind="stable")
+    contagem = np.bincount(codigos + 1, minlength=n + 1)
+    inicio = np.concatenate([[0], np.cumsum(contagem)]).astype(np.int64)
+    return ordem[inicio[1]:], inicio[1:] - inicio[1]
+
+
+def indexar_texto(textos: pd.Series) -> dict:
+    """Índice de busca sobre uma coluna de texto (Item/Serviço), uma entrada por linha."""
+    codigos, distintos = pd.factorize(textos, use_na_sentinel=True)
+    codigos = codigos.astype(np.int32)
+    n = len(distintos)
+
+    limpos = pd.Series(distintos, dtype=object).astype(str).str.replace(_SEP, " ", regex=False)
+    texto = normalizar(_SEP.join(limpos.tolist()) + _SEP) if n else ""
+    cp = np.frombuffer(texto.encode("utf-32-le"), dtype=np.uint32)
+    sep = cp == 0
+    fim = np.flatnonzero(sep)  # posição do \0 de cada descrição
+    inicio = np.concatenate([[0], fim + 1])[:-1]
+
+    # alfabeto do texto (\0 é a letra 0) e trigrama de cada posição como número na base V
+    presentes = np.bincount(cp) > 0 if len(cp) else np.zeros(1, dtype=bool)
+    alfabeto = np.flatnonzero(presentes)
+    tipo = np.uint32 if len(alfabeto) ** 3 < 2 ** 32 else np.uint64
+    letra = (np.cumsum(presentes) - 1)[cp].astype(tipo)
+    v = tipo(len(alfabeto))
+    seg = np.concatenate([letra, np.zeros(2, dtype=tipo)])
+    c1, c2 = seg[1:-1], seg[2:]
+    chave = (letra * v + c1) * v + np.where(c1 == 0, tipo(0), c2)
+    del cp, letra, seg, c1, c2
+
+    # pares (trigrama, descrição) sem repetição, ordenados por trigrama e depois descrição
+    desc = np.cumsum(sep, dtype=np.int32) - sep  # nº de \0 antes de cada posição
+    dentro = ~sep  # posições de letra (não \0)
+    chave, desc = chave[dentro], desc[dentro]
+    del sep, dentro
+    ordem = _ordem_estavel(chave, int(len(alfabeto) ** 3).bit_length())
+    chave, desc = chave[ordem], desc[ordem]
+    novo = np.ones(len(chave), dtype=bool)
+    novo[1:] = (chave[1:] != chave[:-1]) | (desc[1:] != desc[:-1])
+    chave, desc = chave[novo], desc[novo]
+    novo = np.ones(len(chave), dtype=bool)
+    novo[1:] = chave[1:] != chave[:-1]
+    primeiro = np.flatnonzero(novo)
+
+    linhas, linhas_inicio = _agrupar(codigos, n)
+    return {
+        "texto": texto,
+        "inicio": inicio,
+        "fim": fim,
+        "alfabeto": alfabeto,
+        "chaves": chave[primeiro],
+        "postings_inicio": np.append(primeiro, len(desc)),
+        "postings": desc,
+        "codigos": codigos,
+        "linhas": linhas,
+        "linhas_inicio": linhas_inicio,
+    }
+
+
+def _letras(indice: dict, termo: str) -> list[int] | None:
+    """Letras do termo no alfabeto do índice (None se alguma não aparece no texto)."""
+    alfabeto = indice["alfabeto"]
+    cp = np.array([ord(c) for c in termo], dtype=alfabeto.dtype)
+    i = np.searchsorted(alfabeto, cp)
+    if (i >= len(alfabeto)).any() or (alfabeto[np.minimum(i, len(alfabeto) - 1)] != cp).any():
+        return None
+    return i.tolist()
+
+
+def _postings(indice: dict, letras: list[int]) -> np.ndarray:
+    """Descrições dos trigramas que começam pelas letras (1 a 3): lista ordenada quando são 3,
+    faixa de listas (pode repetir descrição) quando são menos. Fatia do array, sem cópia."""
+    v = len(indice["alfabeto"])
+    t = (letras + [0, 0])[:3]
+    lo = (t[0] * v + t[1]) * v + t[2]
+    hi = lo + v ** (3 - len(letras))
+    chaves, ini = indice["chaves"], indice["postings_inicio"]
+    a, b = np.searchsorted(chaves, np.array([lo, hi], dtype=np.uint64))
+    return indice["postings"][ini[a]:ini[b]]
+
+
+def _filtrar(indice: dict, cand: np.ndarray, descricoes: np.ndarray) -> np.ndarray:
+    """Candidatas (ordenadas, sem repetição) que estão em descricoes."""
+    if len(cand) * 16 < len(descricoes):
+        # poucas candidatas: busca binária de cada uma (descricoes aqui é uma lista ordenada)
+        i = np.minimum(np.searchsorted(descricoes, cand), max(len(descricoes) - 1, 0))
+        return cand[descricoes[i] == cand] if len(descricoes) else descricoes
+    contem = np.zeros(len(indice["fim"]), dtype=bool)
+    contem[descricoes] = True
+    return cand[contem[cand]]
+
+
+def _conferir(indice: dict, cand: np.ndarray, termo: str, letras: list[int]) -> np.ndarray:
+    """Candidatas cuja descrição contém mesmo o termo."""
+    texto, inicio, fim = indice["texto"], indice["inicio"], indice["fim"]
+    if len(cand) < _CONFERIR_VARRENDO:
+        return cand[[texto.find(termo, inicio[d], fim[d]) >= 0 for d in cand.tolist()]]
+    if len(letras) <= 3:
+        # até 3 letras o trigrama responde sozinho (com o \0 do fim da descrição)
+        achadas = _postings(indice, letras)
+    else:
+        posicoes = np.fromiter((m.start() for m in re.finditer(re.escape(termo), texto)), dtype=np.int64)
+        achadas = np.searchsorted(fim, posicoes)
+    contem = np.zeros(len(fim), dtype=bool)
+    contem[achadas] = True
+    return cand[contem[cand]]
+
+
+def _descricoes(indice: dict, termos: list[str]) -> np.ndarray:
+    """Descrições (ordenadas) que contêm todos os termos, já normalizados."""
+    letras = {}
+    listas = []  # (descrições de um trigrama do termo, termo)
+    for termo in termos:
+        letras[termo] = t = _letras(indice, termo)
+        if t is None:
+            return np.empty(0, dtype=np.int32)
+        listas += [(_postings(indice, t[i:i + 3]), termo) for i in range(len(t) - 2)]
+
+    if listas:
+        listas.sort(key=lambda x: len(x[0]))
+        cand, exato = listas[0][0], {listas[0][1]}
+        for p, termo in listas[1:]:
+            if len(cand) < _CONFERIR_VARRENDO and len(cand) * 64 < len(p):
+                break  # poucas candidatas: sai mais barato conferir no texto que cruzar listas longas
+            cand = _filtrar(indice, cand, p)
+            exato.add(termo)
+        # só o termo de 3 letras cuja lista entrou no cruzamento dispensa a conferência
+        conferir = [t for t in termos if not (len(t) == 3 and t in exato)]
+    else:
+        # só termos de 1 ou 2 letras: descrições da faixa de trigramas do mais longo
+        termo = termos[0]
+        marcadas = np.zeros(len(indice["fim"]), dtype=bool)
+        marcadas[_postings(indice, letras[termo])] = True
+        cand = np.flatnonzero(marcadas).astype(np.int32)
+        conferir = termos[1:]
+    for termo in conferir:
+        if not len(cand):
+            break
+        cand = _conferir(indice, cand, termo, letras[termo])
+    return cand
+
+
+def buscar(indice: dict, consulta: str) -> np.ndarray | None:
+    """Posições (iloc, em ordem) das linhas cuja descrição contém todos os termos da consulta;
+    None quando a consulta não tem termo (sem filtro)."""
+    termos = sorted(set(normalizar(consulta).split()), key=len, reverse=True)
+    if not termos:
+        return None
+    desc = _descricoes(indice, termos)
+    if not len(desc):
+        return np.empty(0, dtype=np.int64)
+
+    codigos, linhas, ini = indice["codigos"], indice["linhas"], indice["linhas_inicio"]
+    tamanhos = ini[desc + 1] - ini[desc]
+    total = int(tamanhos.sum())
+    if total * 8 > len(codigos):
+        # boa parte da tabela: máscara pelos códigos sai mais barata que juntar as listas
+        marcadas = np.zeros(len(ini), dtype=bool)  # 1 a mais: código -1 (vazio) cai no último
+        marcadas[desc] = True
+        return np.flatnonzero(marcadas[codigos])
+    # linhas de cada descrição, concatenadas sem laço em Python
+    desloc = np.repeat(ini[desc] - np.concatenate([[0], np.cumsum(tamanhos)[:-1]]), tamanhos)
+    return np.sort(linhas[desloc + np.arange(total)])
+
+
+def _grupos(s: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """(código de cada linha no array de valores, valores distintos em ordem crescente); -1
+    onde falta valor."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codigos, valores = s.cat.codes.to_numpy(), s.cat.categories
+    else:
+        codigos, valores = pd.factorize(s, use_na_sentinel=True)
+    valores = np.asarray([str(v) for v in valores], dtype=object)
+    ordem = np.argsort(valores, kind="stable")
+    posto = np.full(len(valores) + 1, -1, dtype=np.int32)  # último: código -1 continua -1
+    posto[ordem] = np.arange(len(valores), dtype=np.int32)
+    return posto[codigos], valores[ordem]
+
+
+def indexar_notas(df: pd.DataFrame, notas) -> dict:
+    """Índices de nota sobre o df (colunas Numero e xml_sig) e os metadados das notas que
+    valem (pares (sig, meta) do xml_store)."""
+    vazio = pd.Series([], dtype=object)
+    cod_num, numeros = _grupos(df["Numero"] if "Numero" in df.columns else vazio)
+    cod_sig, sigs = _grupos(df["xml_sig"] if "xml_sig" in df.columns else vazio)
+    numero_linhas, numero_inicio = _agrupar(cod_num, len(numeros))
+    sig_linhas, sig_inicio = _agrupar(cod_sig, len(sigs))
+
+    meta, por_chave, por_numero = {}, {}, {}
+    for sig, m in notas:
+        meta[sig] = m
+        if m.get("chave"):
+            por_chave[m["chave"]] = sig
+        if m.get("Numero"):
+            por_numero.setdefault(str(m["Numero"]), []).append(sig)
+    return {
+        "numeros": numeros,
+        "numero_linhas": numero_linhas,
+        "numero_inicio": numero_inicio,
+        "sig_codigo": {sig: i for i, sig in enumerate(sigs.tolist())},
+        "sig_linhas": sig_linhas,
+        "sig_inicio": sig_inicio,
+        "meta": meta,
+        "chave_sig": por_chave,
+        "numero_sigs": por_numero,
+    }
+
+
+def nota(indice: dict, sig: str) -> dict | None:
+    """Metadados da nota (Numero, chave, src...) ou None se ela não vale mais."""
+    return indice["meta"].get(sig)
+
+
+def linhas_da_nota(indice: dict, sig: str) -> np.ndarray:
+    """Posições (iloc, em ordem) dos itens da nota."""
+    i = indice["sig_codigo"].get(sig)
+    if i is None:
+        return np.empty(0, dtype=np.int64)
+    ini = indice["sig_inicio"]
+    return np.sort(indice["sig_linhas"][ini[i]:ini[i + 1]])
+
+
+def linhas_por_numero(indice: dict, prefixo: str) -> np.ndarray:
+    """Posições (iloc, em ordem) dos itens das notas cujo Numero começa por prefixo."""
+    numeros, ini = indice["numeros"], indice["numero_inicio"]
+    a, b = np.searchsorted(numeros, np.array([prefixo, prefixo + "\U0010ffff"], dtype=object))
+    return np.sort(indice["numero_linhas"][ini[a]:ini[b]])
+
+
+def sigs_da_nota(indice: dict, digitos: str) -> list[str]:
+    """Notas com esse número exato, ou a nota dessa chave de acesso (44 dígitos)."""
+    sig = indice["chave_sig"].get(digitos)
+    if sig is not None:
+        return [sig]
+    return list(indice["numero_sigs"].get(digitos, ()))
+
+
+def buscar_nota(indice: dict, digitos: str) -> np.ndarray:
+    """Itens da busca de nota: a nota da chave de acesso, se os dígitos forem uma chave
+    conhecida; senão, as notas cujo número começa pelos dígitos."""
+    sig = indice["chave_sig"].get(digitos)
+    if sig is not None:
+        return linhas_da_nota(indice, sig)
+    return linhas_por_numero(indice, digitos)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestão paralela dos XMLs (NFe/NFC-e)
+- parse_documents: distribui o parse entre processos (ProcessPoolExecutor) e devolve os
+  resultados na MESMA ordem de entrada -> deduplicação, totais e erros ficam determinísticos
+- Nº de processos: variável de ambiente EXTRATOR_WORKERS (padrão: nº de CPUs; 1 = sem pool)
+- Duplicatas saem antes de tudo: a assinatura rápida (nfe_parser.quick_signature, busca nos
+  bytes) já identifica a nota repetida, sem parse nem cache
+- Antes do pool, cada XML passa pelo parse_cache (sha1 do conteúdo): rerun não re-parseia
+  (e, com o cache em disco, nem um reinício do servidor); ao terminar, o cache é gravado
+- Itens das notas acumulados por coluna (acumular_itens), não em um dict por linha, e o df
+  sai compacto (itens_para_df): texto repetido como categoria, Item/Serviço em Arrow
+
+Sem dependência de Streamlit. O que roda nos processos do pool fica no módulo tarefas.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import parse_cache
+import tarefas
+from nfe_parser import parse_nfe_document, quick_signature
+
+WORKERS = int(os.environ.get("EXTRATOR_WORKERS", "0") or 0) or (os.cpu_count() or 1)
+PARALLEL_MIN_XMLS = 32  # abaixo disso sai mais barato parsear no próprio processo
+CHUNK_SIZE = 64  # XMLs por tarefa enviada ao pool (amortiza pickle/IPC)
+MAX_INFLIGHT = 4  # tarefas em voo por processo (limita a memória em ZIPs enormes)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _mp_context():
+    # Nada de "fork": o servidor do Streamlit tem várias threads (o filho pode herdar um lock
+    # preso) e no macOS fork sem exec não é seguro. "forkserver" (Linux/macOS) cria cada
+    # processo a partir de um servidor limpo, que já importou o módulo tarefas; no Windows,
+    # "spawn". Nos dois o processo novo roda o __main__ do pai: o app.py aponta o __spec__ dele
+    # para o tarefas, e é só isso que o processo importa.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([tarefas.__name__])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool único por processo do app (reaproveitado entre reruns do Streamlit e também usado
+    pela exportação dividida da planilha)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context())
+            _pool_workers = workers
+        return _pool
+
+
+def reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def duplicate_stub(sig: str) -> dict:
+    """"Documento" de um XML pulado por duplicidade: só a assinatura."""
+    return {"sig": sig, "duplicado": True}
+
+
+def _with_cache(itens, pular):
+    """(origem, payload) -> [origem, payload, chave_cache, doc|None]; doc já vem do cache quando
+    possível. Duplicatas (assinatura rápida já vista) viram stub sem chave_cache: não são parseadas.
+    """
+    vistos: set[str] = set()
+    for src, payload in itens:
+        if isinstance(payload, str):
+            yield [src, payload, None, None]
+            continue
+        sig = quick_signature(payload)
+        if sig is not None:
+            if sig in vistos or (pular is not None and pular(sig)):
+                yield [src, payload, None, duplicate_stub(sig)]
+                continue
+            vistos.add(sig)
+        key = parse_cache.content_key(payload)
+        yield [src, payload, key, parse_cache.get(key)]
+
+
+def _finish(item):
+    src, payload, key, doc = item
+    if key is None:
+        return src, payload, doc  # erro de leitura (doc None) ou duplicata
+    return src, payload, parse_cache.bind(doc, src)
+
+
+def _parse_serial(itens):
+    for item in itens:
+        src, payload, key, doc = item
+        if doc is None and key is not None:
+            item[3] = parse_nfe_document(payload, src)
+            parse_cache.put(key, item[3])
+        yield _finish(item)
+
+
+def parse_documents(fontes, workers: int | None = None, pular=None):
+    """Parse de vários XMLs, em paralelo quando compensa.
+
+    fontes: iterável de (origem, payload). payload são os bytes do XML ou uma str com a
+            mensagem de erro de leitura daquela origem (é repassada sem parse, na ordem).
+    pular: função opcional sig -> bool com as notas que o chamador já tem.
+    Gera (origem, payload, doc) na ordem de entrada; doc é o retorno de parse_nfe_document
+    (None quando payload é erro). XMLs já vistos (mesmo sha1) saem do parse_cache sem parse.
+    Nota repetida (mesma assinatura rápida de outra fonte anterior, ou pular(sig)) não é
+    parseada: doc = duplicate_stub(sig). As que precisam de parse para ter assinatura são
+    deduplicadas pelo chamador, como antes.
+    """
+    try:
+        yield from _parse_documents(fontes, workers, pular)
+    finally:
+        # uma transação só para o lote inteiro (também se o rerun for interrompido)
+        parse_cache.flush()
+
+
+def _parse_documents(fontes, workers: int | None, pular):
+    workers = WORKERS if workers is None else max(1, int(workers))
+    it = _with_cache(fontes, pular)
+    # só conta para decidir o paralelismo o que realmente precisa de parse
+    head = []
+    misses = 0
+    for item in it:
+        head.append(item)
+        if item[2] is not None and item[3] is None:
+            misses += 1
+            if misses >= PARALLEL_MIN_XMLS:
+                break
+    if workers <= 1 or misses < PARALLEL_MIN_XMLS:
+        yield from _parse_serial(chain(head, it))
+        return
+
+    try:
+        pool = get_pool(workers)
+    except Exception:
+        # ambiente sem suporte a multiprocessing: segue no próprio processo
+        yield from _parse_serial(chain(head, it))
+        return
+
+    todos = chain(head, it)
+    pendentes: deque = deque()  # (chunk, itens a parsear, future) na ordem de envio
+
+    def _drain_one():
+        chunk, todo, fut = pendentes.popleft()
+        if fut is not None:
+            try:
+                docs = fut.result()
+            except BrokenProcessPool:
+                # processo do pool morreu (ex.: falta de memória): refaz este lote aqui
+                reset_pool()
+                docs = tarefas.parse_lote([(item[0], item[1]) for item in todo])
+            for item, doc in zip(todo, docs):
+                item[3] = doc
+                parse_cache.put(item[2], doc)
+        for item in chunk:
+            yield _finish(item)
+
+    while True:
+        chunk = []
+        todo = []
+        # lote = CHUNK_SIZE XMLs a parsear (acertos do cache só acompanham, na ordem)
+        for item in todos:
+            chunk.append(item)
+            if item[2] is not None and item[3] is None:
+                todo.append(item)
+                if len(todo) >= CHUNK_SIZE:
+                    break
+        if not chunk:
+            break
+        fut = None
+        if todo:
+            xmls = [(item[0], item[1]) for item in todo]
+            try:
+                fut = pool.submit(tarefas.parse_lote, xmls)
+            except (BrokenProcessPool, RuntimeError):
+                reset_pool()
+                pool = get_pool(workers)
+                fut = pool.submit(tarefas.parse_lote, xmls)
+        pendentes.append((chunk, todo, fut))
+        while len(pendentes) >= workers * MAX_INFLIGHT:
+            yield from _drain_one()
+
+    while pendentes:
+        yield from _drain_one()
+
+
+# -----------------------------
+# Itens -> DataFrame da tabela
+# -----------------------------
+# Colunas de texto com poucos valores distintos (repetidos a cada item): categóricas
+COLS_CATEGORIA = ("Numero", "cClassTrib", "arquivo", "Fonte do valor", "xml_sig")
+try:
+    # texto em Arrow com NaN como ausente (mesma semântica do object); pandas/pyarrow antigos: object
+    _TEXTO_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)
+except (TypeError, ImportError):
+    _TEXTO_DTYPE = None
+
+
+def acumular_itens(colunas: dict, rows: list[dict], sig: str) -> None:
+    """Itens (doc["rows"]) de uma nota acrescentados em `colunas` (campo -> lista de valores),
+    sem guardar um dict por linha; a coluna xml_sig recebe a assinatura da nota."""
+    if not rows:
+        return
+    n = len(colunas["xml_sig"]) if colunas else 0
+    chaves = list(rows[0])
+    for k in chaves:
+        if k not in colunas:
+            colunas[k] = [None] * n
+    colunas.setdefault("xml_sig", []).extend([sig] * len(rows))
+    if len(colunas) == len(chaves) + 1 and all(list(r) == chaves for r in rows):
+        # caso normal (linhas do mesmo parser, mesmas chaves na mesma ordem): transpõe
+        for k, valores in zip(chaves, zip(*[r.values() for r in rows])):
+            colunas[k].extend(valores)
+        return
+    for k, col in colunas.items():
+        if k != "xml_sig":
+            col.extend([r.get(k) for r in rows])
+
+
+def _datas(valores: list) -> np.ndarray:
+    """Coluna Data como date (NaT quando inválida); um objeto date por dia, não por item."""
+    codigos, dias = pd.factorize(pd.to_datetime(pd.Series(valores, dtype=object), errors="coerce"))
+    objs = np.empty(len(dias) + 1, dtype=object)
+    objs[:-1] = dias.date
+    objs[-1] = pd.NaT
+    return objs[codigos]
+
+
+def itens_para_df(colunas: dict) -> pd.DataFrame:
+    """Colunas de acumular_itens -> DataFrame compacto (xml_sig por último, como antes)."""
+    if not colunas:
+        return pd.DataFrame()
+    cols = {}
+    for k, valores in colunas.items():
+        if k == "Data":
+            cols[k] = _datas(valores)
+        elif k in COLS_CATEGORIA:
+            cols[k] = pd.Categorical(valores)
+        elif k == "Item/Serviço" and _TEXTO_DTYPE is not None:
+            cols[k] = pd.array(valores, dtype=_TEXTO_DTYPE)
+        else:
+            # números: mesma inferência do DataFrame(rows); atalho quando não há None
+            arr = np.asarray(valores)
+            cols[k] = arr if arr.dtype.kind in "if" else pd.Series(valores)
+    ordem = [k for k in colunas if k != "xml_sig"] + ["xml_sig"]
+    return pd.DataFrame({k: cols[k] for k in ordem})
+
+
+def concat_itens(df: pd.DataFrame, novo: pd.DataFrame) -> pd.DataFrame:
+    """pd.concat que mantém as colunas categóricas (categorias diferentes viram a união)."""
+    out = pd.concat([df, novo], ignore_index=True).infer_objects()
+    for k in COLS_CATEGORIA:
+        a, b = df.get(k), novo.get(k)
+        if (isinstance(getattr(a, "dtype", None), pd.CategoricalDtype)
+                and isinstance(getattr(b, "dtype", None), pd.CategoricalDtype)
+                and not isinstance(out[k].dtype, pd.CategoricalDtype)):
+            out[k] = union_categoricals([a, b], sort_categories=True)
+    return out
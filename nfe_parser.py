@@ -0,0 +1,749 @@
+# -*- coding: utf-8 -*-
+"""
+Parser de NFe/NFC-e (IBS/CBS)
+- parse_nfe_document: monta a árvore do XML UMA vez e devolve tudo que o app usa
+  (chave, assinatura, nNF, data de emissão, totais ICMSTot, itens e evento de cancelamento)
+- Mantém as funções antigas (_parse_items_from_xml, _parse_tax_totals_from_xml, ...) como atalhos
+- Motor de parse: lxml (XPath pré-compilado no namespace da NFe) ou ElementTree
+  Escolha via variável de ambiente EXTRATOR_XML_ENGINE=lxml|etree (padrão: lxml, se instalado)
+
+Sem dependência de Streamlit: pode ser importado por scripts e processos auxiliares.
+"""
+import codecs
+import hashlib
+import io
+import math
+import os
+import re
+from datetime import datetime, date
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as LET
+except ImportError:  # lxml é opcional: sem ele fica tudo no ElementTree
+    LET = None
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+# Versão do formato devolvido por parse_nfe_document. Suba este número sempre que mudar
+# colunas/valores dos itens, totais ou cancelamento: invalida o cache de parse em disco.
+PARSER_VERSION = 3
+
+XML_ENGINE = os.environ.get("EXTRATOR_XML_ENGINE", "lxml").strip().lower()
+
+
+# -----------------------------
+# XML helpers
+# -----------------------------
+def _local(tag: str) -> str:
+    # "{ns}Tag" -> "Tag"
+    return tag.split("}", 1)[-1] if "}" in tag else tag
+
+def _find_text(elem: ET.Element, path: str) -> str | None:
+    x = elem.find(path)
+    if x is None or x.text is None:
+        return None
+    return x.text.strip()
+
+def _find(elem: ET.Element, path: str):
+    return elem.find(path)
+
+def _findall(elem: ET.Element, path: str) -> list:
+    return elem.findall(path)
+
+
+# Motor ElementTree: caminhos "{*}" reinterpretados a cada chamada (também serve p/ árvore lxml)
+_ET_ENGINE = {"text": _find_text, "find": _find, "findall": _findall}
+
+
+def _date_from_text(t: str) -> date | None:
+    try:
+        # dhEmi pode ser "2026-01-08T10:22:33-03:00"
+        if "T" in t:
+            # remove timezone para parse mais simples
+            base = t.split("T")[0]
+            return datetime.fromisoformat(base).date() if len(base) > 10 else datetime.fromisoformat(t[:19]).date()
+        return datetime.fromisoformat(t).date()
+    except Exception:
+        try:
+            return datetime.strptime(t[:10], "%Y-%m-%d").date()
+        except Exception:
+            return None
+
+def _parse_date(root: ET.Element, eng: dict = _ET_ENGINE) -> date | None:
+    """
+    Tenta pegar data de emissão:
+      - NFe/infNFe/ide/dhEmi (ISO datetime) ou dEmi (YYYY-MM-DD)
+    """
+    find_text = eng["text"]
+    for p in [
+        ".//{*}infNFe/{*}ide/{*}dhEmi",
+        ".//{*}infNFe/{*}ide/{*}dEmi",
+        ".//{*}ide/{*}dhEmi",
+        ".//{*}ide/{*}dEmi",
+    ]:
+        t = find_text(root, p)
+        if not t:
+            continue
+        d = _date_from_text(t)
+        if d is not None:
+            return d
+    return None
+
+def _parse_nnf(root: ET.Element, eng: dict = _ET_ENGINE) -> str | None:
+    # Número da NF: ide/nNF
+    for p in [".//{*}infNFe/{*}ide/{*}nNF", ".//{*}ide/{*}nNF"]:
+        t = eng["text"](root, p)
+        if t:
+            return t
+    return None
+
+
+def _to_float(x: str | None):
+    try:
+        if x in (None, ""):
+            return None
+        # suporta vírgula decimal
+        s = str(x).strip().replace(",", ".")
+        return float(s)
+    except Exception:
+        return None
+
+def _to_float0(x: str | None) -> float:
+    v = _to_float(x)
+    return float(v) if v is not None else 0.0
+
+
+# -----------------------------
+# Valores monetários em centavos (int): soma e comparação exatas, sem float
+# -----------------------------
+# coluna em float -> coluna irmã em centavos (ausente/inválido = 0)
+CENTAVOS_COLS = {
+    "Valor da operação": "vBC_cent",
+    "vIBS": "vIBS_cent",
+    "vCBS": "vCBS_cent",
+    "vProd": "vProd_cent",
+    "vDesc": "vDesc_cent",
+    "vICMS_item": "vICMS_item_cent",
+    "vPIS_item": "vPIS_item_cent",
+    "vCOFINS_item": "vCOFINS_item_cent",
+}
+_RE_DECIMAL = re.compile(r"([+-]?)(\d*)(?:\.(\d*))?")
+
+
+def _to_centavos(x: str | None, virgula: bool = True) -> int:
+    """Texto decimal do XML -> centavos, direto do texto (sem passar por float).
+    Mais de 2 casas: arredonda meio para cima. Vazio/inválido -> 0 (como _to_float0).
+    virgula=False segue a regra dos totais (float() puro: "1,5" é inválido)."""
+    if x is None:
+        return 0
+    t = str(x).strip()
+    if virgula:
+        t = t.replace(",", ".")
+    m = _RE_DECIMAL.fullmatch(t)
+    if m is None or not (m.group(2) or m.group(3)):
+        # formas raras que o float aceita e a regex não (ex.: "1e3"): segue pelo float
+        try:
+            v = float(t)
+        except ValueError:
+            return 0
+        return int(round(v * 100)) if math.isfinite(v) else 0
+    sinal, inteiro, frac = m.group(1), m.group(2) or "0", m.group(3) or ""
+    cent = int(inteiro) * 100 + int((frac + "00")[:2])
+    if len(frac) > 2 and frac[2] >= "5":
+        cent += 1
+    return -cent if sinal == "-" else cent
+
+
+# -----------------------------
+# Extração a partir da árvore já montada
+# -----------------------------
+def _key_from_root(root: ET.Element, eng: dict = _ET_ENGINE) -> str:
+    find_text = eng["text"]
+    # 1) infNFe @Id (mais comum)
+    inf = eng["find"](root, ".//{*}infNFe")
+    if inf is not None:
+        idv = inf.attrib.get("Id") or inf.attrib.get("id") or ""
+        digits = "".join(ch for ch in idv if ch.isdigit())
+        if len(digits) >= 44:
+            return digits[-44:]
+
+    # 2) chNFe em protocolos
+    ch = (
+        find_text(root, ".//{*}protNFe/{*}infProt/{*}chNFe")
+        or find_text(root, ".//{*}infProt/{*}chNFe")
+        or find_text(root, ".//{*}chNFe")
+        or ""
+    )
+    ch_digits = "".join(chh for chh in ch if chh.isdigit())
+    if len(ch_digits) >= 44:
+        return ch_digits[-44:]
+    return ""
+
+
+def _row_from_det(det: ET.Element, filename: str, emissao: date | None, nnf: str | None,
+                  eng: dict = _ET_ENGINE) -> dict | None:
+    """Linha de um item (det). None quando o item não tem IBSCBS."""
+    find_text = eng["text"]
+    xprod = find_text(det, ".//{*}prod/{*}xProd") or ""
+    # Componentes do item (para validação por subtração)
+    vprod = find_text(det, ".//{*}prod/{*}vProd")
+    vdesc = find_text(det, ".//{*}prod/{*}vDesc")
+
+    # Tributos por ITEM (quando existirem)
+    vicms_item = find_text(det, ".//{*}imposto/{*}ICMS//{*}vICMS")
+    vpis_item = find_text(det, ".//{*}imposto/{*}PIS//{*}vPIS")
+    vcof_item = find_text(det, ".//{*}imposto/{*}COFINS//{*}vCOFINS")
+
+    ibscbs = eng["find"](det, ".//{*}imposto/{*}IBSCBS")
+    if ibscbs is None:
+        # alguns XML podem não ter IBSCBS -> ignora item
+        return None
+
+    cclass = find_text(ibscbs, ".//{*}cClassTrib") or ""
+    vbc = find_text(ibscbs, ".//{*}vBC")
+    vibs = find_text(ibscbs, ".//{*}vIBS")
+    vcbs = find_text(ibscbs, ".//{*}vCBS")
+    vbc_f = _to_float(vbc)
+    vibs_f = _to_float(vibs)
+    vcbs_f = _to_float(vcbs)
+
+    # Fonte do valor (base)
+    fonte = "IBSCBS/vBC" if vbc_f is not None else ""
+
+    return {
+        "Data": emissao,
+        "Numero": nnf,
+        "Item/Serviço": xprod,
+        "cClassTrib": cclass,
+        "Valor da operação": vbc_f,
+        "vIBS": vibs_f,
+        "vCBS": vcbs_f,
+        # Componentes para validação por subtração (sempre em float)
+        "vProd": _to_float0(vprod),
+        "vDesc": _to_float0(vdesc),
+        "vICMS_item": _to_float0(vicms_item),
+        "vPIS_item": _to_float0(vpis_item),
+        "vCOFINS_item": _to_float0(vcof_item),
+        "arquivo": filename,
+        "Fonte do valor": fonte,
+        # Mesmos valores em centavos (validação e KPIs somam em inteiro)
+        "vBC_cent": _to_centavos(vbc),
+        "vIBS_cent": _to_centavos(vibs),
+        "vCBS_cent": _to_centavos(vcbs),
+        "vProd_cent": _to_centavos(vprod),
+        "vDesc_cent": _to_centavos(vdesc),
+        "vICMS_item_cent": _to_centavos(vicms_item),
+        "vPIS_item_cent": _to_centavos(vpis_item),
+        "vCOFINS_item_cent": _to_centavos(vcof_item),
+    }
+
+
+def _items_from_root(root: ET.Element, filename: str, emissao: date | None, nnf: str | None,
+                     eng: dict = _ET_ENGINE) -> list[dict]:
+    rows: list[dict] = []
+    dets = eng["findall"](root, ".//{*}infNFe/{*}det") or eng["findall"](root, ".//{*}det")
+    for det in dets:
+        row = _row_from_det(det, filename, emissao, nnf, eng)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+_TOTAIS = ("vICMS", "vPIS", "vCOFINS")
+_TOTAIS_ZERO = {"vICMS": 0.0, "vPIS": 0.0, "vCOFINS": 0.0}
+_TOTAIS_CENT_ZERO = {"vICMS": 0, "vPIS": 0, "vCOFINS": 0}
+
+
+def _totals_texts(root: ET.Element, eng: dict = _ET_ENGINE) -> dict:
+    find_text = eng["text"]
+    return {
+        "vICMS": find_text(root, ".//{*}ICMSTot/{*}vICMS"),
+        "vPIS": find_text(root, ".//{*}ICMSTot/{*}vPIS"),
+        "vCOFINS": find_text(root, ".//{*}ICMSTot/{*}vCOFINS"),
+    }
+
+
+def _totals_from_texts(texts: dict) -> dict:
+    def _to_float(x: str | None) -> float:
+        try:
+            return float(x) if x not in (None, "") else 0.0
+        except Exception:
+            return 0.0
+
+    return {k: _to_float(texts[k]) for k in _TOTAIS}
+
+
+def _totals_cent_from_texts(texts: dict) -> dict:
+    # mesma regra dos totais em float (sem vírgula decimal), em centavos
+    return {k: _to_centavos(texts[k], virgula=False) for k in _TOTAIS}
+
+
+def _totals_from_root(root: ET.Element, eng: dict = _ET_ENGINE) -> dict:
+    return _totals_from_texts(_totals_texts(root, eng))
+
+
+def _totals_doc(root, eng: dict) -> dict:
+    """Campos "totais" (float) e "totais_cent" (centavos) do documento."""
+    texts = _totals_texts(root, eng)
+    return {"totais": _totals_from_texts(texts), "totais_cent": _totals_cent_from_texts(texts)}
+
+
+def _cancel_from_root(root: ET.Element, eng: dict = _ET_ENGINE) -> dict | None:
+    find_text = eng["text"]
+    # Procura tpEvento=110111 (Cancelamento)
+    tp = find_text(root, ".//{*}detEvento/{*}tpEvento") or find_text(root, ".//{*}tpEvento")
+    if tp != "110111":
+        return None
+
+    ch = find_text(root, ".//{*}infEvento/{*}chNFe") or find_text(root, ".//{*}chNFe") or ""
+    dh = find_text(root, ".//{*}infEvento/{*}dhEvento") or find_text(root, ".//{*}dhEvento") or ""
+    nprot = find_text(root, ".//{*}infEvento/{*}nProt") or find_text(root, ".//{*}nProt") or ""
+    xjust = find_text(root, ".//{*}detEvento/{*}xJust") or find_text(root, ".//{*}xJust") or ""
+
+    return {"chNFe": ch, "dhEvento": dh, "nProt": nprot, "xJust": xjust}
+
+
+def _signature_from_key(chave: str, xml_bytes: bytes) -> str:
+    if chave:
+        return f"ch:{chave}"
+    return "sha1:" + hashlib.sha1(xml_bytes).hexdigest()
+
+
+def _document_sig(chave: str, xml_bytes: bytes) -> str:
+    """sig do documento: a assinatura rápida quando ela responde (é com ela que o ingest
+    deduplica antes do parse; XML quebrado depois do cabeçalho mantém o "ch:" dela), senão a
+    chave achada no parse ou o sha1. Mesma regra de _xml_signature."""
+    return quick_signature(xml_bytes) or _signature_from_key(chave, xml_bytes)
+
+
+# -----------------------------
+# Motor lxml: XPath pré-compilado (namespace da NFe)
+# -----------------------------
+# Todos os caminhos usados acima, no formato ElementTree. Cada um vira um etree.XPath
+# compilado uma única vez no import ("{*}Tag" -> "nfe:Tag").
+_NFE_PATHS = [
+    ".//{*}infNFe/{*}ide/{*}dhEmi",
+    ".//{*}infNFe/{*}ide/{*}dEmi",
+    ".//{*}ide/{*}dhEmi",
+    ".//{*}ide/{*}dEmi",
+    ".//{*}infNFe/{*}ide/{*}nNF",
+    ".//{*}ide/{*}nNF",
+    ".//{*}infNFe",
+    ".//{*}protNFe/{*}infProt/{*}chNFe",
+    ".//{*}infProt/{*}chNFe",
+    ".//{*}chNFe",
+    ".//{*}infNFe/{*}det",
+    ".//{*}det",
+    ".//{*}prod/{*}xProd",
+    ".//{*}prod/{*}vProd",
+    ".//{*}prod/{*}vDesc",
+    ".//{*}imposto/{*}ICMS//{*}vICMS",
+    ".//{*}imposto/{*}PIS//{*}vPIS",
+    ".//{*}imposto/{*}COFINS//{*}vCOFINS",
+    ".//{*}imposto/{*}IBSCBS",
+    ".//{*}cClassTrib",
+    ".//{*}vBC",
+    ".//{*}vIBS",
+    ".//{*}vCBS",
+    ".//{*}ICMSTot/{*}vICMS",
+    ".//{*}ICMSTot/{*}vPIS",
+    ".//{*}ICMSTot/{*}vCOFINS",
+    ".//{*}detEvento/{*}tpEvento",
+    ".//{*}tpEvento",
+    ".//{*}infEvento/{*}chNFe",
+    ".//{*}infEvento/{*}dhEvento",
+    ".//{*}dhEvento",
+    ".//{*}infEvento/{*}nProt",
+    ".//{*}nProt",
+    ".//{*}detEvento/{*}xJust",
+    ".//{*}xJust",
+]
+
+_XP_ALL: dict = {}
+_XP_FIRST: dict = {}
+_XP_TEXT: dict = {}
+_LXML_PARSER = None
+
+if LET is not None:
+    _ns = {"nfe": NFE_NS}
+    # sem entidades externas/rede; smart_strings=False evita guardar referência ao nó
+    _LXML_PARSER = LET.XMLParser(resolve_entities=False, no_network=True)
+    for _p in _NFE_PATHS:
+        _x = _p.replace("{*}", "nfe:")
+        _XP_ALL[_p] = LET.XPath(_x, namespaces=_ns)
+        _XP_FIRST[_p] = LET.XPath(f"({_x})[1]", namespaces=_ns)
+        _XP_TEXT[_p] = LET.XPath(f"({_x})[1]/text()", namespaces=_ns, smart_strings=False)
+    del _ns, _p, _x
+
+
+def _xp_text(elem, path: str) -> str | None:
+    r = _XP_TEXT[path](elem)
+    return r[0].strip() if r else None
+
+def _xp_find(elem, path: str):
+    r = _XP_FIRST[path](elem)
+    return r[0] if r else None
+
+def _xp_findall(elem, path: str) -> list:
+    return _XP_ALL[path](elem)
+
+
+_LXML_ENGINE = {"text": _xp_text, "find": _xp_find, "findall": _xp_findall}
+
+
+def _parse_root(xml_bytes: bytes, engine: str | None = None):
+    """Monta a árvore com o motor escolhido. Devolve (root, eng).
+    XML fora do namespace da NFe (raro) usa os caminhos "{*}", que o lxml também entende.
+    Levanta exceção se o XML for inválido.
+    """
+    engine = (engine or XML_ENGINE)
+    if engine == "lxml" and LET is not None:
+        root = LET.fromstring(xml_bytes, _LXML_PARSER)
+        if isinstance(root.tag, str) and root.tag.startswith("{" + NFE_NS + "}"):
+            return root, _LXML_ENGINE
+        return root, _ET_ENGINE
+    return ET.fromstring(xml_bytes), _ET_ENGINE
+
+
+# -----------------------------
+# Modo streaming (iterparse): XMLs muito grandes (centenas de det / infAdic enorme)
+# -----------------------------
+# A partir deste tamanho parse_nfe_document lê o XML em streaming em vez de montar a árvore
+STREAM_MIN_BYTES = int(os.environ.get("EXTRATOR_STREAM_MIN_BYTES", str(2 * 1024 * 1024)))
+
+# Tags fora dos itens cujo texto é guardado durante o streaming
+_STREAM_TAGS = {"dhEmi", "dEmi", "nNF", "chNFe", "vICMS", "vPIS", "vCOFINS",
+                "tpEvento", "dhEvento", "nProt", "xJust"}
+
+
+def _stream_key(path: str) -> tuple[str, str]:
+    # ".//{*}ICMSTot/{*}vICMS" -> ("ICMSTot", "vICMS"); ".//{*}chNFe" -> ("", "chNFe")
+    parts = [c.replace("{*}", "") for c in path.split("/") if c not in ("", ".")]
+    return (parts[-2] if len(parts) > 1 else "", parts[-1])
+
+_STREAM_KEYS = {p: _stream_key(p) for p in _NFE_PATHS}
+
+
+def _stream_text(texts: dict, path: str) -> str | None:
+    return texts.get(_STREAM_KEYS[path])
+
+
+# "Motor" sobre os textos coletados no streaming: permite reaproveitar _parse_date,
+# _parse_nnf, _totals_from_root e _cancel_from_root sem montar a árvore.
+_STREAM_ENGINE = {"text": _stream_text, "find": None, "findall": None}
+
+
+def _iterparse_nfe(xml_bytes: bytes, filename: str, info: dict, engine: str | None = None):
+    """Gera as linhas dos itens (det) uma a uma, limpando cada elemento logo após o uso.
+    Preenche `info` com o que fica fora dos itens:
+      - "Id": atributo Id do primeiro infNFe
+      - "texts": primeiro texto de cada tag de _STREAM_TAGS, por (pai, tag) e por ("", tag)
+    """
+    engine = (engine or XML_ENGINE)
+    use_lxml = engine == "lxml" and LET is not None
+    if use_lxml:
+        events = LET.iterparse(io.BytesIO(xml_bytes), events=("start", "end"),
+                               resolve_entities=False, no_network=True)
+    else:
+        events = ET.iterparse(io.BytesIO(xml_bytes), events=("start", "end"))
+
+    texts = info.setdefault("texts", {})
+    stack: list[str] = []  # nomes locais dos ancestrais
+    in_det = 0
+    header = None  # (emissao, nnf): ide vem antes dos det no layout da NFe
+
+    for ev, elem in events:
+        local = _local(elem.tag) if isinstance(elem.tag, str) else ""
+        if ev == "start":
+            if local == "infNFe" and "Id" not in info:
+                info["Id"] = elem.get("Id") or elem.get("id") or ""
+            elif local == "det":
+                in_det += 1
+            stack.append(local)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else ""
+        if local == "det":
+            in_det -= 1
+            if in_det == 0 and (parent == "infNFe" or "Id" not in info):
+                if header is None:
+                    header = (_parse_date(texts, _STREAM_ENGINE), _parse_nnf(texts, _STREAM_ENGINE))
+                eng = _LXML_ENGINE if use_lxml and elem.tag.startswith("{" + NFE_NS + "}") else _ET_ENGINE
+                row = _row_from_det(elem, filename, header[0], header[1], eng)
+                if row is not None:
+                    yield row
+        elif in_det:
+            # filho de det: fica inteiro até o fim do item
+            continue
+        elif local in _STREAM_TAGS:
+            t = elem.text.strip() if elem.text is not None else None
+            texts.setdefault((parent, local), t)
+            texts.setdefault(("", local), t)
+
+        # libera o elemento (e, no lxml, os irmãos anteriores já processados)
+        elem.clear()
+        if use_lxml:
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def iter_items_from_xml(xml_bytes: bytes, filename: str, engine: str | None = None):
+    """Versão streaming de _parse_items_from_xml: gera 1 dict por det (mesmas colunas),
+    sem manter a árvore inteira em memória. XML inválido encerra a geração no ponto do erro.
+    """
+    try:
+        yield from _iterparse_nfe(xml_bytes, filename, {}, engine)
+    except Exception:
+        return
+
+
+def _parse_document_streaming(xml_bytes: bytes, filename: str, engine: str | None = None) -> dict:
+    info: dict = {}
+    rows = list(_iterparse_nfe(xml_bytes, filename, info, engine))
+    texts = info.get("texts", {})
+
+    chave = ""
+    digits = "".join(ch for ch in info.get("Id", "") if ch.isdigit())
+    if len(digits) >= 44:
+        chave = digits[-44:]
+    else:
+        ch = _stream_text(texts, ".//{*}infProt/{*}chNFe") or _stream_text(texts, ".//{*}chNFe") or ""
+        ch_digits = "".join(chh for chh in ch if chh.isdigit())
+        if len(ch_digits) >= 44:
+            chave = ch_digits[-44:]
+
+    return {
+        "sig": _document_sig(chave, xml_bytes),
+        "chave": chave,
+        "Numero": _parse_nnf(texts, _STREAM_ENGINE),
+        "Data": _parse_date(texts, _STREAM_ENGINE),
+        **_totals_doc(texts, _STREAM_ENGINE),
+        "rows": rows,
+        "cancel": None if rows else _cancel_from_root(texts, _STREAM_ENGINE),
+    }
+
+
+def _empty_document(xml_bytes: bytes) -> dict:
+    return {
+        "sig": _document_sig("", xml_bytes),
+        "chave": "",
+        "Numero": None,
+        "Data": None,
+        "totais": dict(_TOTAIS_ZERO),
+        "totais_cent": dict(_TOTAIS_CENT_ZERO),
+        "rows": [],
+        "cancel": None,
+    }
+
+
+# -----------------------------
+# Pré-classificação pelos bytes (sem montar árvore)
+# -----------------------------
+CLASSIFY_HEAD_BYTES = 4096
+# 1º elemento do documento (pula <?xml ...?>, comentários e DOCTYPE: começam com ? ou !)
+_RE_ROOT = re.compile(rb"<((?:[A-Za-z_][\w.\-]*:)?([A-Za-z_][\w.\-]*))")
+
+
+def classify_xml(xml_bytes: bytes) -> str:
+    """Classifica o XML só olhando os bytes (busca em C, sem parse):
+      - "itens": tem IBSCBS (ou não dá para afirmar nada) -> parse completo dos itens
+      - "evento": sem IBSCBS e com tpEvento (procEventoNFe, CC-e, manifestação...) -> só
+        chave/cancelamento, sem procurar det
+      - "sem_ibscbs": nem IBSCBS nem tpEvento -> sem itens e sem cancelamento (só chave/totais)
+    Sem IBSCBS nos bytes não existe elemento IBSCBS, então pular os itens não muda o resultado.
+    Só vale para codificações compatíveis com ASCII (UTF-8, latin-1...); UTF-16 etc. -> "itens".
+    """
+    head = xml_bytes[:CLASSIFY_HEAD_BYTES]
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    if not head.lstrip().startswith(b"<") or _RE_ROOT.search(head) is None:
+        return "itens"
+    if b"IBSCBS" in xml_bytes:
+        return "itens"
+    if b"tpEvento" in xml_bytes:
+        return "evento"
+    return "sem_ibscbs"
+
+
+def _document_evento(xml_bytes: bytes, root, eng: dict) -> dict:
+    """Documento de um evento: cada busca na árvore só roda se a tag aparece nos bytes
+    (evento não tem ide/ICMSTot/det; o resultado é o mesmo do caminho completo)."""
+    chave = _key_from_root(root, eng)
+    return {
+        "sig": _document_sig(chave, xml_bytes),
+        "chave": chave,
+        "Numero": _parse_nnf(root, eng) if b"nNF" in xml_bytes else None,
+        "Data": _parse_date(root, eng) if b"Emi" in xml_bytes else None,  # dhEmi / dEmi
+        **(_totals_doc(root, eng) if b"ICMSTot" in xml_bytes
+           else {"totais": dict(_TOTAIS_ZERO), "totais_cent": dict(_TOTAIS_CENT_ZERO)}),
+        "rows": [],
+        "cancel": _cancel_from_root(root, eng),
+    }
+
+
+# -----------------------------
+# Assinatura rápida (deduplicação sem montar árvore)
+# -----------------------------
+QUICK_KEY_HEAD_BYTES = 64 * 1024
+_RE_INFNFE = re.compile(rb"<(?:[\w.\-]+:)?infNFe\b([^>]*)>")
+_RE_ATTR_ID = re.compile(rb"(?:^|\s)Id\s*=\s*([\"'])([^\"'<>]*)\1")
+_RE_CHNFE = re.compile(rb"<(?:[\w.\-]+:)?(chNFe)\s*>([^<]*)</")
+
+
+def _key_digits(raw: bytes) -> str | None:
+    # só ASCII: fora disso (ex.: dígitos unicode em latin-1) a regra do parse pode divergir
+    if b"&" in raw or not raw.isascii():
+        return None
+    digits = bytes(c for c in raw if 48 <= c <= 57)
+    return digits[-44:].decode() if len(digits) >= 44 else None
+
+
+def quick_signature(xml_bytes: bytes) -> str | None:
+    """Mesma assinatura de _xml_signature, mas por busca nos bytes do início do documento:
+      - infNFe@Id com 44+ dígitos -> "ch:<chave>" (NFe/NFC-e, com ou sem protNFe)
+      - documento pequeno sem infNFe nem infProt (eventos): 1º chNFe -> "ch:<chave>";
+        sem nenhum chNFe -> "sha1:<hash>"
+    Devolve None quando a busca não garante o mesmo resultado do parse (comentário/CDATA no
+    início, entidades, codificação não ASCII, XML truncado...) -> use o parse de verdade.
+    """
+    head = xml_bytes[:QUICK_KEY_HEAD_BYTES]
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    root = _RE_ROOT.search(head)
+    if root is None or not head.lstrip().startswith(b"<") or b"<!--" in head or b"<![CDATA[" in head:
+        return None
+    if root.group(2) in (b"infNFe", b"chNFe"):  # ".//" do parse não olha a própria raiz
+        return None
+    # XML cortado no meio não passa no parse (e ganharia assinatura por sha1)
+    if not xml_bytes.rstrip().endswith(b"</" + root.group(1) + b">"):
+        return None
+
+    m = _RE_INFNFE.search(head)
+    if m is not None:
+        a = _RE_ATTR_ID.search(m.group(1))
+        ch = _key_digits(a.group(2)) if a is not None else None
+        return f"ch:{ch}" if ch else None
+    if len(xml_bytes) > QUICK_KEY_HEAD_BYTES or b"infNFe" in head or b"infProt" in head:
+        return None
+
+    pos = head.find(b"chNFe")
+    if pos < 0:
+        return "sha1:" + hashlib.sha1(xml_bytes).hexdigest()
+    m = _RE_CHNFE.search(head)
+    if m is None or m.start(1) != pos:
+        return None
+    ch = _key_digits(m.group(2))
+    return f"ch:{ch}" if ch else None
+
+
+# -----------------------------
+# Entrada única (1 parse por XML)
+# -----------------------------
+def parse_nfe_document(xml_bytes: bytes, filename: str = "", engine: str | None = None) -> dict:
+    """Lê o XML uma única vez e devolve um dict com:
+      - sig: assinatura de deduplicação (_document_sig: a de quick_signature quando ela
+        responde, senão a do parse; mesma regra de _xml_signature)
+      - chave, Numero, Data
+      - totais: {"vICMS", "vPIS", "vCOFINS"} do ICMSTot; totais_cent: os mesmos em centavos (int)
+      - rows: itens com IBSCBS (mesmas colunas de _parse_items_from_xml, mais as de CENTAVOS_COLS)
+      - cancel: dados do evento de cancelamento (só quando não há itens) ou None
+    XML inválido devolve o documento "vazio" (sig por sha1, sem itens).
+    engine: "lxml" ou "etree" (padrão: XML_ENGINE).
+    XMLs a partir de STREAM_MIN_BYTES são lidos em streaming (iterparse).
+    Eventos e XMLs sem IBSCBS (classify_xml) não passam pela extração de itens.
+    """
+    try:
+        if len(xml_bytes) >= STREAM_MIN_BYTES:
+            return _parse_document_streaming(xml_bytes, filename, engine)
+        tipo = classify_xml(xml_bytes)
+        root, eng = _parse_root(xml_bytes, engine)
+    except Exception:
+        return _empty_document(xml_bytes)
+
+    if tipo == "evento":
+        return _document_evento(xml_bytes, root, eng)
+
+    chave = _key_from_root(root, eng)
+    emissao = _parse_date(root, eng)
+    nnf = _parse_nnf(root, eng)
+    rows = _items_from_root(root, filename, emissao, nnf, eng) if tipo == "itens" else []
+
+    return {
+        "sig": _document_sig(chave, xml_bytes),
+        "chave": chave,
+        "Numero": nnf,
+        "Data": emissao,
+        **_totals_doc(root, eng),
+        "rows": rows,
+        # sem tpEvento nos bytes não há cancelamento
+        "cancel": None if rows or tipo == "sem_ibscbs" else _cancel_from_root(root, eng),
+    }
+
+
+# -----------------------------
+# Atalhos (compatibilidade): cada um faz o próprio parse
+# -----------------------------
+def _extract_nfe_key(xml_bytes: bytes) -> str:
+    """Tenta extrair a chave (44 dígitos) da NFe/NFCe.
+    - Prioriza Id do infNFe (ex.: Id="NFe3519...")
+    - Fallback para tags chNFe comuns em protNFe/infProt ou eventos.
+    Retorna "" se não encontrar.
+    """
+    try:
+        root, eng = _parse_root(xml_bytes)
+    except Exception:
+        return ""
+    return _key_from_root(root, eng)
+
+
+def _xml_signature(xml_bytes: bytes) -> str:
+    """Assinatura estável para deduplicação:
+    - Se achar chave, usa chave (melhor)
+    - Senão, usa hash do conteúdo (sha1)
+    """
+    return quick_signature(xml_bytes) or _signature_from_key(_extract_nfe_key(xml_bytes), xml_bytes)
+
+
+def _parse_items_from_xml(xml_bytes: bytes, filename: str) -> list[dict]:
+    """
+    Extrai itens (det) e IBS/CBS:
+      - Item/Serviço: det/prod/xProd
+      - cClassTrib: imposto/IBSCBS/cClassTrib
+      - Base (vBC): imposto/IBSCBS/vBC
+      - vIBS / vCBS: imposto/IBSCBS/vIBS, vCBS (se existirem)
+    """
+    if classify_xml(xml_bytes) != "itens":
+        return []
+    try:
+        root, eng = _parse_root(xml_bytes)
+    except Exception:
+        return []
+    return _items_from_root(root, filename, _parse_date(root, eng), _parse_nnf(root, eng), eng)
+
+
+def _parse_tax_totals_from_xml(xml_bytes: bytes) -> dict:
+    """Extrai totais do XML (por NOTA) via ICMSTot:
+    - vICMS (ICMS próprio)
+    - vPIS
+    - vCOFINS
+    """
+    try:
+        root, eng = _parse_root(xml_bytes)
+    except Exception:
+        return {"vICMS": 0.0, "vPIS": 0.0, "vCOFINS": 0.0}
+    return _totals_from_root(root, eng)
+
+
+def _detect_cancel_event(xml_bytes: bytes) -> dict | None:
+    """Detecta XML de evento de cancelamento (procEventoNFe / evento).
+    Retorna dict com dados úteis ou None se não for cancelamento.
+    """
+    if classify_xml(xml_bytes) == "sem_ibscbs":
+        return None
+    try:
+        root, eng = _parse_root(xml_bytes)
+    except Exception:
+        return None
+    return _cancel_from_root(root, eng)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Cache de parse por conteúdo (sha1 dos bytes do XML)
+- LRU em memória, limitada pelo total de itens guardados (EXTRATOR_PARSE_CACHE_ITENS)
+- Vive no processo do servidor: sobrevive aos reruns do Streamlit e vale para todas as sessões
+- Segundo nível em disco (SQLite, EXTRATOR_PARSE_CACHE_DB): sobrevive a reinícios do servidor
+  * limite de tamanho (EXTRATOR_PARSE_CACHE_MB) com descarte LRU por último uso
+  * cada entrada guarda a nfe_parser.PARSER_VERSION: mudou o parser, o cache antigo é descartado
+  * documento gravado em JSON comprimido, não pickle: quem consegue escrever no arquivo não
+    consegue executar código no app
+  * gravações pendentes vão para o disco a cada DB_LOTE documentos (e no flush do fim do lote):
+    um ZIP com 50 mil XMLs não fica inteiro na memória esperando o flush
+  * qualquer erro de SQLite (disco cheio, somente leitura...) só desliga o nível em disco
+
+Os documentos guardados nunca são entregues diretamente: bind() devolve uma cópia com
+"arquivo" apontando para a origem atual (o mesmo XML pode vir com outro nome/ZIP).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date
+
+from nfe_parser import PARSER_VERSION
+
+MAX_ITENS = int(os.environ.get("EXTRATOR_PARSE_CACHE_ITENS", "300000"))
+DB_PATH = os.environ.get(
+    "EXTRATOR_PARSE_CACHE_DB",
+    os.path.join(os.path.expanduser("~"), ".cache", "extrator_xml", "parse_cache.sqlite3"),
+)  # "" desliga o cache em disco
+DB_MAX_BYTES = int(float(os.environ.get("EXTRATOR_PARSE_CACHE_MB", "512")) * 1024 * 1024)
+_DB_SCHEMA = 2  # layout da tabela (a versão do parser vai em cada linha); 2: JSON, não pickle
+DB_LOTE = 500  # documentos pendentes que disparam a gravação no meio do lote
+
+_lru: "OrderedDict[str, dict]" = OrderedDict()
+_peso_total = 0
+_lock = threading.Lock()
+
+
+def content_key(xml_bytes: bytes) -> str:
+    return hashlib.sha1(xml_bytes).hexdigest()
+
+
+def _peso(doc: dict) -> int:
+    return len(doc["rows"]) + 1
+
+
+# -----------------------------
+# Nível em disco (SQLite)
+# -----------------------------
+_db: sqlite3.Connection | None = None
+_db_off = not DB_PATH
+_db_lock = threading.Lock()
+_db_novos: dict[str, bytes] = {}  # gravações pendentes (vão para o disco em flush)
+_db_usados: set[str] = set()  # acertos cujo "último uso" ainda não foi gravado
+
+
+def _db_open() -> sqlite3.Connection | None:
+    global _db, _db_off
+    if _db is not None or _db_off:
+        return _db
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+        con = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        if con.execute("PRAGMA user_version").fetchone()[0] != _DB_SCHEMA:
+            con.execute("DROP TABLE IF EXISTS docs")
+            con.execute(f"PRAGMA user_version={_DB_SCHEMA}")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " chave TEXT PRIMARY KEY, versao INTEGER NOT NULL, usado REAL NOT NULL,"
+            " tam INTEGER NOT NULL, dados BLOB NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS docs_usado ON docs(usado)")
+        # entradas de outra versão do parser não servem mais
+        con.execute("DELETE FROM docs WHERE versao != ?", (PARSER_VERSION,))
+        con.commit()
+        _db = con
+    except (sqlite3.Error, OSError):
+        _db_off = True
+    return _db
+
+
+def _db_fail() -> None:
+    # o cache em disco é só otimização: em qualquer erro, segue sem ele
+    global _db, _db_off
+    _db_off = True
+    _db_novos.clear()
+    _db_usados.clear()
+    if _db is not None:
+        try:
+            _db.close()
+        except sqlite3.Error:
+            pass
+    _db = None
+
+
+def _json_default(v):
+    # o único tipo do documento que o JSON não tem: as datas (Data da nota e dos itens)
+    if isinstance(v, date):
+        return {"$data": v.isoformat()}
+    raise TypeError(f"{type(v).__name__} não vai para o cache em disco")
+
+
+def _json_hook(d: dict):
+    if len(d) == 1 and "$data" in d:
+        return date.fromisoformat(d["$data"])
+    return d
+
+
+def _codificar(doc: dict) -> bytes:
+    texto = json.dumps(doc, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(texto.encode("utf-8"), 3)
+
+
+def _decodificar(dados: bytes) -> dict:
+    return json.loads(zlib.decompress(dados), object_hook=_json_hook)
+
+
+def _db_get(key: str) -> dict | None:
+    with _db_lock:
+        con = _db_open()
+        if con is None:
+            return None
+        try:
+            row = con.execute(
+                "SELECT dados FROM docs WHERE chave = ? AND versao = ?", (key, PARSER_VERSION)
+            ).fetchone()
+        except sqlite3.Error:
+            _db_fail()
+            return None
+        if row is None:
+            return None
+        _db_usados.add(key)
+    try:
+        return _decodificar(row[0])
+    except Exception:
+        return None
+
+
+def _db_put(key: str, doc: dict) -> None:
+    if _db_off:
+        return
+    try:
+        dados = _codificar(doc)
+    except (TypeError, ValueError):
+        return
+    if len(dados) > DB_MAX_BYTES:
+        return
+    with _db_lock:
+        _db_novos[key] = dados
+        cheio = len(_db_novos) >= DB_LOTE
+    if cheio:
+        flush()
+
+
+def _db_evict(con: sqlite3.Connection) -> None:
+    total = con.execute("SELECT COALESCE(SUM(tam), 0) FROM docs").fetchone()[0]
+    if total <= DB_MAX_BYTES:
+        return
+    # descarta os menos usados até ficar em 90% do limite (evita limpar a cada flush)
+    alvo = total - int(DB_MAX_BYTES * 0.9)
+    velhos = []
+    for chave, tam in con.execute("SELECT chave, tam FROM docs ORDER BY usado"):
+        velhos.append((chave,))
+        alvo -= tam
+        if alvo <= 0:
+            break
+    con.executemany("DELETE FROM docs WHERE chave = ?", velhos)
+
+
+def flush() -> None:
+    """Grava no SQLite o que ficou pendente (novos documentos e último uso) e aplica o limite."""
+    with _db_lock:
+        if not _db_novos and not _db_usados:
+            return
+        con = _db_open()
+        if con is None:
+            return
+        agora = time.time()
+        try:
+            with con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO docs (chave, versao, usado, tam, dados) VALUES (?, ?, ?, ?, ?)",
+                    [(k, PARSER_VERSION, agora, len(d), d) for k, d in _db_novos.items()],
+                )
+                con.executemany(
+                    "UPDATE docs SET usado = ? WHERE chave = ?", [(agora, k) for k in _db_usados]
+                )
+                _db_evict(con)
+        except sqlite3.Error:
+            _db_fail()
+            return
+        _db_novos.clear()
+        _db_usados.clear()
+
+
+# -----------------------------
+# API
+# -----------------------------
+def _mem_put(key: str, doc: dict) -> None:
+    global _peso_total
+    peso = _peso(doc)
+    if peso > MAX_ITENS:
+        return
+    with _lock:
+        old = _lru.pop(key, None)
+        if old is not None:
+            _peso_total -= _peso(old)
+        _lru[key] = doc
+        _peso_total += peso
+        while _peso_total > MAX_ITENS and _lru:
+            _, ev = _lru.popitem(last=False)
+            _peso_total -= _peso(ev)
+
+
+def get(key: str) -> dict | None:
+    """Memória primeiro; senão o SQLite (o acerto em disco volta para a memória)."""
+    with _lock:
+        doc = _lru.get(key)
+        if doc is not None:
+            _lru.move_to_end(key)
+    if doc is not None:
+        if not _db_off:
+            with _db_lock:
+                _db_usados.add(key)  # mantém o "último uso" do disco em dia
+        return doc
+    doc = _db_get(key)
+    if doc is not None:
+        _mem_put(key, doc)
+    return doc
+
+
+def put(key: str, doc: dict) -> None:
+    """Guarda em memória e agenda a gravação em disco (efetivada em flush())."""
+    _mem_put(key, doc)
+    _db_put(key, doc)
+
+
+def clear() -> None:
+    """Limpa só a memória (o SQLite continua valendo para o próximo get)."""
+    global _peso_total
+    with _lock:
+        _lru.clear()
+        _peso_total = 0
+
+
+def bind(doc: dict, src: str) -> dict:
+    """Cópia rasa do documento para a origem `src` (linhas e cancelamento copiados)."""
+    out = dict(doc)
+    out["rows"] = [{**r, "arquivo": src} for r in doc["rows"]]
+    if doc["cancel"] is not None:
+        out["cancel"] = dict(doc["cancel"])
+    return out
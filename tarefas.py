@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Tarefas que rodam nos processos do pool (ingest.get_pool)
+- parse_lote: parse de um lote de XMLs (ingest.parse_documents)
+- gerar_planilha: um .xlsx da exportação dividida (exportacao.gerar_planilhas)
+- É também o __main__ dos processos do pool: com forkserver/spawn o multiprocessing roda de novo
+  o __main__ do pai em cada processo novo; o app.py declara este módulo como seu __spec__, e os
+  processos importam só ele em vez de executar o app
+
+Sem dependência de Streamlit.
+"""
+from nfe_parser import parse_nfe_document
+from xlsx_writer import append_lancamentos
+
+
+def parse_lote(chunk: list[tuple[str, bytes]]) -> list[dict]:
+    return [parse_nfe_document(b, src) for src, b in chunk]
+
+
+def gerar_planilha(template_bytes: bytes, df) -> bytes:
+    # cada processo guarda a análise do modelo em cache (xlsx_writer)
+    return append_lancamentos(template_bytes, df)
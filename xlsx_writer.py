@@ -0,0 +1,930 @@
+# -*- coding: utf-8 -*-
+"""
+Geração da planilha preenchida em streaming (aba LANCAMENTOS)
+- O modelo não é carregado no openpyxl: o .xlsx é um ZIP e as outras abas, estilos, fórmulas
+  e validações são copiados como estão; só o XML da aba LANCAMENTOS é reescrito, linha a linha,
+  direto no ZIP de saída (memória não cresce com o nº de linhas)
+- Linhas novas reaproveitam o id de estilo (atributo s) das células da linha-modelo: nada de
+  copiar fonte/preenchimento/borda/alinhamento por célula
+- A linha-modelo é compilada uma vez (_compilar_linha): fórmulas tokenizadas com as linhas
+  relativas viradas campos de str.format; gerar a linha N não chama o tokenizer
+- Mesmas regras do writer openpyxl: cabeçalho procurado nas 25 primeiras linhas, linha-modelo =
+  cabeçalho + 2, gravação a partir da primeira linha sem Data; fórmulas da linha-modelo
+  replicadas em cada linha, campos de entrada sobrescritos
+- Fórmulas compartilhadas (t="shared") cujo mestre foi sobrescrito viram fórmulas normais
+- calcChain.xml sai (como no openpyxl) e o Excel recalcula tudo ao abrir (fullCalcOnLoad)
+- Campos de entrada gravados por coluna (_colunas_entrada): cada coluna do df vira a lista de
+  células já renderizadas de uma vez, com NaN/datas tratados no lote; nada de iterrows
+- Análise do modelo (layout, linha-modelo compilada, XMLs auxiliares) em cache por processo,
+  pela sha1 do conteúdo; ler_modelo só relê o arquivo do disco quando mtime/tamanho mudam
+- Texto de célula como no openpyxl: cortado em 32767 caracteres, e caractere de controle que o
+  XML não aceita levanta IllegalCharacterError (nada é removido em silêncio)
+
+Layout que este writer não cobre levanta ModeloNaoSuportado; aí o app usa
+append_lancamentos_openpyxl (fim deste módulo), o writer openpyxl de antes.
+benchmarks/bench_writer_openpyxl.py grava o mesmo df pelos dois e compara a aba LANCAMENTOS.
+Sem dependência de Streamlit.
+"""
+import hashlib
+import html
+import io
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from copy import copy
+from datetime import date
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, to_excel
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+FIELDS = [
+    "Data", "Numero", "Item/Serviço", "cClassTrib",
+    "Valor da operação", "vIBS", "vCBS", "arquivo", "Fonte do valor",
+]
+EXPECTED_HEADERS = {"Data", "Numero", "Item/Serviço", "cClassTrib", "Valor da operação"}
+FORMATO_DATA = "dd/mm/yyyy"
+LINHAS_POR_BLOCO = 512  # linhas acumuladas antes de cada write no ZIP
+EXCEL_MAX_LINHAS = 1_048_576  # limite de linhas de uma aba no Excel
+LINHAS_POR_LOTE = 8192  # linhas do df renderizadas por coluna de uma vez (_colunas_entrada)
+MAX_TEXTO = 32767  # caracteres por célula (o openpyxl corta no mesmo ponto)
+
+_RE_ROW = re.compile(rb"<row\b([^>]*?)(?:/>|>(.*?)</row>)", re.S)
+_RE_ROW_R = re.compile(rb'\br="(\d+)"')
+_RE_CELL_COL = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)\d+"')
+_RE_CELL = re.compile(rb"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+_RE_ATTR = re.compile(rb"""([\w:]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+_RE_F = re.compile(rb"<f\b([^>]*?)(?:/>|>(.*?)</f>)", re.S)
+_RE_V = re.compile(rb"<v>(.*?)</v>", re.S)
+_RE_T = re.compile(rb"<t\b[^>]*?(?:/>|>(.*?)</t>)", re.S)
+_RE_RPH = re.compile(rb"<rPh\b.*?</rPh>", re.S)
+_RE_REF = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)")
+_RE_XML_ILEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class ModeloNaoSuportado(ValueError):
+    """O modelo usa algo que o writer em streaming não reproduz fielmente."""
+
+
+# -----------------------------
+# Leitura do modelo (XML cru)
+# -----------------------------
+def _attrs(raw: bytes) -> dict[str, str]:
+    return {
+        k.decode(): html.unescape((v1 if v1 or not v2 else v2).decode("utf-8"))
+        for k, v1, v2 in _RE_ATTR.findall(raw)
+    }
+
+
+def _texto(raw: bytes | None) -> str:
+    # quebra de linha normalizada como num parser XML (\r\n literal vira \n)
+    return html.unescape(raw.replace(b"\r\n", b"\n").replace(b"\r", b"\n").decode("utf-8")) if raw else ""
+
+
+def _esc(s: str) -> str:
+    return html.escape(s, quote=True)
+
+
+def _split_ref(ref: str) -> tuple[int, int]:
+    m = _RE_REF.fullmatch(ref)
+    if not m:
+        raise ModeloNaoSuportado(f"referência de célula inválida: {ref!r}")
+    return column_index_from_string(m.group(1)), int(m.group(2))
+
+
+def _rows(body: bytes):
+    """(nº da linha, match do <row>, conteúdo cru) de cada linha do sheetData."""
+    atual = 0
+    for m in _RE_ROW.finditer(body):
+        r = _RE_ROW_R.search(m.group(1))
+        atual = int(r.group(1)) if r else atual + 1
+        yield atual, m, m.group(2) or b""
+
+
+def _cells(conteudo: bytes, linha: int):
+    """(coluna, atributos, inner cru, xml cru) de cada <c> de uma linha."""
+    col = 0
+    for m in _RE_CELL.finditer(conteudo):
+        a = _attrs(m.group(1))
+        if "r" in a:
+            col, _ = _split_ref(a["r"])
+        else:
+            col += 1
+            a["r"] = f"{get_column_letter(col)}{linha}"
+        yield col, a, m.group(2) or b"", m.group(0)
+
+
+def _formula(inner: bytes):
+    """(atributos do <f>, texto da fórmula) ou None."""
+    m = _RE_F.search(inner)
+    if not m:
+        return None
+    return _attrs(m.group(1)), _texto(m.group(2))
+
+
+def _valor(a: dict, inner: bytes, sst: list[str]):
+    """Valor da célula como o openpyxl devolve em ws.cell().value (fórmula = "=...")."""
+    f = _formula(inner)
+    if f is not None:
+        return "=" + f[1] if f[1] else "="  # filha de fórmula compartilhada: não importa o texto
+    t = a.get("t", "n")
+    if t == "inlineStr":
+        return "".join(_texto(x) for x in _RE_T.findall(_RE_RPH.sub(b"", inner))) or None
+    m = _RE_V.search(inner)
+    if not m:
+        return None
+    v = _texto(m.group(1))
+    if t == "s":
+        return sst[int(v)]
+    if t in ("str", "e", "d"):
+        return v
+    if t == "b":
+        return v == "1"
+    return float(v) if v else None
+
+
+def _shared_strings(z: zipfile.ZipFile, caminho: str | None) -> list[str]:
+    if not caminho or caminho not in z.namelist():
+        return []
+    dados = z.read(caminho)
+    out = []
+    for m in re.finditer(rb"<si\b[^>]*>(.*?)</si>", dados, re.S):
+        out.append("".join(_texto(x) for x in _RE_T.findall(_RE_RPH.sub(b"", m.group(1)))))
+    return out
+
+
+def _rels(z: zipfile.ZipFile, caminho: str) -> list[dict]:
+    if caminho not in z.namelist():
+        return []
+    return [_attrs(m.group(1)) for m in re.finditer(rb"<Relationship\b([^>]*?)/?>", z.read(caminho))]
+
+
+def _alvo(base: str, target: str) -> str:
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), target))
+
+
+def _rels_de(caminho: str) -> str:
+    pasta, nome = posixpath.split(caminho)
+    return posixpath.join(pasta, "_rels", nome + ".rels")
+
+
+def _partes(z: zipfile.ZipFile) -> dict:
+    """Caminhos das partes do pacote que o writer usa."""
+    wb_path = next(
+        (_alvo("", r["Target"]) for r in _rels(z, "_rels/.rels") if r.get("Type", "").endswith("/officeDocument")),
+        "xl/workbook.xml",
+    )
+    wb_xml = z.read(wb_path)
+    wb_rels_path = _rels_de(wb_path)
+    rels = {r["Id"]: r for r in _rels(z, wb_rels_path)}
+
+    sheets = [_attrs(m.group(1)) for m in re.finditer(rb"<sheet\b([^>]*?)/?>", wb_xml)]
+    if not sheets:
+        raise ModeloNaoSuportado("workbook sem abas")
+    sheet = next((s for s in sheets if s.get("name") == "LANCAMENTOS"), None)
+    if sheet is None:
+        # mesmo critério do openpyxl (wb.active): a aba ativa da primeira workbookView
+        m = re.search(rb"<workbookView\b([^>]*?)/?>", wb_xml)
+        ativa = int(_attrs(m.group(1)).get("activeTab", "0")) if m else 0
+        sheet = sheets[min(ativa, len(sheets) - 1)]
+    rid = next((v for k, v in sheet.items() if k.endswith(":id")), None)
+    if rid not in rels:
+        raise ModeloNaoSuportado("aba LANCAMENTOS sem relacionamento no workbook")
+
+    por_tipo = {r.get("Type", "").rsplit("/", 1)[-1]: _alvo(wb_path, r["Target"]) for r in rels.values()}
+    m = re.search(rb"<workbookPr\b([^>]*?)/?>", wb_xml)
+    data1904 = bool(m) and _attrs(m.group(1)).get("date1904", "0") in ("1", "true")
+    return {
+        "workbook": wb_path,
+        "workbook_rels": wb_rels_path,
+        "sheet": _alvo(wb_path, rels[rid]["Target"]),
+        "sst": por_tipo.get("sharedStrings"),
+        "styles": por_tipo.get("styles"),
+        "calcchain": por_tipo.get("calcChain"),
+        "epoch": CALENDAR_MAC_1904 if data1904 else CALENDAR_WINDOWS_1900,
+    }
+
+
+# -----------------------------
+# Layout da aba (mesmas regras do writer openpyxl)
+# -----------------------------
+def _layout(linhas: dict[int, bytes], sst: list[str]) -> dict:
+    """header_row, headers (nome -> coluna), last_col, template_row, max_row e next_row."""
+    def valores(r: int, ate_col: int) -> dict[int, object]:
+        out = {}
+        for col, a, inner, _raw in _cells(linhas.get(r, b""), r):
+            if col > ate_col:
+                break
+            out[col] = _valor(a, inner, sst)
+        return out
+
+    header_row = 1
+    for r in range(1, 26):
+        textos = [v.strip() for v in valores(r, 100).values() if isinstance(v, str)]
+        if len(EXPECTED_HEADERS.intersection(textos)) >= 3:
+            header_row = r
+            break
+
+    headers: dict[str, int] = {}
+    last_col = 0
+    for col, v in sorted(valores(header_row, 200).items()):
+        if isinstance(v, str) and v.strip():
+            headers[v.strip()] = col
+            last_col = max(last_col, col)
+
+    com_celulas = [r for r, conteudo in linhas.items() if b"<c" in conteudo]
+    max_row = max(com_celulas, default=1)
+    if last_col == 0:
+        cols = [c for r in com_celulas for c, *_ in _cells(linhas[r], r)]
+        last_col = min(max(cols, default=1), 200)
+
+    template_row = header_row + 2
+    next_row = max_row + 1
+    if "Data" in headers:
+        c = headers["Data"]
+        r = max_row
+        while r >= template_row and valores(r, c).get(c) in (None, ""):
+            r -= 1
+        next_row = max(r + 1, template_row)
+
+    return {
+        "header_row": header_row,
+        "headers": headers,
+        "last_col": last_col,
+        "template_row": template_row,
+        "max_row": max_row,
+        "next_row": next_row,
+    }
+
+
+def _linha_modelo(linhas: dict[int, bytes], layout: dict, mestres: dict) -> list[dict]:
+    """Células 1..last_col da linha-modelo: estilo (id) e fórmula ou valor constante (XML cru)."""
+    r = layout["template_row"]
+    cells = {col: (a, inner) for col, a, inner, _raw in _cells(linhas.get(r, b""), r)}
+    out = []
+    for col in range(1, layout["last_col"] + 1):
+        a, inner = cells.get(col, ({}, b""))
+        item = {"col": col, "letra": get_column_letter(col), "s": a.get("s", "0"), "formula": None, "const": b""}
+        f = _formula(inner)
+        if f is not None:
+            fa, texto = f
+            tipo = fa.get("t", "normal")
+            if tipo == "shared" and not texto:
+                texto = _traduzir_compartilhada(mestres, fa.get("si"), f"{item['letra']}{r}")
+            elif tipo not in ("normal", "shared"):
+                raise ModeloNaoSuportado(f"fórmula {tipo} na linha-modelo ({item['letra']}{r})")
+            item["formula"] = "=" + texto
+        elif inner:
+            # constante: reaproveita o XML da célula (inclusive índice de sharedString)
+            t = a.get("t")
+            item["const"] = (f' t="{t}"' if t else "").encode() + b">" + inner
+        out.append(item)
+    return out
+
+
+def _mestres(body: bytes) -> dict[str, tuple[str, str]]:
+    """si -> (célula do mestre, fórmula) de todas as fórmulas compartilhadas da aba."""
+    out = {}
+    for m in re.finditer(rb'<c\b[^>]*?\br="([A-Z]+\d+)"[^>]*>\s*<f\b([^>]*?t="shared"[^>]*?)>(.*?)</f>', body, re.S):
+        a = _attrs(m.group(2))
+        if "ref" in a and "si" in a:
+            out[a["si"]] = (m.group(1).decode(), _texto(m.group(3)))
+    return out
+
+
+def _traduzir_compartilhada(mestres: dict, si: str | None, destino: str) -> str:
+    if si not in mestres:
+        raise ModeloNaoSuportado(f"fórmula compartilhada sem mestre (si={si})")
+    origem, texto = mestres[si]
+    return Translator("=" + texto, origin=origem).translate_formula(destino)[1:]
+
+
+# -----------------------------
+# Estilos: id do estilo de data (dd/mm/yyyy) derivado do estilo da coluna Data
+# -----------------------------
+def _estilo_data(styles: bytes, s: str) -> tuple[bytes, str]:
+    """Acrescenta (se preciso) o numFmt dd/mm/yyyy e um xf igual ao `s` com esse formato."""
+    fmts = {
+        _attrs(m.group(1)).get("formatCode"): _attrs(m.group(1)).get("numFmtId")
+        for m in re.finditer(rb"<numFmt\b([^>]*?)/?>", styles)
+    }
+    fmt_id = fmts.get(FORMATO_DATA)
+    if fmt_id is None:
+        ids = [int(i) for i in fmts.values() if i and i.isdigit()]
+        fmt_id = str(max(ids + [163]) + 1)
+        novo = f'<numFmt numFmtId="{fmt_id}" formatCode="{FORMATO_DATA}"/>'.encode()
+        if re.search(rb"<numFmts\b", styles):
+            styles = re.sub(rb"</numFmts>", novo + b"</numFmts>", styles, count=1)
+            styles = re.sub(rb'(<numFmts\b[^>]*?count=")(\d+)"',
+                            lambda m: m.group(1) + str(int(m.group(2)) + 1).encode() + b'"', styles, count=1)
+        else:
+            styles = re.sub(rb"(<styleSheet\b[^>]*>)", lambda m: m.group(1) + b'<numFmts count="1">' + novo + b"</numFmts>",
+                            styles, count=1)
+
+    m = re.search(rb"<cellXfs\b[^>]*>(.*?)</cellXfs>", styles, re.S)
+    if not m:
+        raise ModeloNaoSuportado("styles.xml sem cellXfs")
+    xfs = re.findall(rb"<xf\b[^>]*?(?:/>|>.*?</xf>)", m.group(1), re.S)
+    base = xfs[int(s)] if int(s) < len(xfs) else b'<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    if _attrs(re.match(rb"<xf\b([^>]*?)/?>", base).group(1)).get("numFmtId") == fmt_id:
+        return styles, s
+    abre = re.match(rb"<xf\b[^>]*?/?>", base).group(0)
+    novo_abre = re.sub(rb'numFmtId="\d+"', f'numFmtId="{fmt_id}"'.encode(), abre)
+    if b"numFmtId=" not in novo_abre:
+        novo_abre = novo_abre.replace(b"<xf", f'<xf numFmtId="{fmt_id}"'.encode(), 1)
+    if b"applyNumberFormat=" in novo_abre:
+        novo_abre = re.sub(rb'applyNumberFormat="\w+"', b'applyNumberFormat="1"', novo_abre)
+    else:
+        novo_abre = novo_abre.replace(b"<xf", b'<xf applyNumberFormat="1"', 1)
+    novo_xf = novo_abre + base[len(abre):]
+    inicio, fim = m.span(1)
+    styles = styles[:fim] + novo_xf + styles[fim:]
+    styles = re.sub(rb'(<cellXfs\b[^>]*?count=")(\d+)"',
+                    lambda mm: mm.group(1) + str(len(xfs) + 1).encode() + b'"', styles, count=1)
+    return styles, str(len(xfs))
+
+
+# -----------------------------
+# Células das linhas novas
+# -----------------------------
+def _cauda(s: str, val) -> str:
+    """Célula sem o início '<c r="A5"': estilo + valor (val já sem NaN/datas)."""
+    if isinstance(val, bool) or getattr(val, "dtype", None) == bool:
+        return f' s="{s}" t="b"><v>{int(val)}</v></c>'
+    if isinstance(val, str):
+        if not val:
+            return f' s="{s}"/>'  # openpyxl também não grava texto vazio
+        val = val[:MAX_TEXTO]
+        if _RE_XML_ILEGAL.search(val):
+            raise IllegalCharacterError(f"{val} cannot be used in worksheets.")
+        return f' s="{s}" t="inlineStr"><is><t xml:space="preserve">{_esc(val)}</t></is></c>'
+    try:
+        num = float(val)
+    except (TypeError, ValueError):
+        return _cauda(s, str(val))
+    if isinstance(val, int) or (hasattr(val, "dtype") and val.dtype.kind in "iu"):
+        return f' s="{s}"><v>{int(val)}</v></c>'
+    return f' s="{s}"><v>{num!r}</v></c>'
+
+
+def _celulas_coluna(valores: list, nulos, s: str, s_data: str | None, epoch) -> list[str]:
+    """Caudas (_cauda) de uma coluna inteira. s_data: estilo das datas (só na coluna Data)."""
+    vazio = f' s="{s}"/>'
+    memo: dict = {}  # valores se repetem muito (datas, cClassTrib, arquivo...)
+    out = []
+    for val, nulo in zip(valores, nulos):
+        if nulo:
+            out.append(vazio)
+            continue
+        chave = (type(val), val)
+        try:
+            cauda = memo.get(chave)
+        except TypeError:  # valor não hashable
+            chave, cauda = None, None
+        if cauda is None:
+            if s_data is not None and isinstance(val, date):
+                cauda = f' s="{s_data}"><v>{to_excel(val, epoch)}</v></c>'
+            else:
+                cauda = _cauda(s, val)
+            if chave is not None:
+                memo[chave] = cauda
+        out.append(cauda)
+    return out
+
+
+def _colunas_entrada(compilado: dict, df: pd.DataFrame, troca: int | None,
+                     estilo_data: str | None, epoch) -> list[list[str]]:
+    """Campos de entrada do df, coluna a coluna, na ordem de compilado["entradas"].
+    troca: posição no df depois da qual a célula Data sem data também usa estilo_data."""
+    n = len(df)
+    colunas = []
+    for parte in compilado["entradas"]:
+        f, s = parte["campo"], parte["s"]
+        if f not in df.columns:
+            colunas.append([f' s="{s}"/>'] * n)
+            continue
+        serie = df[f]
+        valores = serie.tolist()
+        nulos = pd.isna(serie).to_numpy().tolist()
+        if serie.dtype.kind == "f":
+            colunas.append([f' s="{s}"/>' if nulo else f' s="{s}"><v>{v!r}</v></c>'
+                            for v, nulo in zip(valores, nulos)])
+            continue
+        if f != "Data":
+            colunas.append(_celulas_coluna(valores, nulos, s, None, epoch))
+            continue
+        s_data = estilo_data or s
+        if troca is None or troca >= n:
+            colunas.append(_celulas_coluna(valores, nulos, s, s_data, epoch))
+        else:
+            k = max(troca + 1, 0)
+            colunas.append(_celulas_coluna(valores[:k], nulos[:k], s, s_data, epoch)
+                           + _celulas_coluna(valores[k:], nulos[k:], estilo_data, s_data, epoch))
+    return colunas
+
+
+# -----------------------------
+# Linha-modelo compilada: gerar a linha N é só str.format (nada de Translator por célula)
+# -----------------------------
+def _linha_relativa(ref: str, linhas: list[int]) -> str:
+    """Parte "linha" de uma referência: absoluta ($4) fica; relativa vira campo do molde."""
+    if ref.startswith("$"):
+        return ref
+    base = int(ref)
+    if base not in linhas:
+        linhas.append(base)
+    return "{%d}" % (linhas.index(base) + 1)
+
+
+def _coluna(ref: str) -> str:
+    # mesma normalização do Translator (coluna relativa sai em maiúsculas)
+    return ref if ref.startswith("$") else get_column_letter(column_index_from_string(ref))
+
+
+def _molde_range(range_str: str, linhas: list[int]) -> str:
+    """Translator.translate_range com as linhas relativas trocadas por campos (mesma coluna)."""
+    ws, ref = Translator.strip_ws_name(range_str)
+    ws = _esc(ws).replace("{", "{{").replace("}", "}}")
+    m = Translator.ROW_RANGE_RE.match(ref)
+    if m is not None:
+        return ws + _linha_relativa(m.group(1), linhas) + ":" + _linha_relativa(m.group(2), linhas)
+    m = Translator.COL_RANGE_RE.match(ref)
+    if m is not None:
+        return ws + _coluna(m.group(1)) + ":" + _coluna(m.group(2))
+    if ":" in ref:
+        return ws + ":".join(_molde_range(p, linhas) for p in ref.split(":"))
+    m = Translator.CELL_REF_RE.match(ref)
+    if m is None:  # nome definido
+        return ws + _esc(ref).replace("{", "{{").replace("}", "}}")
+    return ws + _coluna(m.group(1)) + _linha_relativa(m.group(2), linhas)
+
+
+def _molde_formula(formula: str, linhas: list[int]) -> str | None:
+    """Fórmula ("=...") -> conteúdo do <f> já escapado, com campos no lugar das linhas
+    relativas. None quando a tradução daria fórmula vazia."""
+    try:
+        tokens = Tokenizer(formula).items
+    except Exception:
+        # o writer openpyxl mantinha a fórmula sem traduzir quando o tokenizer falhava
+        return _esc(formula[1:]).replace("{", "{{").replace("}", "}}")
+    if not tokens:
+        return None
+    if tokens[0].type == Token.LITERAL:
+        texto = tokens[0].value
+        return _esc(texto[1:] if texto.startswith("=") else texto).replace("{", "{{").replace("}", "}}")
+    out = []
+    for tok in tokens:
+        if tok.type == Token.OPERAND and tok.subtype == Token.RANGE:
+            out.append(_molde_range(tok.value, linhas))
+        else:
+            out.append(_esc(tok.value).replace("{", "{{").replace("}", "}}"))
+    return "".join(out)
+
+
+def _compilar_linha(modelo: list[dict], headers: dict, template_row: int) -> dict:
+    """Linha-modelo analisada uma vez só.
+
+    molde: a linha inteira como um str.format só (células constantes, fórmulas e ids de estilo
+    já resolvidos). {0} = linha destino, {i} = linhas[i-1] + deslocamento e, depois delas, um
+    campo por célula de entrada (Data, Numero...) com a cauda vinda de _colunas_entrada.
+    """
+    entrada = {headers[f]: f for f in FIELDS if f in headers}
+    linhas: list[int] = []
+    partes: list = []  # moldes das células fixas, intercalados com os dicts das de entrada
+    for item in modelo:
+        ref = item["letra"] + "{0}"
+        f = entrada.get(item["col"])
+        if f is not None:
+            partes.append({"campo": f, "s": item["s"], "letra": item["letra"]})
+            continue
+        cel = f'<c r="{ref}" s="{item["s"]}"'
+        molde = _molde_formula(item["formula"], linhas) if item["formula"] is not None else None
+        if molde is not None:
+            partes.append(f"{cel}><f>{molde}</f></c>")
+        elif item["const"]:
+            const = item["const"].decode("utf-8").replace("{", "{{").replace("}", "}}")
+            partes.append(f"{cel}{const}</c>")
+        else:
+            partes.append(f"{cel}/>")
+    entradas = [p for p in partes if isinstance(p, dict)]
+    campos = iter(range(len(linhas) + 1, len(linhas) + 1 + len(entradas)))
+    molde = "".join(p if isinstance(p, str) else f'<c r="{p["letra"]}{{0}}"{{{next(campos)}}}' for p in partes)
+    return {"molde": molde, "entradas": entradas, "linhas": linhas, "template_row": template_row}
+
+
+def _celulas_novas(compilado: dict, df: pd.DataFrame, inicio: int, estilo_data: str | None, epoch):
+    """Gera as células (str) das linhas inicio, inicio+1... : linha-modelo com os campos do df."""
+    molde = compilado["molde"].format
+    base = compilado["linhas"]
+    troca = None
+    k = compilado["template_row"] - inicio
+    if estilo_data and "Data" in df.columns and 0 <= k < len(df):
+        val = df["Data"].iloc[k]
+        if pd.notna(val) and isinstance(val, date):
+            # como no openpyxl: a própria linha-modelo recebeu o formato de data e as linhas
+            # gravadas depois dela copiam esse estilo também nas células sem data
+            troca = k
+    # em lotes: as colunas renderizadas de um lote por vez (memória não cresce com o df)
+    for ini_lote in range(0, len(df), LINHAS_POR_LOTE):
+        lote = df.iloc[ini_lote:ini_lote + LINHAS_POR_LOTE]
+        r0 = inicio + ini_lote
+        delta = r0 - compilado["template_row"]
+        colunas = _colunas_entrada(compilado, lote, None if troca is None else troca - ini_lote,
+                                   estilo_data, epoch)
+        for i, caudas in enumerate(zip(*colunas) if colunas else ((),) * len(lote)):
+            yield molde(r0 + i, *[b + delta + i for b in base], *caudas)
+
+
+# -----------------------------
+# Escrita
+# -----------------------------
+def _reescrever_linha(m: re.Match, r: int, novas: str | None, last_col: int,
+                      afetados: dict, mestres: dict, inicio: int, fim: int) -> bytes:
+    """Linha existente: troca as células 1..last_col (se `novas`) e ajusta fórmulas compartilhadas.
+
+    afetados: si das fórmulas compartilhadas cujo mestre sai ou é encurtado; as filhas que
+    sobram viram fórmula normal.
+    """
+    conteudo = m.group(2) or b""
+    if novas is None:
+        if r > fim and not any(f' si="{si}"'.encode() in conteudo for si in afetados):
+            return m.group(0)
+        if r < inicio and b' ref="' not in conteudo:
+            return m.group(0)
+    abre = m.group(0)[: m.start(2) - m.start(0)] if m.group(2) is not None else m.group(0)[:-2] + b">"
+    if novas is not None and b' ref="' not in conteudo:
+        # caso comum: nenhuma célula além de last_col nem mestre de fórmula compartilhada
+        ultima = _RE_CELL_COL.match(conteudo, max(conteudo.rfind(b"<c "), 0))
+        if b"<c" not in conteudo or (ultima and column_index_from_string(ultima.group(1).decode()) <= last_col):
+            return abre + novas.encode() + b"</row>"
+    partes = [novas.encode()] if novas is not None else []
+    mudou = novas is not None
+    for col, a, inner, raw in _cells(conteudo, r):
+        if novas is not None and col <= last_col:
+            f = _formula(inner)
+            if f is not None and f[0].get("t") == "shared" and "ref" in f[0]:
+                afetados[f[0]["si"]] = True  # mestre sobrescrito
+            continue
+        f = _formula(inner)
+        if f is not None and f[0].get("t") == "shared":
+            fa, texto = f
+            si = fa.get("si")
+            if "ref" in fa:
+                # mestre que fica antes da área gravada, mas cuja faixa entra nela: encurta
+                c1, r1 = _split_ref(fa["ref"].split(":")[0])
+                fim_ref = fa["ref"].split(":")[-1]
+                c2, r2 = _split_ref(fim_ref)
+                if r1 < inicio <= r2 and c1 <= last_col and r <= inicio - 1:
+                    novo_ref = f"{get_column_letter(c1)}{r1}:{get_column_letter(c2)}{inicio - 1}"
+                    raw = raw.replace(f'ref="{fa["ref"]}"'.encode(), f'ref="{novo_ref}"'.encode(), 1)
+                    afetados[si] = True
+                    mudou = True
+            elif si in afetados and r >= inicio:
+                texto = _traduzir_compartilhada(mestres, si, a["r"])
+                attrs = "".join(f' {k}="{_esc(v)}"' for k, v in a.items() if k != "t")
+                raw = f"<c{attrs}><f>{_esc(texto)}</f></c>".encode()
+                mudou = True
+        partes.append(raw)
+    if not mudou:
+        return m.group(0)
+    return abre + b"".join(partes) + b"</row>"
+
+
+def _linha_nova(r: int, celulas: str) -> bytes:
+    return f'<row r="{r}">{celulas}</row>'.encode()
+
+
+def _escrever_aba(w, mod: dict, df: pd.DataFrame, estilo_data: str | None) -> None:
+    layout, epoch = mod["layout"], mod["epoch"]
+    inicio = layout["next_row"]
+    fim = inicio + len(df) - 1
+    ultima = max(layout["max_row"], fim) if len(df) else layout["max_row"]
+    cab = re.sub(
+        rb'(<dimension\b[^>]*?ref=")([A-Z]+\d+)(?::([A-Z]+)\d+)?"',
+        lambda m: m.group(1) + m.group(2) + b":" + (m.group(3) or re.match(rb"[A-Z]+", m.group(2)).group(0))
+        + str(ultima).encode() + b'"',
+        mod["cab"], count=1,
+    )
+    w.write(cab)
+
+    linhas_df = _celulas_novas(mod["compilado"], df, inicio, estilo_data, epoch)
+    afetados: dict[str, bool] = {}
+    bloco: list[bytes] = []
+    prox = inicio  # próxima linha do df ainda não escrita
+
+    def _novas_ate(limite: int):
+        nonlocal prox
+        while prox <= fim and prox < limite:
+            bloco.append(_linha_nova(prox, next(linhas_df)))
+            prox += 1
+            if len(bloco) >= LINHAS_POR_BLOCO:
+                w.write(b"".join(bloco))
+                bloco.clear()
+
+    for r, m, _conteudo in mod["linhas"]:
+        _novas_ate(r)
+        novas = None
+        if inicio <= r <= fim:
+            novas = next(linhas_df)
+            prox = r + 1
+        bloco.append(_reescrever_linha(m, r, novas, layout["last_col"], afetados, mod["mestres"], inicio, fim))
+        if len(bloco) >= LINHAS_POR_BLOCO:
+            w.write(b"".join(bloco))
+            bloco.clear()
+    _novas_ate(fim + 1)
+    w.write(b"".join(bloco))
+    w.write(mod["rod"])
+
+
+def _sem_calcchain(dados: bytes, alvo: str) -> bytes:
+    return re.sub(rb"<Relationship\b[^>]*?" + re.escape(alvo.encode()) + rb'"[^>]*?/>', b"", dados)
+
+
+# -----------------------------
+# Cache do modelo (por processo, vale para todas as sessões)
+# -----------------------------
+CACHE_MODELOS = 4  # modelos analisados guardados (normalmente só planilha_modelo.xlsx)
+
+_modelos: "OrderedDict[str, dict]" = OrderedDict()
+_arquivos: dict[str, tuple[tuple[int, int], bytes]] = {}  # caminho -> ((mtime_ns, tamanho), bytes)
+_cache_lock = threading.Lock()
+
+
+def ler_modelo(caminho) -> bytes:
+    """Bytes do arquivo modelo; só relê do disco quando mtime/tamanho mudam.
+    Arquivo inexistente levanta FileNotFoundError, como Path.read_bytes."""
+    st = os.stat(caminho)
+    versao = (st.st_mtime_ns, st.st_size)
+    chave = os.path.abspath(caminho)
+    with _cache_lock:
+        atual = _arquivos.get(chave)
+    if atual is not None and atual[0] == versao:
+        return atual[1]
+    with open(caminho, "rb") as fh:
+        dados = fh.read()
+    with _cache_lock:
+        _arquivos[chave] = (versao, dados)
+    return dados
+
+
+def _analisar_modelo(template_bytes: bytes) -> dict:
+    """Tudo o que depende só do modelo: partes do pacote, layout da aba, linha-modelo
+    compilada, fórmulas compartilhadas, XMLs auxiliares já ajustados e demais membros do ZIP."""
+    with zipfile.ZipFile(io.BytesIO(template_bytes)) as z:
+        partes = _partes(z)
+        sheet = z.read(partes["sheet"])
+        sst = _shared_strings(z, partes["sst"])
+        membros = [(info, None if info.filename == partes["sheet"] else z.read(info.filename))
+                   for info in z.infolist() if info.filename != partes["calcchain"]]
+
+    ini_sd = sheet.find(b"<sheetData")
+    if ini_sd < 0:
+        raise ModeloNaoSuportado("aba sem <sheetData>")
+    fecha_abre = sheet.index(b">", ini_sd)
+    if sheet[fecha_abre - 1:fecha_abre] == b"/":
+        cab, body, rod = sheet[:ini_sd] + b"<sheetData>", b"", b"</sheetData>" + sheet[fecha_abre + 1:]
+    else:
+        fim_sd = sheet.index(b"</sheetData>")
+        cab, body, rod = sheet[:fecha_abre + 1], sheet[fecha_abre + 1:fim_sd], sheet[fim_sd:]
+
+    linhas = list(_rows(body))
+    conteudos = {r: conteudo for r, _m, conteudo in linhas}
+    layout = _layout(conteudos, sst)
+    mestres = _mestres(body)
+    modelo = _linha_modelo(conteudos, layout, mestres)
+
+    fixos = {}
+    for info, dados in membros:
+        nome = info.filename
+        if nome == partes["workbook"]:
+            # valores em cache das fórmulas ficam velhos: recalcula ao abrir
+            if re.search(rb"<calcPr\b", dados):
+                dados = re.sub(rb"<calcPr\b(?![^>]*fullCalcOnLoad)", b'<calcPr fullCalcOnLoad="1"', dados, count=1)
+            else:
+                dados = dados.replace(b"</sheets>", b'</sheets><calcPr fullCalcOnLoad="1"/>', 1)
+        elif partes["calcchain"] and nome == partes["workbook_rels"]:
+            # o Excel refaz a cadeia de cálculo (openpyxl também não grava)
+            dados = _sem_calcchain(dados, posixpath.basename(partes["calcchain"]))
+        elif partes["calcchain"] and nome == "[Content_Types].xml":
+            dados = re.sub(rb'<Override\b[^>]*?PartName="/' + re.escape(partes["calcchain"].encode())
+                           + rb'"[^>]*?/>', b"", dados)
+        else:
+            continue
+        fixos[nome] = dados
+
+    return {
+        "partes": partes,
+        "epoch": partes["epoch"],
+        "cab": cab,
+        "rod": rod,
+        "linhas": linhas,
+        "layout": layout,
+        "mestres": mestres,
+        "modelo": modelo,
+        "compilado": _compilar_linha(modelo, layout["headers"], layout["template_row"]),
+        "membros": [(info, fixos.get(info.filename, dados)) for info, dados in membros],
+        "estilo_data": None,  # (styles.xml, id) com o formato de data; criado no primeiro uso
+    }
+
+
+def _modelo(template_bytes: bytes) -> dict:
+    """Análise do modelo, reaproveitada enquanto o conteúdo (sha1) for o mesmo."""
+    chave = hashlib.sha1(template_bytes).hexdigest()
+    with _cache_lock:
+        mod = _modelos.get(chave)
+        if mod is not None:
+            _modelos.move_to_end(chave)
+            return mod
+    mod = _analisar_modelo(template_bytes)
+    with _cache_lock:
+        _modelos[chave] = mod
+        while len(_modelos) > CACHE_MODELOS:
+            _modelos.popitem(last=False)
+    return mod
+
+
+def _styles_com_data(mod: dict) -> tuple[bytes, str] | None:
+    col_data = mod["layout"]["headers"].get("Data")
+    styles = next((d for info, d in mod["membros"] if info.filename == mod["partes"]["styles"]), None)
+    if col_data is None or styles is None:
+        return None
+    if mod["estilo_data"] is None:
+        mod["estilo_data"] = _estilo_data(styles, mod["modelo"][col_data - 1]["s"])
+    return mod["estilo_data"]
+
+
+def linhas_livres(template_bytes: bytes) -> int:
+    """Quantas linhas ainda cabem na aba LANCAMENTOS do modelo (limite do Excel)."""
+    return EXCEL_MAX_LINHAS - _modelo(template_bytes)["layout"]["next_row"] + 1
+
+
+def append_lancamentos(template_bytes: bytes, df: pd.DataFrame) -> bytes:
+    """Grava df na aba LANCAMENTOS do modelo (mesmo resultado do writer openpyxl) e devolve o .xlsx.
+    df maior do que cabe na aba (linhas_livres) levanta ValueError: use exportacao.particionar."""
+    mod = _modelo(template_bytes)
+    partes = mod["partes"]
+    livres = EXCEL_MAX_LINHAS - mod["layout"]["next_row"] + 1
+    if len(df) > livres:
+        raise ValueError(f"{len(df)} linhas não cabem na aba LANCAMENTOS (limite do Excel: {livres})")
+
+    styles, estilo_data = None, None
+    if len(df) and "Data" in df.columns:
+        styles, estilo_data = _styles_com_data(mod) or (None, None)
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zo:
+        for info, dados in mod["membros"]:
+            nome = info.filename
+            if nome == partes["sheet"]:
+                zi = zipfile.ZipInfo(nome, date_time=info.date_time)
+                zi.compress_type = zipfile.ZIP_DEFLATED
+                with zo.open(zi, "w", force_zip64=True) as w:
+                    _escrever_aba(w, mod, df, estilo_data)
+                continue
+            if nome == partes["styles"] and styles is not None:
+                dados = styles
+            zo.writestr(info, dados, compress_type=zipfile.ZIP_DEFLATED)
+    return out.getvalue()
+
+
+# -----------------------------
+# Writer openpyxl (modelo que o streaming não cobre: ModeloNaoSuportado)
+# -----------------------------
+def append_lancamentos_openpyxl(template_bytes: bytes, df: pd.DataFrame) -> bytes:
+    """
+    Abre o template e grava df na aba LANCAMENTOS, acrescentando linhas.
+
+    ✅ O que este writer garante:
+      - Encontra a linha correta de cabeçalhos mesmo que o layout mude (ex.: cabeçalho na linha 2).
+      - Escreve nos campos de entrada (Data, Numero, Item/Serviço, etc.).
+      - COPIA fórmulas/estilos da primeira linha-modelo de dados para todas as novas linhas,
+        para que "Base", "Valor IBS/CBS", validações e cálculos voltem a aparecer no Excel.
+    """
+    bio = io.BytesIO(template_bytes)
+    wb = load_workbook(bio)
+
+    ws = wb["LANCAMENTOS"] if "LANCAMENTOS" in wb.sheetnames else wb.active
+
+    # ------------------------------------------------------------
+    # 1) Descobre em qual linha estão os cabeçalhos (layout pode mudar)
+    # ------------------------------------------------------------
+    expected = EXPECTED_HEADERS
+    header_row = None
+
+    # procura nos primeiros 25 rows (suficiente pro seu layout)
+    for r in range(1, 26):
+        values = []
+        for c in range(1, 101):  # lê até 100 colunas (bem além do necessário)
+            v = ws.cell(row=r, column=c).value
+            if isinstance(v, str):
+                values.append(v.strip())
+        hit = len(expected.intersection(values))
+        if hit >= 3:  # achou linha com a maioria dos cabeçalhos
+            header_row = r
+            break
+
+    if header_row is None:
+        # fallback antigo (assume linha 1)
+        header_row = 1
+
+    # mapeia "nome do cabeçalho" -> coluna
+    headers: dict[str, int] = {}
+    last_col = 0
+    for col in range(1, 201):  # até 200 colunas
+        v = ws.cell(row=header_row, column=col).value
+        if isinstance(v, str) and v.strip():
+            headers[v.strip()] = col
+            last_col = max(last_col, col)
+
+    # se ainda não achou nada (planilha muito custom), tenta usar as colunas usadas do sheet
+    if last_col == 0:
+        last_col = min(ws.max_column, 200)
+
+    # ------------------------------------------------------------
+    # 2) Define a "linha modelo" (a primeira linha de dados com fórmulas)
+    #    No seu modelo: header_row=2, a linha 3 é seção, a 4 é a linha modelo.
+    # ------------------------------------------------------------
+    template_row = header_row + 2
+
+    # ------------------------------------------------------------
+    # 3) Descobre a próxima linha vazia olhando a coluna "Data"
+    # ------------------------------------------------------------
+    next_row = ws.max_row + 1
+    if "Data" in headers:
+        c = headers["Data"]
+        r = ws.max_row
+        while r >= (template_row) and ws.cell(row=r, column=c).value in (None, ""):
+            r -= 1
+        next_row = max(r + 1, template_row)
+
+    # ------------------------------------------------------------
+    # 4) Função para copiar estilo + fórmulas da linha modelo
+    # ------------------------------------------------------------
+    def _copy_row_style_and_formulas(src_row: int, dst_row: int):
+        for col in range(1, last_col + 1):
+            src = ws.cell(row=src_row, column=col)
+            dst = ws.cell(row=dst_row, column=col)
+
+            # estilos
+            dst.font = copy(src.font)
+            dst.fill = copy(src.fill)
+            dst.border = copy(src.border)
+            dst.alignment = copy(src.alignment)
+            dst.number_format = src.number_format
+            dst.protection = copy(src.protection)
+
+            # valor / fórmula
+            if isinstance(src.value, str) and src.value.startswith("="):
+                # traduz a referência da linha-modelo -> linha destino (ex.: G4 vira G7)
+                try:
+                    dst.value = Translator(src.value, origin=src.coordinate).translate_formula(dst.coordinate)
+                except Exception:
+                    dst.value = src.value
+            else:
+                dst.value = src.value
+
+
+    # ------------------------------------------------------------
+    # 5) Escreve as linhas: primeiro replica modelo, depois grava os valores de entrada
+    # ------------------------------------------------------------
+    fields = FIELDS
+
+    # colunas de entrada convertidas uma vez (listas Python, NaN -> None), sem iterrows
+    entradas = []
+    for f in fields:
+        if f not in headers:
+            continue
+        if f in df.columns:
+            valores = [None if nulo else v for v, nulo in zip(df[f].tolist(), pd.isna(df[f]).tolist())]
+        else:
+            valores = [None] * len(df)
+        entradas.append((f, headers[f], valores))
+
+    for i in range(len(df)):
+        # replica a linha modelo (fórmulas + visual)
+        _copy_row_style_and_formulas(template_row, next_row)
+
+        # agora sobrescreve somente os campos de ENTRADA
+        for f, col, valores in entradas:
+            val = valores[i]
+            cell = ws.cell(row=next_row, column=col)
+            cell.value = val
+
+            # datas
+            if f == "Data" and isinstance(val, date):
+                cell.number_format = "dd/mm/yyyy"
+
+        next_row += 1
+
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
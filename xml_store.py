@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Store dos XMLs das notas (botões "Baixar XML")
+- Em memória só os metadados de cada nota (Numero, Data, chave, src) e a ref do XML no upload
+  (archives.iter_xml_sources / read_xml): nenhum byte de XML fica guardado na sessão
+- Os bytes são lidos sob demanda, no clique do download (ler); XML de dentro de arquivo
+  compactado (reler um membro de .tar.gz é percorrer o arquivo) vai, comprimido com zlib, para
+  um diretório em disco endereçado pelo sha1 do conteúdo — o próximo clique lê de lá
+- Orçamento de disco por sessão (EXTRATOR_XML_STORE_MB, padrão 64): passou, sai o menos usado
+  (LRU); a nota continua baixável, relida do upload
+- Memória: a ref aponta para o próprio upload (UploadedFile), então o que segura os bytes em
+  memória são os arquivos que continuam no uploader — o Streamlit já os guarda inteiros enquanto
+  estão lá (cada um até server.maxUploadSize). Esse é o limite real: EXTRATOR_XML_STORE_MB só
+  limita as cópias em disco. Tirar o arquivo do uploader tira as notas dele (pop) e solta a ref
+- Diretório: um por processo, dentro de EXTRATOR_XML_STORE_DIR (padrão: pasta temporária do
+  sistema), apagado ao sair; o mesmo conteúdo em duas sessões é gravado uma vez só
+
+Sem dependência de Streamlit.
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+
+from archives import read_xml
+
+ORCAMENTO_BYTES = int(float(os.environ.get("EXTRATOR_XML_STORE_MB", "64")) * 1024 * 1024)
+BASE_DIR = os.environ.get("EXTRATOR_XML_STORE_DIR") or None  # None = tempfile.gettempdir()
+NIVEL_ZLIB = 1  # XML comprime bem mesmo no nível mais rápido
+
+_pasta: str | None = None
+_refs: dict[str, int] = {}  # sha1 -> nº de sessões com aquele conteúdo em disco
+_lock = threading.Lock()
+
+
+def _dir() -> str:
+    global _pasta
+    if _pasta is None:
+        _pasta = tempfile.mkdtemp(prefix="extrator_xml_store_", dir=BASE_DIR)
+        atexit.register(shutil.rmtree, _pasta, True)
+    return _pasta
+
+
+def _caminho(h: str) -> str:
+    return os.path.join(_dir(), h[:2], h + ".xml.z")
+
+
+def _gravar(h: str, comprimido: bytes) -> None:
+    """Conteúdo h passa a ter mais uma sessão; grava no disco se for o primeiro."""
+    with _lock:
+        n = _refs.get(h, 0)
+        if n == 0:
+            caminho = _caminho(h)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            tmp = f"{caminho}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(comprimido)
+            os.replace(tmp, caminho)
+        _refs[h] = n + 1
+
+
+def _soltar(h: str) -> None:
+    with _lock:
+        n = _refs.get(h, 0) - 1
+        if n > 0:
+            _refs[h] = n
+            return
+        _refs.pop(h, None)
+        try:
+            os.remove(_caminho(h))
+        except OSError:
+            pass
+
+
+def _soltar_todos(lru: "OrderedDict[str, int]") -> None:
+    # sessão encerrada (store coletado) sem remover as notas uma a uma
+    for h in list(lru):
+        _soltar(h)
+    lru.clear()
+
+
+class XmlStore:
+    """xml_store de uma sessão: sig -> metadados ({src, Numero, Data, chave, ref}).
+
+    Usa-se como o dict de antes (in, get, [], pop, items); os bytes saem de ler(sig).
+    """
+
+    def __init__(self, orcamento: int = ORCAMENTO_BYTES):
+        self.orcamento = orcamento
+        self._meta: dict[str, dict] = {}
+        self._conteudo: dict[str, str] = {}  # sig -> sha1 do XML gravado em disco
+        self._sigs: dict[str, set[str]] = {}  # sha1 -> sigs com aquele conteúdo
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # sha1 -> bytes comprimidos (LRU)
+        self.bytes_disco = 0
+        self._lock = threading.Lock()
+        weakref.finalize(self, _soltar_todos, self._lru)
+
+    def __contains__(self, sig) -> bool:
+        return sig in self._meta
+
+    def __getitem__(self, sig: str) -> dict:
+        return self._meta[sig]
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def get(self, sig, default=None):
+        return self._meta.get(sig, default)
+
+    def items(self):
+        return self._meta.items()
+
+    def put(self, sig: str, meta: dict, ref) -> None:
+        """Registra a nota; ref = (upload, nome, caminho até o membro) para read_xml."""
+        self._meta[sig] = {**meta, "ref": ref}
+
+    def pop(self, sig: str, default=None):
+        meta = self._meta.pop(sig, default)
+        with self._lock:
+            h = self._conteudo.pop(sig, None)
+            if h is not None:
+                sigs = self._sigs[h]
+                sigs.discard(sig)
+                if not sigs:
+                    self._descartar(h)
+        return meta
+
+    def _descartar(self, h: str) -> None:
+        # com self._lock
+        for s in self._sigs.pop(h, ()):
+            del self._conteudo[s]
+        self.bytes_disco -= self._lru.pop(h, 0)
+        _soltar(h)
+
+    def _do_disco(self, sig: str) -> bytes | None:
+        with self._lock:
+            h = self._conteudo.get(sig)
+            if h is None or h not in self._lru:
+                return None
+            self._lru.move_to_end(h)
+        try:
+            with open(_caminho(h), "rb") as fh:
+                return zlib.decompress(fh.read())
+        except (OSError, zlib.error):
+            return None
+
+    def _para_disco(self, sig: str, xml: bytes) -> None:
+        h = hashlib.sha1(xml).hexdigest()
+        with self._lock:
+            if h in self._lru:
+                self._conteudo[sig] = h
+                self._sigs[h].add(sig)
+                return
+        comprimido = zlib.compress(xml, NIVEL_ZLIB)
+        if len(comprimido) > self.orcamento:
+            return
+        try:
+            _gravar(h, comprimido)
+        except OSError:
+            return  # disco cheio/sem permissão: fica só a releitura do upload
+        with self._lock:
+            if sig not in self._meta or h in self._lru:
+                # nota saiu (ou outra thread gravou o mesmo conteúdo) enquanto gravava
+                _soltar(h)
+                if sig in self._meta:
+                    self._conteudo[sig] = h
+                    self._sigs[h].add(sig)
+                return
+            self._conteudo[sig] = h
+            self._sigs[h] = {sig}
+            self._lru[h] = len(comprimido)
+            self.bytes_disco += len(comprimido)
+            while self.bytes_disco > self.orcamento:
+                self._descartar(next(iter(self._lru)))
+
+    def ler(self, sig: str) -> bytes | None:
+        """Bytes do XML da nota (None se a nota saiu ou o upload não pode mais ser lido)."""
+        meta = self._meta.get(sig)
+        if meta is None:
+            return None
+        xml = self._do_disco(sig)
+        if xml is not None:
+            return xml
+        ref = meta["ref"]
+        try:
+            xml = read_xml(ref)
+        except Exception:
+            return None
+        if ref[2]:  # membro de arquivo compactado: próxima leitura sai do disco
+            self._para_disco(sig, xml)
+        return xml